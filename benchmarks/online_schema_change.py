@@ -0,0 +1,117 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Online schema change check against a real MySQL or MariaDB server.
+
+Fills a scratch table in the database of a saved profile, keeps writing to
+it from another connection while `online_alter` changes a column type with a
+shadow copy, and compares the rows of both connections afterwards.
+The scratch table is dropped at the end.
+
+Usage: python benchmarks/online_schema_change.py --profile <name> [--rows 200000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils.connect import connect_profile  # noqa: E402
+from src.utils.online import shadow_alter  # noqa: E402
+
+TABLE = "_adb_online_check"
+
+
+def writer(profile: str, stop: threading.Event, expected: dict, counts: dict) -> None:
+    "Insert, update and delete random rows until stopped, keeping `expected` in line with the table"
+    db = connect_profile(profile)
+    with db.cursor() as cursor:
+        while not stop.is_set():
+            action = random.random()
+            row_id = random.randint(1, counts["rows"])
+            if action < 0.4:
+                value = random.randint(0, 1000)
+                cursor.execute(f"INSERT INTO {TABLE} (value, note) VALUES (%s, 'inserted')", (value,))
+                expected[cursor.lastrowid] = value
+            elif action < 0.8:
+                cursor.execute(f"UPDATE {TABLE} SET value = value + 1, note = 'updated' WHERE id = %s", (row_id,))
+                if row_id in expected:
+                    expected[row_id] += 1
+            else:
+                cursor.execute(f"DELETE FROM {TABLE} WHERE id = %s", (row_id,))
+                expected.pop(row_id, None)
+            counts["writes"] += 1
+    db.connection.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", required=True, help="Saved connection profile of a scratch database")
+    parser.add_argument("--rows", type=int, default=200000)
+    args = parser.parse_args()
+
+    db = connect_profile(args.profile)
+    counts = {"rows": args.rows, "writes": 0}
+    expected = {}
+
+    with db.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cursor.execute(f"CREATE TABLE {TABLE} (id INT NOT NULL AUTO_INCREMENT, value INT NOT NULL, note VARCHAR(20) NULL, PRIMARY KEY (id)) ENGINE = InnoDB")
+        for start in range(0, args.rows, 5000):
+            values = [random.randint(0, 1000) for _ in range(min(5000, args.rows - start))]
+            cursor.execute(f"INSERT INTO {TABLE} (id, value) VALUES {','.join(['(%s, %s)'] * len(values))}", tuple(v for i, value in enumerate(values) for v in (start + i + 1, value)))
+            expected.update((start + i + 1, value) for i, value in enumerate(values))
+
+    stop = threading.Event()
+    thread = threading.Thread(target=writer, args=(args.profile, stop, expected, counts))
+    thread.start()
+
+    try:
+        start = time.perf_counter()
+        stats = shadow_alter(db, TABLE, "MODIFY COLUMN value BIGINT NOT NULL, RENAME COLUMN note TO remark", {"on_progress": lambda message: print(message, end="\r")})
+        elapsed = time.perf_counter() - start
+    finally:
+        stop.set()
+        thread.join()
+
+    with db.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*), SUM(value) FROM {TABLE}")
+        after = cursor.fetchone()
+        cursor.execute(f"SELECT DATA_TYPE FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = 'value'", (db.db_name, TABLE))
+        data_type = cursor.fetchone()[0]
+        cursor.execute(f"DROP TABLE {TABLE}")
+
+    print(f"\ncopied {stats['rows']:,} rows in {stats['chunks']} chunks, {elapsed:.2f}s ({stats['throttled']:.1f}s throttled)")
+    print(f"{counts['writes']:,} concurrent writes, {after[0]:,} rows after the swap, value column is now {data_type}")
+
+    if not data_type == "bigint":
+        print("FAIL: the column was not changed")
+        return 1
+
+    if not (after[0], int(after[1] or 0)) == (len(expected), sum(expected.values())):
+        print(f"FAIL: expected {len(expected):,} rows summing to {sum(expected.values()):,}, found {after[0]:,} summing to {int(after[1] or 0):,}")
+        return 1
+
+    print("ok")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
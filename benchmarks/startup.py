@@ -0,0 +1,124 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Startup budget check for the command line interface.
+
+Runs `--version` and `status` in a throwaway HOME (so `status` stops after the
+connection check) and fails when the time spent exceeds the budget, or when a
+heavy dependency gets imported on the way. `--version` is measured against a
+bare interpreter, `status` against an interpreter that only imports the CLI
+framework (typer and rich), which every command needs.
+
+Usage: python benchmarks/startup.py [--runs 10] [--version-budget 100] [--status-budget 150]
+Also collected by pytest, see test_startup.py
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#### Modules that must not be imported to answer these commands
+HEAVY_MODULES = ("alphadb", "mysql", "cryptography", "requests", "inquirer", "simpleUID")
+
+#### Allowed overhead in ms, over a bare interpreter (--version) and over importing the CLI framework (status)
+VERSION_BUDGET = 100
+STATUS_BUDGET = 150
+
+#### Cost of the CLI framework itself, not something this project can make lazy
+FRAMEWORK_IMPORTS = "import typer, rich.console"
+
+
+def timed_run(args: list, env: dict, cwd: str) -> float:
+    "Run a command and return its wall time in milliseconds"
+    start = time.perf_counter()
+    subprocess.run(args, env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+    return (time.perf_counter() - start) * 1000
+
+
+def median_run(args: list, env: dict, cwd: str, runs: int) -> float:
+    return statistics.median(timed_run(args, env, cwd) for _ in range(runs))
+
+
+def imported_heavy_modules(cli_args: list, env: dict, cwd: str) -> list:
+    "List heavy top-level modules imported while running the CLI"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-m", "src", *cli_args], env=env, cwd=cwd, capture_output=True, text=True, check=False)
+
+    found = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        module = line.rsplit("|", 1)[-1].strip().split(".")[0]
+        if module in HEAVY_MODULES:
+            found.add(module)
+
+    return sorted(found)
+
+
+def measure(runs: int = 10) -> dict:
+    "Overhead in ms and imported heavy modules of `--version` and `status`, each over its own baseline"
+    results = {}
+
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home, USERPROFILE=home, PYTHONPATH=ROOT)
+
+        #### Warm up the bytecode cache and create the config file
+        timed_run([sys.executable, "-m", "src", "status"], env, ROOT)
+        timed_run([sys.executable, "-c", FRAMEWORK_IMPORTS], env, ROOT)
+
+        baselines = {
+            "--version": median_run([sys.executable, "-c", "pass"], env, ROOT, runs),
+            "status": median_run([sys.executable, "-c", FRAMEWORK_IMPORTS], env, ROOT, runs),
+        }
+
+        for name in ("--version", "status"):
+            results[name] = {
+                "baseline": baselines[name],
+                "overhead": median_run([sys.executable, "-m", "src", name], env, ROOT, runs) - baselines[name],
+                "heavy": imported_heavy_modules([name], env, ROOT),
+            }
+
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--version-budget", type=float, default=VERSION_BUDGET, help="Allowed overhead in ms for --version, over a bare interpreter")
+    parser.add_argument("--status-budget", type=float, default=STATUS_BUDGET, help="Allowed overhead in ms for status, over importing typer and rich")
+    args = parser.parse_args()
+
+    failed = False
+    budgets = {"--version": args.version_budget, "status": args.status_budget}
+
+    for name, result in measure(args.runs).items():
+        verdict = "ok" if result["overhead"] <= budgets[name] and not result["heavy"] else "FAIL"
+        print(f"{name}: {result['overhead']:.1f} ms over {result['baseline']:.1f} ms baseline (budget {budgets[name]:.0f} ms) {verdict}")
+        if result["heavy"]:
+            print(f"  imported heavy modules: {', '.join(result['heavy'])}")
+
+        failed = failed or verdict == "FAIL"
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
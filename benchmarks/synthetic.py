@@ -0,0 +1,115 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Synthetic version sources for benchmarks.
+
+Generates a reproducible (seeded) version source with wide tables, a block
+of default data every `--data-every` versions, a new table every
+`--table-every` versions and added columns in between.
+
+Usage: python benchmarks/synthetic.py <output.json> [--versions 1000] [--columns 30] [--rows 100] [--seed 1]
+"""
+
+import argparse
+import json
+import random
+import sys
+
+#### Column types of the generated tables, cycled through
+COLUMN_TYPES = ("INT", "VARCHAR", "TEXT", "DECIMAL", "DATETIME")
+
+
+def version_id(i: int) -> str:
+    "Version number of the i-th version, ordered the way AlphaDB compares them (dots removed)"
+    return f"1.{i // 1000}.{i % 1000:03d}"
+
+
+def _column(kind: str, nullable: bool = False) -> dict:
+    column = {"type": kind}
+    if kind == "VARCHAR":
+        column["length"] = 100
+    if kind == "DECIMAL":
+        column["length"] = 12
+    if nullable:
+        column["null"] = True
+    return column
+
+
+def _value(kind: str, rng: random.Random):
+    if kind == "INT":
+        return rng.randint(-1000000, 1000000)
+    if kind == "DECIMAL":
+        return round(rng.uniform(-10000, 10000), 2)
+    if kind == "DATETIME":
+        return f"20{rng.randint(10, 29)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00"
+    return "".join(rng.choices("abcdefghijklmnopqrstuvwxyz ", k=rng.randint(5, 60 if kind == "TEXT" else 30)))
+
+
+def generate(versions: int, columns: int = 30, rows: int = 100, table_every: int = 50, data_every: int = 100, seed: int = 1, name: str = "benchmark") -> dict:
+    "Version source with `versions` versions"
+    rng = random.Random(seed)
+    tables = {}  ## Table name -> column types of the columns it was created with
+    source = []
+
+    for i in range(1, versions + 1):
+        version = {"_id": version_id(i)}
+
+        if len(tables) > 0 and i % data_every == 0:
+            table = rng.choice(list(tables))
+            kinds = tables[table]
+            version["default_data"] = {table: [{f"col{c}": _value(kind, rng) for c, kind in enumerate(kinds)} for _ in range(rows)]}
+
+        elif len(tables) == 0 or i % table_every == 0:
+            table = f"table{len(tables) + 1}"
+            kinds = [COLUMN_TYPES[c % len(COLUMN_TYPES)] for c in range(columns)]
+            tables[table] = kinds
+
+            definition = {"primary_key": "id", "id": {"type": "INT", "a_i": True}}
+            for c, kind in enumerate(kinds):
+                definition[f"col{c}"] = _column(kind, nullable=c % 3 == 0)
+            version["createtable"] = {table: definition}
+
+        else:
+            table = rng.choice(list(tables))
+            version["altertable"] = {table: {"addcolumn": {f"added{i}": _column(rng.choice(COLUMN_TYPES), nullable=True)}}}
+
+        source.append(version)
+
+    return {"name": name, "version": source}
+
+
+def write(path: str, versions: int, **options) -> None:
+    with open(path, "w") as f:
+        json.dump(generate(versions, **options), f)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output")
+    parser.add_argument("--versions", type=int, default=1000)
+    parser.add_argument("--columns", type=int, default=30, help="Columns of every created table")
+    parser.add_argument("--rows", type=int, default=100, help="Rows of every default data block")
+    parser.add_argument("--table-every", type=int, default=50)
+    parser.add_argument("--data-every", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    write(args.output, args.versions, columns=args.columns, rows=args.rows, table_every=args.table_every, data_every=args.data_every, seed=args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
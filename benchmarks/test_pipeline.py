@@ -0,0 +1,169 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mysql.connector.conversion import MySQLConverter
+from mysql.connector.errors import ProgrammingError
+
+from src.utils import journal as journal_module
+from src.utils.events import subscribed
+from src.utils.journal import JOURNAL_TABLE_NAME, Journal
+from src.utils.pipeline import pipeline_packets
+from src.utils.plan import execute_plan
+
+
+class FakeConnection:
+    "Runs nothing, but fails like the server protocol when a statement is sent while multi-statement results are unread"
+
+    converter = MySQLConverter("utf8mb4")
+    python_charset = "utf8"
+    sql_mode = ""
+    server_host = "fake"
+    server_port = 3306
+
+    def __init__(self, failing: str | None = None):
+        self.failing = failing
+        self.reading = False
+        self.statements = []  ## Every statement sent, packets split up
+
+    def send(self, statement: str) -> None:
+        if self.reading:
+            raise AssertionError(f"Commands out of sync, sent while reading a packet: {statement}")
+        self.statements.append(statement)
+
+
+class FakeCursor:
+    def __init__(self, connection: FakeConnection):
+        self.connection = connection
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+    def fetchall(self) -> list:
+        return []
+
+    def execute(self, query: str, params=None, multi: bool = False):
+        self.connection.send(query)
+        if not multi:
+            self.rowcount = 1
+            return None
+
+        self.connection.reading = True
+
+        def results():
+            try:
+                for statement in query.split(";\n"):
+                    if not self.connection.failing == None and self.connection.failing in statement:
+                        raise ProgrammingError(msg=f"Failed: {statement}")
+                    self.rowcount = 1
+                    yield self
+            finally:
+                self.connection.reading = False
+
+        return results()
+
+
+class FakeDB:
+    db_name = "fake"
+
+    def __init__(self, failing: str | None = None):
+        self.connection = FakeConnection(failing)
+
+    def cursor(self):
+        return FakeCursor(self.connection)
+
+
+def _step(version, table, method, query, params=None) -> dict:
+    return {"version": version, "squashed": [], "table": table, "method": method, "query": query, "params": params, "rows": None}
+
+
+@pytest.fixture
+def steps() -> list:
+    return [
+        _step(None, "adb_conf", "template", "UPDATE adb_conf SET template = %s WHERE db = %s", ("shop", "fake")),
+        _step("0.0.1", "a", "createtable", "CREATE TABLE a (id INT);"),
+        _step("0.0.1", "b", "createtable", "CREATE TABLE b (id INT);"),
+        _step("0.0.2", "a", "altertable", "ALTER TABLE a ADD c INT;"),
+        _step("0.0.2", "b", "altertable", "ALTER TABLE b ADD c INT;"),
+        _step("0.0.2", "adb_conf", "version", "UPDATE `adb_conf` SET version=%s WHERE `db` = %s", ("0.0.2", "fake")),
+    ]
+
+
+@pytest.fixture
+def journal_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal_module, "JOURNAL_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _run(db, steps, journal) -> list:
+    events = []
+    with subscribed(events.append):
+        try:
+            execute_plan(steps, db=db, journal=journal, pipeline=True)
+        except ProgrammingError:
+            pass
+    return events
+
+
+def _indexes(events: list, name: str) -> list:
+    return [event["index"] for event in events if event["event"] == name]
+
+
+def test_packets_per_version(steps):
+    assert pipeline_packets(steps) == {1: [1, 2], 3: [3, 4, 5]}
+
+
+def test_packets_leave_out_completed_steps(steps):
+    keys = [str(i) for i in range(len(steps))]
+    assert pipeline_packets(steps, keys, {"3"}) == {1: [1, 2], 4: [4, 5]}
+
+
+def test_pipelined_update(steps, journal_dir):
+    db = FakeDB()
+    events = _run(db, steps, Journal(db))
+
+    assert _indexes(events, "step_finished") == [0, 1, 2, 3, 4, 5]
+    assert _indexes(events, "step_failed") == []
+    assert [event for event in events if event["event"] == "pipeline_finished"][0]["packets"] == 2
+
+    #### The mirror of a version is written before the packet of the next is sent, never in between its results
+    mirrors = [i for i, statement in enumerate(db.connection.statements) if statement.startswith(f"INSERT IGNORE INTO `{JOURNAL_TABLE_NAME}`")]
+    packets = [i for i, statement in enumerate(db.connection.statements) if ";\n" in statement]
+    assert len(packets) == 2
+    assert len(mirrors) == 2
+    assert mirrors[0] < packets[0] < mirrors[1] < packets[1]
+
+
+def test_failing_statement_is_attributed(steps, journal_dir):
+    db = FakeDB(failing="ALTER TABLE b")
+    journal = Journal(db)
+    events = _run(db, steps, journal)
+
+    assert _indexes(events, "step_finished") == [0, 1, 2, 3]
+    assert _indexes(events, "step_failed") == [4]
+
+    failure = journal.failure()
+    assert (failure["version"], failure["table"], failure["method"]) == ("0.0.2", "b", "altertable")
+    assert sorted(entry["table"] for entry in journal.entries.values() if not entry["finished"] == None) == ["a", "a", "adb_conf", "b"]
@@ -0,0 +1,34 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from startup import STATUS_BUDGET, VERSION_BUDGET, measure
+
+
+@pytest.fixture(scope="module")
+def startup():
+    return measure(runs=7)
+
+
+@pytest.mark.parametrize("command, budget", [("--version", VERSION_BUDGET), ("status", STATUS_BUDGET)])
+def test_startup_budget(startup, command, budget):
+    result = startup[command]
+    assert result["overhead"] <= budget, f"{command} takes {result['overhead']:.0f} ms over its {result['baseline']:.0f} ms baseline"
+
+
+@pytest.mark.parametrize("command", ["--version", "status"])
+def test_no_heavy_imports(startup, command):
+    assert startup[command]["heavy"] == []
@@ -13,13 +13,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from src import __app_name__, cli
-from src.utils.decorators import config_check
-from src.utils.common import console, clear
+import sys
+import time
+
+STARTED = time.perf_counter()
+
+from src import __app_name__, __version__
+from src.utils import headless
 
 DEV = True
 
+#### Arguments that are answered without clearing the terminal
+CHEAP_ARGS = ("--version", "-V", "--help")
+
 def raise_error(e):
+    from src.utils.common import console
+
     if DEV: raise e
     else: 
         if hasattr(e, "msg"):
@@ -27,13 +36,66 @@ def raise_error(e):
         else:
             console.print(f"[white]{e}[/white]", style="white on red")
 
-@config_check
-def main():
-    clear()
+def run():
+    from src.utils.trace import span
+
+    with span("import cli", "startup"):
+        from src import cli
+        from src.utils.common import clear
+
+    if not any(arg in CHEAP_ARGS for arg in sys.argv[1:]):
+        clear()
+
+    if headless.enabled():
+        run_headless(cli)
+        return
+
     try:
         cli.app(prog_name=__app_name__)
     except Exception as e:
         raise_error(e)
 
+def run_headless(cli):
+    "Run the command, reporting its result (and errors) as events"
+    try:
+        cli.app(prog_name=__app_name__)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code == None else 1)
+        headless.finish(code)
+        sys.exit(code)
+    except Exception as e:
+        headless.finish(1, e)
+        sys.exit(1)
+
+def main():
+
+    #### Answer version requests before the CLI framework is imported
+    if sys.argv[1:] in (["--version"], ["-V"]):
+        print(f"{__app_name__} v{__version__}")
+        return
+
+    #### Headless mode is enabled before anything is printed, and is not forwarded since the daemon renders for a terminal
+    if headless.options(sys.argv[1:]):
+        headless.enable()
+
+    #### Hand the command to a running daemon, which has everything loaded already
+    from src.utils import daemon
+
+    if not headless.enabled() and daemon.forwardable(sys.argv[1:]):
+        code = daemon.forward(sys.argv[1:])
+        if not code == None:
+            sys.exit(code)
+
+    #### Tracing starts before the config is read, the --profile option of the CLI records the rest
+    from src.utils import trace
+
+    trace_path, python_profile_path = trace.options(sys.argv[1:])
+    if not trace_path == None:
+        trace.start(trace_path, python_profile_path, started=STARTED)
+
+    from src.utils.decorators import config_check
+
+    config_check(run)()
+
 if __name__ == "__main__":
     main()
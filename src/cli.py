@@ -9,7 +9,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Optional
+from typing import List, Optional
 import typer
 from src import __app_name__, __version__, commands
 
@@ -29,9 +29,171 @@ def update(
         False,
         "--no-data",
         help="Update only to the database structure, but do not include default data",
-    )
+    ),
+    offline: bool = typer.Option(
+        False,
+        "--offline",
+        envvar="ALPHADB_OFFLINE",
+        help="Use the locally cached copy of web version sources instead of contacting the server",
+    ),
+    plan: bool = typer.Option(
+        False,
+        "--plan",
+        help="Print the SQL that would be executed, without touching the database",
+    ),
+    squash: bool = typer.Option(
+        False,
+        "--squash",
+        help="Merge consecutive ALTER TABLE statements on the same table into one",
+    ),
+    batch_size: Optional[int] = typer.Option(
+        None,
+        "--batch-size",
+        min=1,
+        envvar="ALPHADB_BATCH_SIZE",
+        help="Number of default data rows per INSERT statement (1000)",
+    ),
+    infile: bool = typer.Option(
+        False,
+        "--load-infile",
+        help="Load default data through LOAD DATA LOCAL INFILE (requires local_infile on the server)",
+    ),
+    targets: Optional[str] = typer.Option(
+        None,
+        "--targets",
+        help="Update saved profiles instead of the connected database: 'all' or comma separated glob patterns",
+    ),
+    concurrency: Optional[int] = typer.Option(
+        None,
+        "--concurrency",
+        min=1,
+        help="Number of targets updated at the same time (8)",
+    ),
+    timeout: Optional[float] = typer.Option(
+        None,
+        "--timeout",
+        min=1,
+        help="Seconds a single target may take before it is marked as failed (600)",
+    ),
+    summary: Optional[str] = typer.Option(
+        None,
+        "--summary",
+        help="File to write the JSON summary of a fleet update to",
+    ),
+    source: Optional[str] = typer.Option(
+        None,
+        "--source",
+        envvar="ALPHADB_SOURCE",
+        help="Version source to use (a saved name, path or URL) instead of choosing one",
+    ),
+    online: bool = typer.Option(
+        False,
+        "--online",
+        help="Change tables without blocking writes, copying them to a shadow table when the server can't alter them in place",
+    ),
+    chunk_time: Optional[float] = typer.Option(
+        None,
+        "--chunk-time",
+        min=0.01,
+        help="Seconds each copied chunk should take with --online (0.5)",
+    ),
+    max_threads: Optional[int] = typer.Option(
+        None,
+        "--max-threads",
+        min=1,
+        help="Pause copying while more threads are running on the server (25)",
+    ),
+    max_lag: Optional[float] = typer.Option(
+        None,
+        "--max-lag",
+        min=0,
+        help="Pause copying while a replica lags behind more seconds (5)",
+    ),
+    replica: Optional[List[str]] = typer.Option(
+        None,
+        "--replica",
+        help="Saved profile of a replica to check the lag of, can be repeated",
+    ),
+    skip_validation: bool = typer.Option(
+        False,
+        "--skip-validation",
+        help="Do not check the version source before updating",
+    ),
+    resume: bool = typer.Option(
+        False,
+        "--resume",
+        help="Continue an interrupted update, skipping the statements it completed",
+    ),
+    jobs: Optional[int] = typer.Option(
+        None,
+        "--jobs",
+        min=1,
+        help="Number of connections applying changes to unrelated tables at the same time (1)",
+    ),
+    pipeline: bool = typer.Option(
+        False,
+        "--pipeline",
+        help="Send the statements of each version in multi-statement packets, saving a round trip per statement on distant servers",
+    ),
 ) -> None:
-    commands.update(nodata=nodata if not nodata == None else False)
+    options = None
+    if online:
+        options = {k: v for k, v in (("chunk_time", chunk_time), ("max_threads", max_threads), ("max_lag", max_lag), ("replicas", replica)) if not v == None}
+
+    if not targets == None:
+        if online:
+            raise typer.BadParameter("--online can not be combined with --targets")
+        if plan:
+            raise typer.BadParameter("--plan can not be combined with --targets")
+        if resume:
+            raise typer.BadParameter("--resume can not be combined with --targets")
+        if not jobs == None:
+            raise typer.BadParameter("--jobs can not be combined with --targets, use --concurrency")
+        if pipeline:
+            raise typer.BadParameter("--pipeline can not be combined with --targets")
+        if not commands.update_fleet(targets, nodata=nodata if not nodata == None else False, offline=offline, squash=squash, batch_size=batch_size, infile=infile, concurrency=concurrency, timeout=timeout, summary=summary, source=source, skip_validation=skip_validation):
+            raise typer.Exit(code=1)
+        return
+
+    if pipeline and not jobs == None and jobs > 1:
+        raise typer.BadParameter("--pipeline can not be combined with --jobs")
+
+    commands.update(nodata=nodata if not nodata == None else False, offline=offline, plan=plan, squash=squash, batch_size=batch_size, infile=infile, source=source, online=options, skip_validation=skip_validation, resume=resume, jobs=jobs, pipeline=pipeline)
+
+@app.command(help="List the versions that have not yet been applied to the database")
+def pending(
+    offline: bool = typer.Option(
+        False,
+        "--offline",
+        envvar="ALPHADB_OFFLINE",
+        help="Use the locally cached copy of web version sources instead of contacting the server",
+    ),
+    source: Optional[str] = typer.Option(
+        None,
+        "--source",
+        envvar="ALPHADB_SOURCE",
+        help="Version source to use (a saved name, path or URL) instead of choosing one",
+    ),
+) -> None:
+    commands.pending(offline=offline, source=source)
+
+@app.command(help="Check a version source for errors, without connecting to a database")
+def validate(
+    source: Optional[str] = typer.Option(
+        None,
+        "--source",
+        envvar="ALPHADB_SOURCE",
+        help="Version source to use (a saved name, path or URL) instead of choosing one",
+    ),
+    offline: bool = typer.Option(
+        False,
+        "--offline",
+        envvar="ALPHADB_OFFLINE",
+        help="Use the locally cached copy of web version sources instead of contacting the server",
+    ),
+) -> None:
+    if not commands.validate(source=source, offline=offline):
+        raise typer.Exit(code=1)
 
 @app.command(help="Irriversibally deletes ALL data in the database")
 def vacate(
@@ -39,13 +201,280 @@ def vacate(
         None,
         "--confirm",
         help="Needs to be specified. This is a safety feature. Only with this option specified the vacate function will be called",
-    )
+    ),
+    truncate_only: bool = typer.Option(
+        False,
+        "--truncate-only",
+        help="Keep the tables and only delete their rows, truncating tables concurrently",
+    ),
+    workers: Optional[int] = typer.Option(
+        None,
+        "--workers",
+        min=1,
+        help="Number of connections used by --truncate-only (4)",
+    ),
+    yes: bool = typer.Option(
+        False,
+        "--yes",
+        help="Skip the confirmation prompt, for scripted runs",
+    ),
+) -> None:
+    commands.vacate(confirm=confirm if not confirm == None else False, truncate_only=truncate_only, workers=workers, yes=yes)
+
+@app.command(help="Dump the database, with its template and version, to a directory of compressed chunk files")
+def dump(
+    output: Optional[str] = typer.Option(
+        None,
+        "--output",
+        "-o",
+        help="Directory to write the archive to (<database>-<version>-<time>)",
+    ),
+    workers: Optional[int] = typer.Option(
+        None,
+        "--workers",
+        min=1,
+        help="Number of connections dumping tables at the same time (4)",
+    ),
+    chunk_rows: Optional[int] = typer.Option(
+        None,
+        "--chunk-rows",
+        min=1,
+        help="Number of rows per chunk file (250000)",
+    ),
+) -> None:
+    if commands.dump(output=output, workers=workers, chunk_rows=chunk_rows) == False:
+        raise typer.Exit(code=1)
+
+@app.command(help="Restore an archive written by dump into the database")
+def restore(
+    archive: str = typer.Argument(
+        ...,
+        help="Directory of the archive",
+    ),
+    workers: Optional[int] = typer.Option(
+        None,
+        "--workers",
+        min=1,
+        help="Number of connections restoring tables at the same time (4)",
+    ),
+    batch_size: Optional[int] = typer.Option(
+        None,
+        "--batch-size",
+        min=1,
+        envvar="ALPHADB_BATCH_SIZE",
+        help="Number of rows per INSERT statement (1000)",
+    ),
+    infile: bool = typer.Option(
+        False,
+        "--load-infile",
+        help="Load the chunks through LOAD DATA LOCAL INFILE (requires local_infile on the server)",
+    ),
+    replace: bool = typer.Option(
+        False,
+        "--replace",
+        help="Drop the tables of the database before restoring",
+    ),
+    yes: bool = typer.Option(
+        False,
+        "--yes",
+        help="Skip the confirmation prompt of --replace, for scripted runs",
+    ),
 ) -> None:
-    commands.vacate(confirm=confirm if not confirm == None else False)
+    if commands.restore(archive, workers=workers, batch_size=batch_size, infile=infile, replace=replace, yes=yes) == False:
+        raise typer.Exit(code=1)
+
+@app.command(help="Fill the tables of the database with generated rows, following the schema of the version source")
+def seed(
+    rows: int = typer.Option(
+        ...,
+        "--rows",
+        min=1,
+        help="Number of rows inserted into every table",
+    ),
+    table: Optional[List[str]] = typer.Option(
+        None,
+        "--table",
+        help="Table to seed, can be repeated (all tables)",
+    ),
+    seed: int = typer.Option(
+        0,
+        "--seed",
+        help="Seed of the random generator, the same seed generates the same rows",
+    ),
+    workers: Optional[int] = typer.Option(
+        None,
+        "--workers",
+        min=1,
+        help="Number of connections inserting rows at the same time (4)",
+    ),
+    batch_size: Optional[int] = typer.Option(
+        None,
+        "--batch-size",
+        min=1,
+        envvar="ALPHADB_BATCH_SIZE",
+        help="Number of rows per INSERT statement (1000)",
+    ),
+    source: Optional[str] = typer.Option(
+        None,
+        "--source",
+        envvar="ALPHADB_SOURCE",
+        help="Version source to use (a saved name, path or URL) instead of choosing one",
+    ),
+    offline: bool = typer.Option(
+        False,
+        "--offline",
+        envvar="ALPHADB_OFFLINE",
+        help="Use the locally cached copy of web version sources instead of contacting the server",
+    ),
+) -> None:
+    if commands.seed(rows, tables=table or None, seed=seed, workers=workers, batch_size=batch_size, source=source, offline=offline) == False:
+        raise typer.Exit(code=1)
 
 @app.command(help="Connect to a new database")
-def connect() -> None:
-    commands.connect()
+def connect(
+    profile: Optional[str] = typer.Option(
+        None,
+        "--profile",
+        help="Save the database as a named profile (for update --targets) instead of connecting to it",
+    ),
+    host: Optional[str] = typer.Option(
+        None,
+        "--host",
+        envvar="ALPHADB_HOST",
+        help="Host of the MySQL server (localhost)",
+    ),
+    user: Optional[str] = typer.Option(
+        None,
+        "--user",
+        envvar="ALPHADB_USER",
+        help="User with permissions to alter the database",
+    ),
+    password: Optional[str] = typer.Option(
+        None,
+        "--password",
+        envvar="ALPHADB_PASSWORD",
+        help="Password of the user, prefer the environment variable over the option",
+    ),
+    database: Optional[str] = typer.Option(
+        None,
+        "--database",
+        envvar="ALPHADB_DATABASE",
+        help="Name of the database to connect to",
+    ),
+    port: Optional[int] = typer.Option(
+        None,
+        "--port",
+        envvar="ALPHADB_PORT",
+        help="Port of the MySQL server (3306)",
+    ),
+) -> None:
+    commands.connect(profile=profile, host=host, user=user, password=password, database=database, port=port)
+
+@app.command(help="Start an interactive shell that keeps the database connection open between commands")
+def shell() -> None:
+    commands.shell()
+
+@app.command(help="Compare the database schema with the schema described by the version source")
+def drift(
+    source: Optional[str] = typer.Option(
+        None,
+        "--source",
+        envvar="ALPHADB_SOURCE",
+        help="Version source to use (a saved name, path or URL) instead of choosing one",
+    ),
+    offline: bool = typer.Option(
+        False,
+        "--offline",
+        envvar="ALPHADB_OFFLINE",
+        help="Use the locally cached copy of web version sources instead of contacting the server",
+    ),
+    snapshot: Optional[str] = typer.Option(
+        None,
+        "--snapshot",
+        help="Compare with a schema snapshot saved earlier instead of the database",
+    ),
+    save: Optional[str] = typer.Option(
+        None,
+        "--save",
+        help="Save the schema of the database to this file, for later use with --snapshot",
+    ),
+) -> None:
+    if commands.drift(source=source, offline=offline, snapshot=snapshot, save=save) == False:
+        raise typer.Exit(code=1)
+
+daemon_app = typer.Typer(help="Background process answering commands, so repeated invocations skip the start-up work")
+app.add_typer(daemon_app, name="daemon")
+
+@daemon_app.command("start", help="Start the daemon")
+def daemon_start(
+    idle_timeout: Optional[float] = typer.Option(
+        None,
+        "--idle-timeout",
+        min=1,
+        help="Seconds without commands after which the daemon stops (900)",
+    ),
+    foreground: bool = typer.Option(
+        False,
+        "--foreground",
+        help="Run in the foreground instead of detaching",
+    ),
+) -> None:
+    commands.daemon_start(idle_timeout=idle_timeout, foreground=foreground)
+
+@daemon_app.command("stop", help="Stop the daemon")
+def daemon_stop() -> None:
+    commands.daemon_stop()
+
+@daemon_app.command("status", help="Show whether the daemon is running")
+def daemon_status() -> None:
+    commands.daemon_status()
+
+@app.command("compile", help="Compile a version source to a binary file that loads without parsing JSON, usable wherever a version source is")
+def compile_source(
+    source: str = typer.Argument(
+        ...,
+        help="Version source to compile (a saved name, path or URL)",
+    ),
+    output: Optional[str] = typer.Option(
+        None,
+        "--output",
+        "-o",
+        help="File to write the compiled version source to (the source file name with .adbc)",
+    ),
+    offline: bool = typer.Option(
+        False,
+        "--offline",
+        envvar="ALPHADB_OFFLINE",
+        help="Use the locally cached copy of web version sources instead of contacting the server",
+    ),
+) -> None:
+    if not commands.compile_source(source, output=output, offline=offline):
+        raise typer.Exit(code=1)
+
+sources_app = typer.Typer(help="Saved version sources")
+app.add_typer(sources_app, name="sources")
+
+@sources_app.command("refresh", help="Fetch all saved version sources concurrently and store their template, latest version and version count")
+def sources_refresh(
+    workers: Optional[int] = typer.Option(
+        None,
+        "--workers",
+        min=1,
+        help="Number of version sources fetched at the same time (8)",
+    ),
+    offline: bool = typer.Option(
+        False,
+        "--offline",
+        envvar="ALPHADB_OFFLINE",
+        help="Use the locally cached copy of web version sources instead of contacting the server",
+    ),
+) -> None:
+    if not commands.sources_refresh(workers=workers, offline=offline):
+        raise typer.Exit(code=1)
+
+@app.command(help="List saved connection profiles")
+def profiles() -> None:
+    commands.profiles()
 
 def version_callback(value: bool) -> None:
     if value:
@@ -55,6 +484,7 @@ def version_callback(value: bool) -> None:
 
 @app.callback()
 def main(
+    ctx: typer.Context,
     version: Optional[bool] = typer.Option(
         None,
         "--version",
@@ -62,6 +492,34 @@ def main(
         help="Show the application's version and exit.",
         callback=version_callback,
         is_eager=True,
-    )
+    ),
+    profile: Optional[str] = typer.Option(
+        None,
+        "--profile",
+        help="Write a timeline of the command to this file, in Chrome trace format (open it in Perfetto)",
+    ),
+    profile_python: Optional[str] = typer.Option(
+        None,
+        "--profile-python",
+        help="Write a cProfile dump of the Python side to this file (requires --profile)",
+    ),
+    headless: bool = typer.Option(
+        False,
+        "--headless",
+        envvar="ALPHADB_HEADLESS",
+        help="Write newline delimited JSON events to stdout instead of spinners and prompts, for CI. Inputs come from options and environment variables",
+    ),
 ) -> None:
-    return
+    if headless:
+        from src.utils import headless as headless_mode
+
+        #### Usually enabled before anything was printed, see __main__
+        headless_mode.enable()
+        headless_mode.command(ctx.invoked_subcommand)
+
+    if not profile == None:
+        from src.utils import trace
+
+        #### Usually started before the config was read, see __main__
+        trace.start(profile, profile_python)
+        ctx.call_on_close(trace.stop)
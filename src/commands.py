@@ -13,29 +13,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
+import time
+
+#### Heavy dependencies (alphadb, mysql, cryptography, requests, inquirer) are imported
+#### inside the commands that need them, so cheap invocations don't pay for them
 from src.utils.common import print_title
-from src.utils.connect import get_mysql_creds
-from alphadb import AlphaDB
-from alphadb.utils.exceptions import DBTemplateNoMatch, IncompleteVersionData, MissingVersionData, DBConfigIncomplete
-from mysql.connector import DatabaseError, InterfaceError
-from cryptography.fernet import Fernet
-from src.utils.config import config_get, config_write, config_get_items
-from src.utils.common import console, clear
+from src.utils.config import config_get, config_write
+from src.utils.common import console
 from src.utils.decorators import connection_check
-from src.utils.version_source import add_version_source
-from inquirer import List, prompt, Confirm
-from requests import get
-from requests.exceptions import ConnectionError, JSONDecodeError
-import json
-from src.utils import globals
-
-def connect():
+from src.utils.events import emit
+from src.utils import globals, headless
+
+def connect(profile=None, host=None, user=None, password=None, database=None, port=None):
     "Connect to a database"
+    from alphadb import AlphaDB
+    from cryptography.fernet import Fernet
+    from mysql.connector import DatabaseError, InterfaceError
+    from src.utils.connect import get_mysql_creds, profile_section
 
     print_title("connect")
         
     globals.db = AlphaDB()
-    creds = get_mysql_creds()
+    creds = get_mysql_creds(host=host, user=user, password=password, database=database, port=port)
 
     try:
         globals.db.connect(
@@ -55,8 +55,9 @@ def connect():
     f = Fernet(config_get("CONFIG", "secret"))
     pass_encrypted = f.encrypt(pass_bytes)
 
+    #### Named profiles are saved next to the active session, for fleet updates
     config_write({
-        "DB_SESSION": {
+        profile_section(profile): {
             "host": creds["host"],
             "user": creds["user"],
             "password": pass_encrypted,
@@ -65,11 +66,152 @@ def connect():
         }
     })
 
+    if not profile == None:
+        console.print(f'\n[green]Saved database[/green] [cyan]"{creds["database"]}"[/cyan] [green]as profile[/green] [cyan]{profile}[/cyan]\n')
+        return
+
     console.print(f'\n[green]Successfully connected to database:[/green] [cyan]"{creds["database"]}"[/cyan]\n')
 
 
     return
 
+def shell():
+    "Interactive shell keeping the database connection open between commands"
+    from src.utils.shell import run_shell
+
+    print_title("shell")
+    run_shell()
+
+def drift(source=None, offline=False, snapshot=None, save=None) -> bool | None:
+    "Compare the database schema with the schema the version source describes. Returns False when they differ"
+    from src.utils.schema import load_snapshot
+
+    print_title("drift")
+
+    if snapshot == None:
+        return _drift_live(source=source, offline=offline, save=save)
+
+    try:
+        live = load_snapshot(snapshot)
+    except (OSError, ValueError) as e:
+        console.print(f"[red]Unable to read snapshot {snapshot}: {e}[/red]\n")
+        return False
+
+    console.print(f"[cyan]Comparing with snapshot of[/cyan] {live['database']} [cyan]taken at[/cyan] {live['taken']}\n")
+    return _drift_report(live, source=source, offline=offline)
+
+@connection_check()
+def _drift_live(source=None, offline=False, save=None) -> bool | None:
+    from src.utils.schema import fetch_snapshot, save_snapshot
+
+    status = globals.db.status()
+    if status["init"] == False:
+        console.print(f"[yellow]Database [cyan]{status['name']}[/cyan] has not yet been initialized[/yellow]\n")
+        return None
+
+    with console.status("[cyan]Fetching the database schema[/cyan]", spinner="bouncingBall") as _:
+        live = fetch_snapshot(globals.db)
+        live["version"] = status["version"]
+
+    if not save == None:
+        save_snapshot(live, save)
+        console.print(f"[green]Snapshot saved to[/green] [cyan]{save}[/cyan]\n")
+
+    return _drift_report(live, source=source, offline=offline)
+
+def _drift_report(live, source=None, offline=False) -> bool | None:
+    from src.utils.exceptions import VersionSourceUnavailable
+    from src.utils.schema import compare, describe, replay
+    from src.utils.version_index import read_pending
+    from src.utils.version_source import select_version_source, version_source_file
+
+    #### Ask user to select version source
+    version_source_path = select_version_source(source)
+
+    #### If source path is None, user probably aborted
+    if version_source_path == None: return None
+
+    try:
+        version_source = read_pending(version_source_file(version_source_path, offline=offline), None)
+    except VersionSourceUnavailable as e:
+        console.print(f"[red]{e.msg}[/red]\n")
+        return False
+    except ValueError:
+        console.print("[red]The version source did not contain compatible data[/red]\n")
+        return False
+
+    differences = compare(replay(version_source, up_to=live["version"]), live["tables"])
+
+    if len(differences) == 0:
+        console.print(f"[green]No drift, the schema matches version[/green] [cyan]{live['version']}[/cyan]\n")
+        return True
+
+    console.print(f"[yellow]Found {len(differences)} difference{'s' if len(differences) > 1 else ''} with version[/yellow] [cyan]{live['version']}[/cyan]\n")
+    for difference in differences:
+        console.print(f" - {describe(difference)}", highlight=False)
+    print()
+
+    return False
+
+def daemon_start(idle_timeout=None, foreground=False):
+    "Start the background daemon"
+    from src.utils import daemon
+
+    if globals.SOCKET_PATH == None:
+        console.print("[red]The daemon requires unix domain sockets, which are not available on this platform[/red]\n")
+        return
+
+    status = daemon.daemon_status()
+    if not status == None:
+        console.print(f"[blue]The daemon is already running[/blue] [cyan](pid {status['pid']})[/cyan]\n")
+        return
+
+    idle_timeout = idle_timeout if not idle_timeout == None else daemon.DEFAULT_IDLE_TIMEOUT
+
+    if foreground:
+        console.print(f"[cyan]Listening on[/cyan] {globals.SOCKET_PATH}\n")
+
+    pid = daemon.start_daemon(idle_timeout=idle_timeout, foreground=foreground)
+
+    if not foreground:
+        console.print(f"[green]Daemon started[/green] [cyan](pid {pid})[/cyan], it stops after {idle_timeout:.0f} seconds without commands\n")
+
+def daemon_stop():
+    "Stop the background daemon"
+    from src.utils import daemon
+
+    if daemon.stop_daemon():
+        console.print("[green]Daemon stopped[/green]\n")
+    else:
+        console.print("[yellow]The daemon is not running[/yellow]\n")
+
+def daemon_status():
+    "Show whether the background daemon is running"
+    from src.utils import daemon
+
+    status = daemon.daemon_status()
+    if status == None:
+        console.print("[yellow]The daemon is not running[/yellow]\n")
+        return
+
+    console.print(f"[green]Running[/green] [cyan](pid {status['pid']})[/cyan], {status['requests']} commands answered, idle for {status['idle']:.0f} seconds\n")
+
+def profiles():
+    "List saved connection profiles"
+    from src.utils.connect import profile_names, profile_section
+
+    print_title("profiles")
+
+    names = profile_names()
+    if len(names) == 0:
+        console.print("[yellow]No profiles saved yet, add one with[/yellow] [cyan]connect --profile <name>[/cyan]\n")
+        return
+
+    for name in names:
+        conn = config_get(profile_section(name))
+        console.print(f'[cyan]{name}[/cyan] {conn["database"]} on {conn["host"]}:{conn["port"]}')
+    print()
+
 @connection_check()
 def init():
     "Initialize database"
@@ -92,6 +234,7 @@ def status():
     print_title("database status")
 
     check = globals.db.status()
+    emit("status", name=check["name"], template=check["template"], init=check["init"], version=check["version"])
 
     print(f'Database: {check["name"]}')
     print(f'Template: {check["template"]}')
@@ -103,12 +246,132 @@ def status():
 
     return
 
+def check_source(source_file) -> bool:
+    "Print the issues of a version source file, returns False when it has errors"
+    from src.utils.validate import describe, errors, validate_file
+
+    issues = validate_file(source_file)
+    emit("issues", issues=issues)
+    for issue in issues:
+        console.print(describe(issue), highlight=False)
+
+    if not len(errors(issues)) == 0:
+        console.print(f"\n[red]The version source contains {len(errors(issues))} error{'s' if len(errors(issues)) > 1 else ''}, nothing was changed[/red]\n")
+        return False
+
+    return True
+
+def validate(source=None, offline=False) -> bool:
+    "Check a version source without connecting to a database. Returns False when it has errors"
+    from src.utils.exceptions import VersionSourceUnavailable
+    from src.utils.version_source import select_version_source, version_source_file
+
+    print_title("validate")
+
+    #### Ask user to select version source
+    version_source_path = select_version_source(source)
+
+    #### If source path is None, user probably aborted
+    if version_source_path == None: return True
+
+    try:
+        with console.status("[cyan]Validating version source[/cyan]", spinner="bouncingBall") as _:
+            source_file = version_source_file(version_source_path, offline=offline)
+            valid = check_source(source_file)
+    except VersionSourceUnavailable as e:
+        console.print(f"[red]{e.msg}[/red]\n")
+        return False
+
+    if valid:
+        console.print("[green]The version source is valid[/green]\n")
+    return valid
+
+def compile_source(source, output=None, offline=False) -> bool:
+    "Compile a version source to the binary format. Returns False when it could not be compiled"
+    from src.utils.compiled import EXTENSION, compile_source
+    from src.utils.exceptions import VersionSourceUnavailable
+    from src.utils.version_source import is_web_source, select_version_source, version_source_file
+
+    print_title("compile")
+
+    version_source_path = select_version_source(source)
+
+    if output == None:
+        name = version_source_path.rstrip("/").split("/")[-1] if is_web_source(version_source_path) else version_source_path
+        output = os.path.splitext(name)[0] + EXTENSION
+
+    started = time.perf_counter()
+    try:
+        with console.status("[cyan]Compiling version source[/cyan]", spinner="bouncingBall") as _:
+            source_file = version_source_file(version_source_path, offline=offline)
+            if not check_source(source_file):
+                return False
+            result = compile_source(source_file, output)
+    except VersionSourceUnavailable as e:
+        console.print(f"[red]{e.msg}[/red]\n")
+        return False
+    except (OSError, ValueError) as e:
+        console.print(f"[red]The version source could not be compiled:[/red] {e}\n")
+        return False
+
+    console.print(
+        f"[green]Compiled {result['versions']} versions to[/green] [cyan]{output}[/cyan] ({result['source_size']:,} → {result['size']:,} bytes) in {time.perf_counter() - started:.2f}s\n",
+        highlight=False,
+    )
+    return True
+
+def sources_refresh(workers=None, offline=False) -> bool:
+    "Refresh the metadata of all saved version sources. Returns False when any of them failed"
+    from src.utils.config import config_get_items
+    from src.utils.sources import DEFAULT_WORKERS, refresh_sources
+
+    print_title("sources refresh")
+
+    sources = config_get_items("VERSION_SOURCES")
+    if len(sources) == 0:
+        console.print("[yellow]No version sources saved yet[/yellow]\n")
+        return True
+
+    started = time.perf_counter()
+    with console.status(f"[cyan]Refreshing {len(sources)} version sources[/cyan]", spinner="bouncingBall") as _:
+        results = refresh_sources(sources, workers=workers if not workers == None else DEFAULT_WORKERS, offline=offline)
+
+    failed = 0
+    for name, metadata in results.items():
+        if not metadata["error"] == None:
+            failed += 1
+            console.print(f"[red]{name}[/red] {metadata['error']}", highlight=False)
+            continue
+        stale = " [yellow](server unreachable, cached copy)[/yellow]" if metadata["stale"] else ""
+        console.print(f"[cyan]{name}[/cyan] {metadata['template']} [cyan]{metadata['latest']}[/cyan] ({metadata['versions']} versions){stale}", highlight=False)
+
+    console.print(f"\n[green]Refreshed {len(results) - failed} of {len(results)} version sources[/green] in {time.perf_counter() - started:.2f}s\n")
+    return failed == 0
+
 @connection_check()
-def update(nodata=False):
+def update(nodata=False, offline=False, plan=False, squash=False, batch_size=None, infile=False, source=None, online=None, skip_validation=False, resume=False, jobs=None, pipeline=False):
     "Update database"
+    from alphadb.utils.exceptions import DBTemplateNoMatch, IncompleteVersionData, MissingVersionData, DBConfigIncomplete
+    from mysql.connector import DatabaseError
+    from src.utils.bulk_load import DEFAULT_BATCH_SIZE, format_rate
+    from src.utils.events import subscribed
+    from src.utils.exceptions import OnlineChangeUnsupported, VersionSourceUnavailable
+    from src.utils.plan import build_plan, execute_plan, print_plan, squash_plan
+    from src.utils.journal import Journal, step_keys
+    from src.utils.progress import UpdateProgress
+    from src.utils.trace import span
+    from src.utils.version_index import read_pending
+    from src.utils.version_source import select_version_source, version_source_file
 
     print_title("update")
 
+    journal = None
+    pipelined = {}  ## Round trips of the packets, see pipeline.PipelineStats
+
+    def on_event(event):
+        if event["event"] == "pipeline_finished":
+            pipelined.update(event)
+
     #### Initialize loader
     with console.status("[cyan]Checking database[/cyan]", spinner="bouncingBall") as loader:
 
@@ -118,84 +381,377 @@ def update(nodata=False):
             console.print(f"[yellow]Database [cyan]{status['name']}[/cyan] has not yet been initialized[/yellow]\n")
             return
 
-    #### Check for version sources
-    version_sources = config_get_items("VERSION_SOURCES")
-    version_source_path = None
-
-    #### If no versions sources exist, ask to create one
-    if len(version_sources) == 0:
-        console.print("[cyan]You have no saved version sources, so let's find one.[/cyan]\n")
-        version_source_path = add_version_source()
-        print("\n")
     try:
         #### Ask user to select version source
-        if version_source_path == None:
-
-            choices = [f"{i[0]} ({'web' if i[1][0:4] == 'http' else 'file'})" for i in version_sources]
-            choices.append("+ New version source")
-            questions = [List("version_source", message=f"Fount {len(version_sources)} version sources, which one do you wish to use?", choices=choices)]
-
-            answers = prompt(questions)
-
-            #### If answers is None, user probably aborted
-            if answers == None: return
-
-            version_source = answers["version_source"]
+        version_source_path = select_version_source(source)
 
-            clear()
-
-            if version_source == "+ New version source":
-                version_source_path = add_version_source()
-            else:
-                version_source_path = config_get("VERSION_SOURCES")[version_source.split(" ")[0]]
-    
         #### If source path is None, user probably aborted
         if version_source_path == None: return
         
         with console.status("[cyan]Reading version source[/cyan]", spinner="bouncingBall") as loader:
 
-            #### Get version invormation from path
-            if version_source_path[0:4] == "http":
-                try:
-                    r = get(version_source_path)
-                    if not r.status_code == 200:
-                        console.print(f"[red]No version information was returned from the server, it instead responded with status {r.status_code}[/red]\n")
+            #### Get version invormation from path, web sources go through the local cache
+            #### Only versions newer than the database version are read, located through the version index
+            try:
+                source_file = version_source_file(version_source_path, offline=offline)
+
+                #### Check the whole source before any statement is sent, unchanged sources are answered from the cache
+                if not skip_validation:
+                    loader.update("[cyan]Validating version source[/cyan]")
+                    if not check_source(source_file):
                         return
 
+                version_information = read_pending(source_file, status["version"])
 
-                    version_information = r.json()
+            except VersionSourceUnavailable as e:
+                console.print(f"[red]{e.msg}[/red]\n")
+                return
 
-               #### TODO This connection error catch does not seem to work  
-                except ConnectionError:
-                    console.print("[red]Unable to establish connection[/red]\n")
-                    return
+            except ValueError:
+                console.print("[red]The version source did not contain compatible data[/red]\n")
+                return
 
-                except JSONDecodeError as e:
-                    console.print("[red]The supplied URL did not respond with compatible data[/red]\n")
-                    return
-            else:
-                with open(version_source_path) as version_json:
-                    version_information = json.load(version_json)
+            #### Compile the pending versions into statements
+            loader.update("[cyan]Planning updates[/cyan]")
+            with span("plan", versions=len(version_information.get("version", []))):
+                steps = build_plan(version_information, status, no_data=nodata)
+                alters = sum(1 for step in steps if step["method"] == "altertable")
+
+                if squash:
+                    steps = squash_plan(steps)
 
-            loader.update("[cyan]Running updates on the database[/cyan]")
+        #### An earlier update that was interrupted left a journal of the statements it completed
+        if not plan:
+            journal = Journal(globals.db)
 
-            update = globals.db.update(version_source=version_information, no_data=nodata)
+            if journal.unfinished:
+                if len(steps) == 0:
+                    journal.finish()  ## Interrupted after its last statement
 
-            if update:
-                if update == "up-to-date":
-                    console.print(f"[blue]Database is already the latest version [cyan]({status['version']})[/cyan][/blue]\n")
+                elif not resume:
+                    print_interrupted(journal)
                     return
 
-                console.print("[green]Database successfully updated to the latest version[/green]\n")
-            else:
-                console.print("[red]An error occured[/red]\n")
+                else:
+                    skipped = len(journal.completed() & set(step_keys(steps)))
+                    console.print(f"[cyan]Resuming the interrupted update, skipping {skipped} completed statement{'' if skipped == 1 else 's'}[/cyan]")
+
+        #### Progress of the updates is shown per version, with an ETA based on the timings of earlier updates
+        if not plan and not len(steps) == 0:
+            with UpdateProgress(steps, version_information["name"]) as progress, subscribed(on_event):
+
+                #### Copy progress of online schema changes replaces the running statement
+                if not online == None:
+                    online["on_progress"] = progress.note
+
+                execute_plan(
+                    steps,
+                    batch_size=batch_size if not batch_size == None else DEFAULT_BATCH_SIZE,
+                    infile=infile,
+                    on_load=lambda result: console.print(f"[green]Loaded[/green] {format_rate(result)}"),
+                    online=online,
+                    template=version_information["name"],
+                    journal=journal,
+                    jobs=jobs if not jobs == None else 1,
+                    pipeline=pipeline,
+                )
+
+        if len(steps) == 0:
+            console.print(f"[blue]Database is already the latest version [cyan]({status['version']})[/cyan][/blue]\n")
+            return
+
+        if squash:
+            console.print(f"[cyan]Squashed {alters} ALTER TABLE statements into {sum(1 for step in steps if step['method'] == 'altertable')}[/cyan]")
+
+        if pipelined:
+            console.print(f"[cyan]Sent {pipelined['statements']} statements in {pipelined['packets']} packet{'' if pipelined['packets'] == 1 else 's'}, saving {pipelined['saved']} round trip{'' if pipelined['saved'] == 1 else 's'}[/cyan]")
+
+        if plan:
+            print_plan(steps)
+            return
+
+        console.print("[green]Database successfully updated to the latest version[/green]\n")
 
     except (DBTemplateNoMatch, IncompleteVersionData, MissingVersionData, DBConfigIncomplete) as e:
         console.print(f"[red]{e}[/red]\n")
 
+    except OnlineChangeUnsupported as e:
+        console.print(f"[red]{e.msg}[/red]\n")
+
+    except DatabaseError as e:
+        console.print(f"[red]{e.msg}[/red]\n")
+
+        #### Statements sent together in a packet are still told apart
+        failure = None if journal == None else journal.failure()
+        if not failure == None:
+            console.print(f"Failed statement: [cyan]{failure['method']} {failure['table'] or ''}[/cyan] of version [cyan]{failure['version']}[/cyan]\n", highlight=False)
+
+        if not journal == None and not journal.failure() == None:
+            console.print("Fix the cause and run [cyan]update --resume[/cyan] to continue from the statement that failed\n")
+
+def print_interrupted(journal) -> None:
+    "Tell where an interrupted update stopped"
+    last, failure = journal.last_completed(), journal.failure()
+
+    console.print("[yellow]An earlier update of this database did not finish[/yellow]")
+    if not last == None:
+        console.print(f"Last completed statement: [cyan]{last['method']} {last['table'] or ''}[/cyan] of version [cyan]{last['version']}[/cyan] at {last['finished']}", highlight=False)
+    if not failure == None:
+        console.print(f"Failed statement: [cyan]{failure['method']} {failure['table'] or ''}[/cyan] of version [cyan]{failure['version']}[/cyan]: [red]{failure['error']}[/red]", highlight=False)
+    console.print("\nRun [cyan]update --resume[/cyan] to continue without repeating the completed statements\n")
+
+def update_fleet(targets, nodata=False, offline=False, squash=False, batch_size=None, infile=False, concurrency=None, timeout=None, summary=None, source=None, skip_validation=False) -> bool:
+    "Update many saved profiles at once. Returns False when any of them failed"
+    from src.utils.exceptions import VersionSourceUnavailable
+    from src.utils.fleet import DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT, match_targets, run_fleet, write_summary
+    from src.utils.version_source import select_version_source, version_source_file
+
+    print_title("fleet update")
+
+    names = match_targets(targets)
+    if len(names) == 0:
+        console.print(f"[yellow]No saved profiles match[/yellow] [cyan]{targets}[/cyan]\n")
+        return False
+
+    console.print(f"[cyan]Updating {len(names)} target{'s' if len(names) > 1 else ''}[/cyan]\n")
+
+    #### Ask user to select version source
+    version_source_path = select_version_source(source)
+
+    #### If source path is None, user probably aborted
+    if version_source_path == None: return True
+
+    try:
+        source_file = version_source_file(version_source_path, offline=offline)
+    except VersionSourceUnavailable as e:
+        console.print(f"[red]{e.msg}[/red]\n")
+        return False
+
+    #### Validated once for all targets
+    if not skip_validation and not check_source(source_file):
+        return False
+
+    results = run_fleet(
+        names,
+        source_file,
+        concurrency=concurrency if not concurrency == None else DEFAULT_CONCURRENCY,
+        timeout=timeout if not timeout == None else DEFAULT_TIMEOUT,
+        no_data=nodata,
+        squash=squash,
+        batch_size=batch_size,
+        infile=infile,
+    )
+
+    for result in results:
+        if result["status"] == "failed":
+            console.print(f"[red]{result['target']}:[/red] {result['error']}")
+
+    counts = {status: sum(1 for result in results if result["status"] == status) for status in ("updated", "up-to-date", "failed")}
+    console.print(f"\n[green]{counts['updated']} updated[/green], [blue]{counts['up-to-date']} up to date[/blue], [red]{counts['failed']} failed[/red]")
+    console.print(f"Summary written to [cyan]{write_summary(results, version_source_path, summary)}[/cyan]\n")
+
+    return counts["failed"] == 0
+
 @connection_check()
-def vacate(confirm=False):
+def pending(offline=False, source=None):
+    "List versions that have not yet been applied"
+    from src.utils.exceptions import VersionSourceUnavailable
+    from src.utils.version_index import pending_ids
+    from src.utils.version_source import select_version_source, version_source_file
+
+    print_title("pending")
+
+    status = globals.db.status()
+    if status["init"] == False:
+        console.print(f"[yellow]Database [cyan]{status['name']}[/cyan] has not yet been initialized[/yellow]\n")
+        return
+
+    version_source_path = select_version_source(source)
+
+    #### If source path is None, user probably aborted
+    if version_source_path == None: return
+
+    try:
+        ids = pending_ids(version_source_file(version_source_path, offline=offline), status["version"])
+
+    except VersionSourceUnavailable as e:
+        console.print(f"[red]{e.msg}[/red]\n")
+        return
+
+    except ValueError:
+        console.print("[red]The version source did not contain compatible data[/red]\n")
+        return
+
+    emit("pending", version=status["version"], versions=ids)
+
+    if len(ids) == 0:
+        console.print(f"[blue]Database is already the latest version [cyan]({status['version']})[/cyan][/blue]\n")
+        return
+
+    console.print(f"[cyan]{len(ids)} pending version{'s' if len(ids) > 1 else ''}[/cyan] (database is at version {status['version']})\n")
+    print("\n".join(ids) + "\n")
+
+    return
+
+@connection_check()
+def dump(output=None, workers=None, chunk_rows=None) -> bool:
+    "Dump the database to an archive of compressed chunk files. Returns False when it failed"
+    from datetime import datetime
+    from mysql.connector import Error
+    from src.utils.dump import CHUNK_ROWS, DEFAULT_WORKERS, dump_database
+
+    print_title("dump")
+
+    status = globals.db.status()
+    if output == None:
+        output = f"{globals.db.db_name}-{status['version'] or 'uninitialized'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+
+    def on_table(table):
+        rate = table["rows"] / table["seconds"] if table["seconds"] > 0 else float(table["rows"])
+        console.print(
+            f"Dumped {table['rows']:,} rows from [cyan]{table['name']}[/cyan] in {table['seconds']:.2f}s ({rate:,.0f} rows/s, {len(table['chunks'])} chunks, {table['bytes'] / 1e6:,.1f} MB)",
+            highlight=False,
+        )
+
+    start = time.perf_counter()
+    try:
+        with console.status(f"[cyan]Dumping {globals.db.db_name}[/cyan]", spinner="bouncingBall") as _:
+            manifest = dump_database(globals.db, output, workers=workers if not workers == None else DEFAULT_WORKERS, chunk_rows=chunk_rows if not chunk_rows == None else CHUNK_ROWS, on_table=on_table)
+    except (Error, OSError, ValueError) as e:
+        console.print(f"\n[red]The dump failed:[/red] {getattr(e, 'msg', None) or e}\n")
+        return False
+
+    if not manifest["consistent"]:
+        console.print("\n[yellow]Reading the tables at the same moment requires the RELOAD privilege, their snapshots may differ by the time it took to start them[/yellow]")
+
+    rows = sum(table["rows"] for table in manifest["tables"])
+    console.print(
+        f"\n[green]Dumped {len(manifest['tables'])} tables ({rows:,} rows)[/green] of template [cyan]{manifest['template']}[/cyan] version [cyan]{manifest['version']}[/cyan] to [cyan]{output}[/cyan] in {time.perf_counter() - start:.2f}s\n",
+        highlight=False,
+    )
+    return True
+
+@connection_check()
+def restore(archive, workers=None, batch_size=None, infile=False, replace=False, yes=False) -> bool:
+    "Restore an archive written by dump into the database. Returns False when it failed"
+    from inquirer import Confirm, prompt
+    from mysql.connector import Error
+    from src.utils.bulk_load import DEFAULT_BATCH_SIZE, format_rate
+    from src.utils.dump import DEFAULT_WORKERS, read_manifest, restore_database
+    from src.utils.exceptions import ArchiveUnreadable
+    from src.utils.vacate import drop_all, list_tables
+
+    print_title("restore")
+
+    try:
+        manifest = read_manifest(archive)
+    except ArchiveUnreadable as e:
+        console.print(f"[red]{e.msg}[/red]\n")
+        return False
+
+    rows = sum(table["rows"] for table in manifest["tables"])
+    console.print(f"Archive of [cyan]{manifest['database']}[/cyan], template [cyan]{manifest['template']}[/cyan] version [cyan]{manifest['version']}[/cyan] ({len(manifest['tables'])} tables, {rows:,} rows, {manifest['created']})\n", highlight=False)
+
+    tables = list_tables(globals.db)
+    if len(tables) > 0:
+        if not replace:
+            console.print(f"[red]The database has {len(tables)} tables.[/red] Restore into an empty database, or pass [cyan]--replace[/cyan] to drop them first.\n")
+            return False
+
+        #### Prompt user for confirmation, unless it was given up front
+        if not yes:
+            headless.require("--yes")
+            answers = prompt([Confirm("confirm", message=f"Drop all {len(tables)} tables of {globals.db.db_name} before restoring?")])
+            if answers == None or not answers["confirm"]:
+                console.print("[cyan]Not restoring[/cyan]\n")
+                return True
+
+        drop_all(globals.db, tables)
+
+    start = time.perf_counter()
+    try:
+        with console.status(f"[cyan]Restoring {len(manifest['tables'])} tables[/cyan]", spinner="bouncingBall") as _:
+            restore_database(
+                archive,
+                workers=workers if not workers == None else DEFAULT_WORKERS,
+                batch_size=batch_size if not batch_size == None else DEFAULT_BATCH_SIZE,
+                infile=infile,
+                on_table=lambda result: console.print(f"[green]Restored[/green] {format_rate(result)}", highlight=False),
+            )
+    except (Error, OSError, ValueError) as e:
+        console.print(f"\n[red]The restore failed:[/red] {getattr(e, 'msg', None) or e}\n")
+        return False
+
+    console.print(f"\n[green]Restored template [cyan]{manifest['template']}[/cyan] version [cyan]{manifest['version']}[/cyan][/green] ({rows:,} rows) in {time.perf_counter() - start:.2f}s\n", highlight=False)
+    return True
+
+@connection_check()
+def seed(rows, tables=None, seed=0, workers=None, batch_size=None, source=None, offline=False) -> bool | None:
+    "Fill the tables of the database with generated rows. Returns False when it failed"
+    from mysql.connector import Error
+    from src.utils.bulk_load import DEFAULT_BATCH_SIZE, format_rate
+    from src.utils.exceptions import VersionSourceUnavailable
+    from src.utils.schema import replay
+    from src.utils.seed import DEFAULT_WORKERS, seed_database
+    from src.utils.version_index import read_source
+    from src.utils.version_source import select_version_source, version_source_file
+
+    print_title("seed")
+
+    status = globals.db.status()
+    if status["init"] == False:
+        console.print(f"[yellow]Database [cyan]{status['name']}[/cyan] has not yet been initialized[/yellow]\n")
+        return
+
+    #### Ask user to select version source
+    version_source_path = select_version_source(source)
+
+    #### If source path is None, user probably aborted
+    if version_source_path == None: return
+
+    try:
+        with console.status("[cyan]Reading the schema from the version source[/cyan]", spinner="bouncingBall") as _:
+            schema = replay(read_source(version_source_file(version_source_path, offline=offline)), up_to=status["version"])
+    except VersionSourceUnavailable as e:
+        console.print(f"[red]{e.msg}[/red]\n")
+        return False
+
+    if not tables == None:
+        unknown = [table for table in tables if not table in schema]
+        if len(unknown) > 0:
+            console.print(f"[red]The version source has no table {', '.join(unknown)} at version {status['version']}[/red]\n")
+            return False
+        schema = {name: table for name, table in schema.items() if name in tables}
+
+    console.print(f"Seeding {len(schema)} tables of [cyan]{globals.db.db_name}[/cyan] with {rows:,} rows each (seed {seed})\n", highlight=False)
+
+    start = time.perf_counter()
+    try:
+        with console.status("[cyan]Generating rows[/cyan]", spinner="bouncingBall") as _:
+            results = seed_database(
+                globals.db,
+                schema,
+                rows,
+                seed=seed,
+                workers=workers if not workers == None else DEFAULT_WORKERS,
+                batch_size=batch_size if not batch_size == None else DEFAULT_BATCH_SIZE,
+                on_table=lambda result: console.print(f"[green]Seeded[/green] {format_rate(result)}", highlight=False),
+            )
+    except (Error, ValueError) as e:
+        console.print(f"\n[red]Seeding failed:[/red] {getattr(e, 'msg', None) or e}\n")
+        return False
+
+    seconds = time.perf_counter() - start
+    total = sum(result["rows"] for result in results)
+    console.print(f"\n[green]Inserted {total:,} rows[/green] in {seconds:.2f}s ({total / seconds if seconds > 0 else total:,.0f} rows/s)\n", highlight=False)
+    return True
+
+@connection_check()
+def vacate(confirm=False, truncate_only=False, workers=None, yes=False):
     "Empty database"
+    from inquirer import Confirm, prompt
+    from src.utils.vacate import DEFAULT_WORKERS, drop_all, list_tables, truncate_all
+
     print_title("vacate")
     
     #### Only works when confirm==True is specified
@@ -204,22 +760,59 @@ def vacate(confirm=False):
         print("This is a safety feature that hopefully prevents unintended data loss.\n\nDon't worry, you'll still be prompted for confirmation!\n")
         return
 
-    console.print(f"[yellow]The vacate function[/yellow] [red]deletes all data in the database[/red].")
+    if truncate_only:
+        console.print(f"[yellow]The vacate function[/yellow] [red]deletes all rows of every table in the database[/red][yellow], the tables are kept.[/yellow]")
+    else:
+        console.print(f"[yellow]The vacate function[/yellow] [red]deletes all data in the database[/red].")
     console.print("[yellow]This action can [red]NOT[/red] be undone.[/yellow]\n")
     
-    #### Prompt user for confirmation
-    questions = [Confirm("confirm", message="Are you absolutely sure you want to completely delete all data?")]
-    answers = prompt(questions)
+    #### Prompt user for confirmation, unless it was given up front
+    if not yes:
+        headless.require("--yes")
+        questions = [Confirm("confirm", message="Are you absolutely sure you want to completely delete all data?")]
+        answers = prompt(questions)
 
-    #### If answers is None, user likely aborted
-    if answers == None: return
+        #### If answers is None, user likely aborted
+        if answers == None: return
 
-    if answers["confirm"]:
-        with console.status("[cyan]Removing all data from database[/cyan]", spinner="bouncingBall") as _:
+        if not answers["confirm"]:
+            console.print("[cyan]Not empying[/cyan]\n")
+            return
 
-            #### Empty db
-            if globals.db.vacate(confirm=confirm):
-                console.print("[green]The database had successfully been emptied.[/green]\n")
-    else:
-        console.print("[cyan]Not empying[/cyan]\n")
+    tables = list_tables(globals.db)
+
+    if truncate_only:
+        from alphadb.utils.globals import CONFIG_TABLE_NAME
+
+        #### The AlphaDB config table holds the version, truncating it would uninitialize the database
+        tables = [table for table in tables if not table == CONFIG_TABLE_NAME]
+        start = time.perf_counter()
+
+        with console.status(f"[cyan]Truncating {len(tables)} tables[/cyan]", spinner="bouncingBall") as _:
+            results = truncate_all(
+                tables,
+                workers=workers if not workers == None else DEFAULT_WORKERS,
+                on_table=lambda timing: console.print(
+                    f"[red]Failed to truncate[/red] [cyan]{timing['table']}[/cyan]: {timing['error']}" if timing["error"] else f"Truncated [cyan]{timing['table']}[/cyan] in {timing['seconds'] * 1000:.0f} ms",
+                    highlight=False,
+                ),
+            )
+
+        failed = [timing for timing in results if timing["error"]]
+        if failed:
+            console.print(f"\n[red]{len(failed)} of {len(tables)} tables could not be truncated[/red]\n")
+            return
+
+        console.print(f"\n[green]Truncated {len(tables)} tables in {time.perf_counter() - start:.2f}s[/green]\n")
+        return
+
+    with console.status(f"[cyan]Dropping {len(tables)} tables[/cyan]", spinner="bouncingBall") as _:
+        seconds = drop_all(globals.db, tables)
+
+        #### An interrupted update can't be resumed on an empty database
+        from src.utils.journal import Journal
+
+        Journal(globals.db).finish()
+
+    console.print(f"[green]The database had successfully been emptied[/green], dropped {len(tables)} tables in a single statement in {seconds:.2f}s\n")
     return
@@ -0,0 +1,134 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+import time
+from typing import Iterator, TypedDict
+
+#### Rows per multi-row INSERT
+DEFAULT_BATCH_SIZE = 1000
+
+
+class LoadResult(TypedDict):
+    table: str
+    rows: int
+    statements: int  ## Round trips used to load the rows
+    seconds: float
+
+
+def _value(value):
+    "Convert a default data value the way AlphaDB writes it into its queries"
+    if type(value) is dict:
+        return json.dumps(value)
+    if type(value) is bool:
+        return 1 if value else 0
+    if type(value) in (int, float, str):
+        return value
+    return str(value)
+
+
+def row_groups(items: list) -> Iterator[tuple[tuple, list]]:
+    """
+    Group consecutive rows by the columns they set.
+    Like AlphaDB, columns with a None value are left out, so the database fills in their default.
+    """
+    columns, rows = None, []
+
+    for item in items:
+        item_columns = tuple(key for key in item if not item[key] == None)
+
+        if not item_columns == columns and rows:
+            yield columns, rows
+            rows = []
+
+        columns = item_columns
+        rows.append(tuple(_value(item[key]) for key in item_columns))
+
+    if rows:
+        yield columns, rows
+
+
+def insert_batches(table_name: str, items: list, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[tuple[str, tuple]]:
+    "Yield (query, params) multi-row INSERTs of at most `batch_size` rows"
+    for columns, rows in row_groups(items):
+        column_list = ",".join(columns)
+        placeholders = "(" + ",".join(["%s"] * len(columns)) + ")"
+
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i : i + batch_size]
+            params = tuple(value for row in batch for value in row)
+            yield f"INSERT INTO `{table_name}` ({column_list}) VALUES {','.join([placeholders] * len(batch))};", params
+
+
+def _infile_field(value) -> str:
+    "Escape a value for LOAD DATA with the default field and line terminators"
+    if type(value) is float:
+        value = repr(value)
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r").replace("\0", "\\0")
+
+
+def _load_infile(cursor, table_name: str, columns: tuple, rows: list) -> None:
+    "Stream the rows into a temporary tab separated file and load it in a single statement"
+    fd, path = tempfile.mkstemp(prefix="alphadb-", suffix=".tsv")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="\n") as f:
+            for row in rows:
+                f.write("\t".join(_infile_field(value) for value in row))
+                f.write("\n")
+
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE `{table_name}` CHARACTER SET utf8mb4 ({','.join(columns)});",
+            (path,),
+        )
+    finally:
+        os.unlink(path)
+
+
+def load_table(connection, table_name: str, items: list, batch_size: int = DEFAULT_BATCH_SIZE, infile: bool = False) -> LoadResult:
+    """
+    Insert the default data of a table inside a single transaction.
+    With `infile`, every group of rows is sent through LOAD DATA LOCAL INFILE, which requires a connection opened with `allow_local_infile`.
+    """
+    start = time.perf_counter()
+    statements = 0
+
+    connection.start_transaction()
+    try:
+        with connection.cursor() as cursor:
+            if infile:
+                for columns, rows in row_groups(items):
+                    if len(columns) == 0:
+                        cursor.execute(f"INSERT INTO `{table_name}` () VALUES {','.join(['()'] * len(rows))};")  ## Only defaults, nothing to put in a file
+                    else:
+                        _load_infile(cursor, table_name, columns, rows)
+                    statements += 1
+            else:
+                for query, params in insert_batches(table_name, items, batch_size):
+                    cursor.execute(query, params)
+                    statements += 1
+
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+    return {"table": table_name, "rows": len(items), "statements": statements, "seconds": time.perf_counter() - start}
+
+
+def format_rate(result: LoadResult) -> str:
+    rate = result["rows"] / result["seconds"] if result["seconds"] > 0 else float(result["rows"])
+    return f"{result['rows']:,} rows into [cyan]{result['table']}[/cyan] in {result['seconds']:.2f}s ({rate:,.0f} rows/s, {result['statements']} statements)"
@@ -13,23 +13,38 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import os
 from src.utils.config import config_get
 from rich.console import Console
-console = Console()
+
+from src.utils import headless
+
+
+class _Console(Console):
+    "Console whose status spinners are reported as phases in headless mode, without starting a refresh thread"
+
+    def status(self, status, **kwargs):
+        if headless.enabled():
+            return headless.phase(status)
+        return super().status(status, **kwargs)
+
+
+console = _Console()
 
 "Prints out the programs title"
 def print_title(title:str):
+    if headless.enabled():  ## The command_started event is written instead
+        return
     console.print(f"[green]----- [white]{title.upper()}[/white] -----[/green]\n")
 
 "Clear the terminal"
 def clear():
 
-    #### Clear terminal
-    if os.name == "posix":
-        os.system("clear")
-    else:
-        os.system("cls")
+    #### Scripted runs (pipes, CI logs) are not cleared
+    if not console.is_terminal:
+        return
+
+    #### Clear terminal using escape codes instead of spawning `clear`/`cls`
+    console.clear()
 
     db_session_data = config_get("DB_SESSION", fallback=True)
     if not db_session_data == None:
@@ -0,0 +1,147 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+#### Compiled version sources, written by `compile` and read in place of the JSON they were compiled from. Layout (little endian):
+#### magic (8 bytes), format (u16), version count (u32), header size (u32)
+#### header: msgpack map with the root level values, the version `_id`s and numbers, and the sha256 of the JSON source
+#### version table: offset (u64) of every version payload in document order, followed by the end of the last payload
+#### payloads: every version as a msgpack map
+MAGIC = b"ADBCSRC\x00"
+
+#### Bump when the layout changes, older artifacts have to be compiled again
+COMPILED_FORMAT = 1
+
+EXTENSION = ".adbc"
+
+_PREAMBLE = struct.Struct("<8sHII")
+_OFFSET = struct.Struct("<Q")
+
+
+class _Spans:
+    "[start, end] of every payload, looked up in the version table when accessed"
+
+    def __init__(self, offsets: array):
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> list:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return [self.offsets[i], self.offsets[i + 1]]
+
+
+def is_compiled(path: str) -> bool:
+    "Whether the file is a compiled version source, from its magic bytes"
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IsADirectoryError:
+        return False
+
+
+def read_header(path: str) -> dict:
+    """
+    Header of a compiled version source, without reading any version.
+    Returns the root level values (`header`), `has_versions`, `ids`, `numbers`, `spans` ([start, end] of every payload) and `sha256`.
+    """
+    import msgpack
+
+    with open(path, "rb") as f:
+        try:
+            magic, version, count, header_size = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        except struct.error:
+            raise ValueError("Not a compiled version source")
+        if not magic == MAGIC:
+            raise ValueError("Not a compiled version source")
+        if not version == COMPILED_FORMAT:
+            raise ValueError(f"Compiled with an unsupported format ({version}), compile the version source again")
+
+        header = msgpack.unpackb(f.read(header_size), raw=False)
+        table = f.read(_OFFSET.size * (count + 1))
+        if not len(table) == _OFFSET.size * (count + 1):
+            raise ValueError("The compiled version source is truncated")
+
+    offsets = array("Q", table)
+    if sys.byteorder == "big":
+        offsets.byteswap()
+
+    return {"header": header["root"], "has_versions": header["has_versions"], "ids": header["ids"], "numbers": header["numbers"], "spans": _Spans(offsets), "sha256": header["sha256"]}
+
+
+def read_payloads(path: str, spans: list) -> list:
+    "Decode the versions at the given spans, straight from a memory map of the file"
+    import msgpack
+
+    if len(spans) == 0:
+        return []
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return [msgpack.unpackb(mapped[start:end], raw=False) for start, end in spans]
+
+
+def compile_source(path: str, output: str) -> dict:
+    """
+    Compile a JSON version source to `output`, decoding one version at a time.
+    Returns the number of versions and the size of both files.
+    """
+    import msgpack
+
+    from src.utils.version_index import load_index
+
+    if is_compiled(path):
+        raise ValueError("The version source is compiled already")
+
+    index = load_index(path)
+    directory = os.path.dirname(os.path.abspath(output))
+
+    header = msgpack.packb({"root": index["header"], "has_versions": index["has_versions"], "ids": index["ids"], "numbers": index["numbers"], "sha256": index["sha256"]}, use_bin_type=True)
+    offset = _PREAMBLE.size + len(header) + _OFFSET.size * (len(index["ids"]) + 1)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as out, open(path, "rb") as source:
+            out.write(_PREAMBLE.pack(MAGIC, COMPILED_FORMAT, len(index["ids"]), len(header)))
+            out.write(header)
+
+            #### Payloads are written after the version table, which is filled in once their sizes are known
+            out.seek(offset)
+            offsets = [offset]
+            for start, end in index["spans"]:
+                source.seek(start)
+                payload = msgpack.packb(json.loads(source.read(end - start)), use_bin_type=True)
+                out.write(payload)
+                offsets.append(offsets[-1] + len(payload))
+
+            out.seek(_PREAMBLE.size + len(header))
+            out.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+
+        os.replace(tmp_path, output)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return {"versions": len(index["ids"]), "source_size": os.path.getsize(path), "size": os.path.getsize(output)}
@@ -13,13 +13,99 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from configparser import ConfigParser, SectionProxy
+import os
+import tempfile
+from configparser import ConfigParser
+from contextlib import contextmanager
+from typing import Callable, overload, Literal
+
 from src.utils.exceptions import ConfigIncoplete
 from src.utils.globals import CONFIG_PATH
-from typing import overload, Literal
+from src.utils.trace import span
+
+try:
+    import fcntl
+except ImportError:  ## Windows
+    fcntl = None
+    import msvcrt
 
+#### The config file is parsed once per process and kept here
 config = ConfigParser()
 
+#### (mtime, size, inode) of the config file as it was last read
+config_stat = None
+
+def _file_stat() -> tuple | None:
+    try:
+        stat = os.stat(CONFIG_PATH)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+"Parse the config file, unless it did not change since it was last read"
+def config_load() -> ConfigParser:
+    global config, config_stat
+
+    stat = _file_stat()
+    if stat == config_stat:
+        return config
+
+    #### A fresh parser, so sections removed by another process don't linger
+    parser = ConfigParser()
+    if not stat == None:
+        with span("config read"):
+            parser.read(CONFIG_PATH)
+
+    config = parser
+    config_stat = stat
+
+    return config
+
+@contextmanager
+def config_lock():
+    "Hold an advisory lock on the config file while it is being modified"
+
+    with open(CONFIG_PATH + ".lock", "a+") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _modify(change: Callable[[ConfigParser], bool]) -> None:
+    "Apply a change under lock and write the file only when something changed"
+    global config_stat
+
+    with config_lock():
+        #### Re-read under the lock so changes made by other processes are kept
+        parser = config_load()
+
+        if not change(parser):
+            return
+
+        #### Write to a temporary file and rename it over the config, so readers never see a partial file
+        config_dir = os.path.dirname(os.path.abspath(CONFIG_PATH))
+        fd, tmp_path = tempfile.mkstemp(prefix=".cli-config-", dir=config_dir)
+        try:
+            with os.fdopen(fd, "w") as configfile:
+                parser.write(configfile)
+                configfile.flush()
+                os.fsync(configfile.fileno())
+            os.replace(tmp_path, CONFIG_PATH)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        config_stat = _file_stat()
+
 @overload
 def config_get(section: str, key: str) -> str: ...
 
@@ -27,19 +113,22 @@ def config_get(section: str, key: str) -> str: ...
 def config_get(section: str, key: str, fallback: Literal[True]) -> None: ...
 
 @overload
-def config_get(section: str) -> SectionProxy: ...
+def config_get(section: str) -> dict: ...
 
 @overload
 def config_get(section:str, *, fallback: Literal[True]) -> None: ...
 
 "Get data from config file"
-def config_get(section: str, key: str | None = None, fallback: bool = False) -> SectionProxy | str | None:
+def config_get(section: str, key: str | None = None, fallback: bool = False) -> dict | str | None:
     
-    config.read(CONFIG_PATH)
+    config = config_load()
 
     try:
+        #### A copy, changing it must not change the parsed config, config_write compares against that
         if key == None:
-            return config[section]
+            if not config.has_section(section):
+                raise KeyError(section)
+            return dict(config.items(section, raw=True))
         
         return config[section][key]
     except KeyError:
@@ -50,36 +139,58 @@ def config_get(section: str, key: str | None = None, fallback: bool = False) ->
 "Write to config file"
 def config_write(data: dict | list) -> None:
 
-    config.read(CONFIG_PATH)
+    def change(config: ConfigParser) -> bool:
+        changed = False
+
+        #### Loop through root level dict keys
+        for key in data:
+            new = {config.optionxform(str(k)): str(v) for k, v in dict(data[key]).items()}
+            if key in config and dict(config.items(key, raw=True)) == new:
+                continue
+
+            config[key] = data[key]
+            changed = True
 
-    #### Loop through root level dict keys
-    for key in data:
-        config[key] = data[key]
+        return changed
 
-    #### Write changes to config file
-    with open(CONFIG_PATH, "w") as configfile:
-        config.write(configfile)
+    _modify(change)
 
     return
 
+"Set a single key, unless it already has a value. Returns the value in effect"
+def config_setdefault(section: str, key: str, value: str) -> str:
+
+    def change(config: ConfigParser) -> bool:
+        if section in config and key in config[section]:
+            return False
+
+        if not section in config:
+            config[section] = {}
+        config[section][key] = value
+        return True
+
+    _modify(change)
+
+    return config[section][key]
+
 "Remove from config file"
 def config_remove(section: str, key: str | None = None):
 
-    if key == None:
-        config.remove_section(section)
-    else:
-        config.remove_option(section, key)
+    def change(config: ConfigParser) -> bool:
+        if key == None:
+            return config.remove_section(section)
+        if not section in config:
+            return False
+        return config.remove_option(section, key)
 
-    #### Write changes to config file
-    with open(CONFIG_PATH, 'w') as configfile:
-        config.write(configfile)
+    _modify(change)
 
     return
 
 "Get all keys of available items in config section"
 def config_get_items(key: str) -> list:
 
-    config.read(CONFIG_PATH)
+    config = config_load()
 
     try:
         return config.items(key)
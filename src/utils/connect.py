@@ -16,9 +16,9 @@
 import sys
 from typing import TypedDict
 
-import inquirer
-
 from src.utils.common import console
+from src.utils.config import config_get, config_load
+from src.utils.trace import span
 
 
 class MySQLCredentials(TypedDict):
@@ -38,8 +38,131 @@ def check_port(val):
     return True
 
 
-def get_mysql_creds() -> MySQLCredentials:
-    "Prompt user to input credentials"
+#### Named connection profiles are stored in sections with this prefix
+PROFILE_PREFIX = "PROFILE."
+
+
+def profile_section(profile: str | None) -> str:
+    "Config section holding the credentials of a profile, the active session when None"
+    return "DB_SESSION" if profile == None else PROFILE_PREFIX + profile
+
+
+def profile_names() -> list:
+    "Names of all saved connection profiles"
+    return [section[len(PROFILE_PREFIX) :] for section in config_load().sections() if section.startswith(PROFILE_PREFIX)]
+
+
+def saved_credentials(profile: str | None = None) -> MySQLCredentials | None:
+    "Credentials of the connected database (or a named profile), with the password decrypted. None if there are none"
+    conn = config_get(profile_section(profile), fallback=True)
+    secret = config_get("CONFIG", "secret", fallback=True)
+
+    if not conn or secret == None:
+        return None
+
+    with span("decrypt credentials"):
+        from cryptography.fernet import Fernet
+
+        password = Fernet(secret).decrypt(conn["password"][1:-1]).decode()
+
+    return {
+        "host": conn["host"],
+        "user": conn["user"],
+        "password": password,
+        "database": conn["database"],
+        "port": int(conn["port"]),
+    }
+
+
+def open_connection(profile: str | None = None, **options):
+    "Open a new connection to the connected database (or a named profile), next to the one in `globals.db`"
+    from mysql.connector import MySQLConnection
+
+    credentials = saved_credentials(profile)
+    if credentials == None:
+        return None
+
+    with span("mysql connect", "database", host=credentials["host"], profile=profile):
+        connection = MySQLConnection(**credentials, **options)
+    connection.autocommit = True
+
+    return connection
+
+
+#### Profile connections kept open between commands (by the daemon), None when they are closed after use
+kept_connections: dict | None = None
+
+
+def keep_connections() -> None:
+    global kept_connections
+    if kept_connections == None:
+        kept_connections = {}
+
+
+def drop_connections() -> None:
+    "Close all kept connections, they are reopened with the (possibly changed) saved credentials"
+    if kept_connections == None:
+        return
+
+    for db in list(kept_connections.values()):
+        try:
+            db.connection.close()
+        except Exception:
+            pass
+    kept_connections.clear()
+
+
+def release_connection(db) -> None:
+    "Close a connection from `connect_profile`, unless it is kept open"
+    if not kept_connections == None and any(kept is db for kept in kept_connections.values()):
+        return
+
+    db.connection.close()
+
+
+def connect_profile(profile: str | None, keep: bool = True, **options):
+    "AlphaDB instance connected to a saved profile, with extra connection options (timeouts, ...). With `keep` off, a new connection is never kept"
+    from alphadb import AlphaDB
+    from mysql.connector import MySQLConnection
+
+    if keep and not kept_connections == None and profile in kept_connections:
+        db = kept_connections[profile]
+        try:
+            db.connection.ping(reconnect=True, attempts=2, delay=1)
+            return db
+        except Exception:
+            del kept_connections[profile]
+
+    credentials = saved_credentials(profile)
+    if credentials == None:
+        raise ValueError(f"No saved credentials for profile {profile}")
+
+    #### Same as AlphaDB.connect, which does not take connection options
+    db = AlphaDB()
+    with span("mysql connect", "database", host=credentials["host"], profile=profile):
+        db.connection = MySQLConnection(**credentials, buffered=True, **options)
+    db.connection.autocommit = True
+    db.cursor = db.connection.cursor
+    db.db_name = credentials["database"]
+
+    if keep and not kept_connections == None:
+        kept_connections[profile] = db
+
+    return db
+
+
+def get_mysql_creds(host: str | None = None, user: str | None = None, password: str | None = None, database: str | None = None, port: int | None = None) -> MySQLCredentials:
+    "Prompt user to input credentials, unless they are given (user, password and database at least)"
+
+    if not user == None and not password == None and not database == None:
+        return {"host": host or "localhost", "user": user, "password": password, "database": database, "port": port or 3306}
+
+    from src.utils import headless
+
+    headless.require("--user, --password and --database (or ALPHADB_USER, ALPHADB_PASSWORD and ALPHADB_DATABASE)")
+
+    import inquirer
+
     console.print(
         "[cyan]Connecting to a MySQL database requires you to provide log-in credentials[/cyan]\n"
     )
@@ -0,0 +1,339 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#### The client half of this module runs before anything else is imported, keep the top level to the standard library
+import io
+import json
+import os
+import socket
+import sys
+import time
+
+from src.utils import globals
+
+#### Seconds without requests after which the daemon exits
+DEFAULT_IDLE_TIMEOUT = 900
+
+#### Seconds between checks for idle shutdown and config changes
+POLL_INTERVAL = 2
+
+#### Commands that can run without a terminal, so they can be answered by the daemon
+FORWARDED_COMMANDS = ("status", "init", "pending", "update", "profiles", "drift", "validate", "sources")
+
+#### Commands that prompt for a version source, unless one is passed along
+SOURCE_COMMANDS = ("pending", "update", "drift", "validate")
+
+#### Environment variables passed along to the daemon
+FORWARDED_ENV_PREFIXES = ("ALPHADB_",)
+FORWARDED_ENV = ("TERM", "COLORTERM", "NO_COLOR", "FORCE_COLOR", "COLUMNS")
+
+
+#### Client
+
+
+def forwardable(argv: list) -> bool:
+    "Whether the command can be handed to a running daemon"
+    if globals.SOCKET_PATH == None or os.environ.get("ALPHADB_NO_DAEMON"):
+        return False
+
+    if len(argv) == 0 or not argv[0] in FORWARDED_COMMANDS:
+        return False
+
+    if argv[0] in SOURCE_COMMANDS and not os.environ.get("ALPHADB_SOURCE") and not any(arg == "--source" or arg.startswith("--source=") for arg in argv):
+        return False
+
+    return os.path.exists(globals.SOCKET_PATH)
+
+
+def _connect(timeout: float | None = None) -> socket.socket | None:
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(globals.SOCKET_PATH)
+    except OSError:
+        client.close()
+        return None
+    return client
+
+
+def request(message: dict, timeout: float | None = None):
+    "Send a message to the daemon, yields its replies. Yields nothing when no daemon is listening"
+    client = _connect(timeout)
+    if client == None:
+        return
+
+    with client, client.makefile("rwb") as stream:
+        stream.write(json.dumps(message).encode() + b"\n")
+        stream.flush()
+
+        for line in stream:
+            yield json.loads(line)
+
+
+def forward(argv: list) -> int | None:
+    "Run a command on the daemon, streaming its output. None when the daemon could not be reached"
+    message = {
+        "action": "run",
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "env": {k: v for k, v in os.environ.items() if k.startswith(FORWARDED_ENV_PREFIXES) or k in FORWARDED_ENV},
+        "terminal": sys.stdout.isatty(),
+        "width": os.get_terminal_size().columns if sys.stdout.isatty() else None,
+    }
+
+    reached = False
+    for reply in request(message):
+        reached = True
+        if "out" in reply:
+            sys.stdout.write(reply["out"])
+            sys.stdout.flush()
+        if "exit" in reply:
+            return reply["exit"]
+
+    if not reached:
+        return None
+
+    sys.stderr.write("The daemon stopped before the command finished\n")
+    return 1
+
+
+def daemon_status() -> dict | None:
+    "Status of the running daemon, None when there is none"
+    for reply in request({"action": "status"}, timeout=2):
+        return reply
+    return None
+
+
+def stop_daemon() -> bool:
+    for reply in request({"action": "stop"}, timeout=5):
+        return reply.get("stopped", False)
+    return False
+
+
+#### Server
+
+
+class _ClientStream(io.TextIOBase):
+    "Output of a forwarded command, sent to the client as it is written"
+
+    def __init__(self, stream, terminal: bool):
+        self.stream = stream
+        self.terminal = terminal
+
+    def writable(self) -> bool:
+        return True
+
+    def isatty(self) -> bool:
+        return self.terminal
+
+    def write(self, text: str) -> int:
+        if text:
+            self.stream.write(json.dumps({"out": text}).encode() + b"\n")
+            self.stream.flush()
+        return len(text)
+
+
+class Daemon:
+    """
+    Answers forwarded commands over a unix socket, one at a time.
+    The interpreter, imports, version source indexes and database connections stay warm between commands.
+    Connections are dropped when the config file changes, the daemon exits after `idle_timeout` seconds without requests.
+    """
+
+    def __init__(self, idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.started = time.time()
+        self.last_request = time.monotonic()
+        self.requests = 0
+        self.config_stat = self._config_stat()
+        self.running = True
+
+    def _config_stat(self):
+        try:
+            stat = os.stat(globals.CONFIG_PATH)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def warm_up(self) -> None:
+        "Import everything a command might need and open the database connection"
+        import alphadb  # noqa: F401
+        import inquirer  # noqa: F401
+        import mysql.connector  # noqa: F401
+        import requests  # noqa: F401
+
+        from src import cli, commands  # noqa: F401
+        from src.utils import fleet, plan, version_index, version_source  # noqa: F401
+        from src.utils.connect import keep_connections
+        from src.utils.decorators import connection_check
+
+        keep_connections()
+
+        #### Connecting is best effort, commands report the problem themselves
+        try:
+            connection_check()(lambda: None)()
+        except Exception:
+            pass
+
+    def reload(self) -> None:
+        "Drop everything derived from the config, it is rebuilt on the next command"
+        from src.utils.config import config_load
+        from src.utils.connect import drop_connections
+        from src.utils.types import AlphaDBMock
+
+        drop_connections()
+        if not globals.db.connection == None:
+            try:
+                globals.db.connection.close()
+            except Exception:
+                pass
+        globals.db = AlphaDBMock()
+
+        config_load()
+
+    def _check_config(self) -> None:
+        stat = self._config_stat()
+        if not stat == self.config_stat:
+            self.config_stat = stat
+            self.reload()
+
+    def run_command(self, message: dict, stream) -> int:
+        from contextlib import redirect_stderr, redirect_stdout
+
+        from src.utils.common import console
+        from src.utils.shell import run_command
+
+        output = _ClientStream(stream, message.get("terminal", False))
+        cwd = os.getcwd()
+        environ = dict(os.environ)
+
+        os.chdir(message.get("cwd", cwd))
+
+        #### Only the client's own settings apply, not those the daemon was started with or an earlier request sent
+        for key in list(os.environ):
+            if key.startswith(FORWARDED_ENV_PREFIXES) or key in FORWARDED_ENV:
+                del os.environ[key]
+        os.environ.update(message.get("env", {}))
+
+        #### Modules hold a reference to the console, so it is re-initialized in place
+        console.__init__(file=output, force_terminal=output.terminal, width=message.get("width"))
+
+        try:
+            with redirect_stdout(output), redirect_stderr(output):
+                sys.stdin = io.StringIO()  ## Nothing to answer prompts with
+                return run_command(message["argv"])
+        except Exception as e:
+            output.write(f"{e.msg if hasattr(e, 'msg') else e}\n")
+            return 1
+        finally:
+            sys.stdin = sys.__stdin__
+            console.__init__()
+            os.environ.clear()
+            os.environ.update(environ)
+            os.chdir(cwd)
+
+    def handle(self, client: socket.socket) -> None:
+        with client, client.makefile("rwb") as stream:
+            line = stream.readline()
+            if not line:
+                return
+
+            message = json.loads(line)
+            action = message.get("action")
+
+            if action == "status":
+                reply = {"pid": os.getpid(), "started": self.started, "requests": self.requests, "idle": time.monotonic() - self.last_request}
+            elif action == "stop":
+                self.running = False
+                reply = {"stopped": True}
+            elif action == "run":
+                self._check_config()
+                self.requests += 1
+                reply = {"exit": self.run_command(message, stream)}
+            else:
+                reply = {"error": f"Unknown action {action}"}
+
+            stream.write(json.dumps(reply).encode() + b"\n")
+            stream.flush()
+
+    def serve(self) -> None:
+        path = globals.SOCKET_PATH
+
+        if os.path.exists(path):
+            os.unlink(path)  ## Left behind by a daemon that did not shut down cleanly
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        #### Created without permissions for others, there is no moment other users can connect
+        umask = os.umask(0o177)
+        try:
+            server.bind(path)
+        finally:
+            os.umask(umask)
+        server.listen()
+        server.settimeout(POLL_INTERVAL)
+
+        try:
+            while self.running:
+                try:
+                    client, _ = server.accept()
+                except socket.timeout:
+                    if time.monotonic() - self.last_request > self.idle_timeout:
+                        return
+                    self._check_config()
+                    continue
+
+                client.settimeout(None)
+                try:
+                    self.handle(client)
+                except (OSError, ValueError):
+                    pass  ## Client went away
+                self.last_request = time.monotonic()
+        finally:
+            server.close()
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def start_daemon(idle_timeout: float = DEFAULT_IDLE_TIMEOUT, foreground: bool = False) -> int | None:
+    "Start the daemon, in the background unless `foreground`. Returns the pid of the daemon"
+    daemon = Daemon(idle_timeout=idle_timeout)
+
+    if foreground:
+        daemon.warm_up()
+        daemon.serve()
+        return None
+
+    pid = os.fork()
+    if pid == 0:
+        #### Detach from the terminal of the starting process
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+
+        try:
+            daemon.warm_up()
+            daemon.serve()
+        finally:
+            os._exit(0)
+
+    #### Wait until the daemon accepts connections
+    for _ in range(100):
+        status = daemon_status()
+        if not status == None:
+            return status["pid"]
+        time.sleep(0.1)
+
+    return pid
@@ -13,34 +13,25 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import os
-from configparser import ConfigParser
 from typing import Callable
 
-from alphadb import AlphaDB
-from cryptography.fernet import Fernet
-from simpleUID import urlsafe
-
 from src.utils import globals
 from src.utils.common import console
-from src.utils.config import config_get, config_remove
+from src.utils.config import config_get, config_setdefault
+from src.utils.trace import span
+from src.utils.types import AlphaDBMock
 
 
 def config_check(func: Callable) -> Callable:
     "Initialize config when it's not yet initialized"
 
     def _(*args, **kwargs):
-        config = ConfigParser()
-        if os.path.isfile(globals.CONFIG_PATH):
-            config.read(globals.CONFIG_PATH)
 
-        if not "CONFIG" in config:
-            config["CONFIG"] = {}
-        if not "secret" in config["CONFIG"]:
-            config["CONFIG"]["secret"] = urlsafe("padding")
+        #### Only touches the file when no secret exists yet
+        if config_get("CONFIG", "secret", fallback=True) == None:
+            from simpleUID import urlsafe
 
-        with open(globals.CONFIG_PATH, "w+") as configfile:
-            config.write(configfile)
+            config_setdefault("CONFIG", "secret", urlsafe("padding"))
 
         return func(*args, **kwargs)
 
@@ -52,24 +43,30 @@ def connection_check() -> Callable:
 
     def _(func: Callable) -> Callable:
         def _wrapper(*args, **kwargs):
+
+            #### A connection kept open (by the shell) is reused, after checking it is still alive
+            if not globals.db.connection == None:
+                try:
+                    globals.db.connection.ping(reconnect=True, attempts=2, delay=1)
+                except:
+                    console.print("[red]Lost the connection to the database and was unable to reconnect.[/red]\n")
+                    globals.db = AlphaDBMock()
+                    return
+
+                return func(*args, **kwargs)
+
             if globals.db.connection == None:
-                conn = config_get("DB_SESSION", fallback=True)
-                main_config = config_get("CONFIG")
-                secret = main_config["secret"] if "secret" in main_config else None
+                if config_get("DB_SESSION", fallback=True):
+                    with span("import alphadb", "startup"):
+                        from alphadb import AlphaDB
+                    from src.utils.connect import saved_credentials
 
-                if conn and secret:
                     globals.db = AlphaDB()
 
                     try:
-                        globals.db.connect(
-                            host=conn["host"],
-                            user=conn["user"],
-                            password=Fernet(secret)
-                            .decrypt(conn["password"][1:-1])
-                            .decode(),  ## Decrypt
-                            database=conn["database"],
-                            port=conn["port"],
-                        )
+                        credentials = saved_credentials()
+                        with span("mysql connect", "database", host=credentials["host"]):
+                            globals.db.connect(**credentials)
 
                         globals.db.connection.autocommit = True
                     except:
@@ -0,0 +1,383 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gzip
+import json
+import os
+import queue
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, TypedDict
+
+from src.utils.bulk_load import DEFAULT_BATCH_SIZE, LoadResult
+
+#### Bump when the layout of archives changes, older archives can't be restored
+DUMP_FORMAT = 1
+
+MANIFEST_NAME = "manifest.json"
+
+#### Connections used to dump and restore tables concurrently
+DEFAULT_WORKERS = 4
+
+#### Rows per chunk file, and per fetch from the server. Bounds the memory used, whatever the size of a table
+CHUNK_ROWS = 250_000
+FETCH_SIZE = 5000
+
+#### Fast over small, archives are written while the server is read
+COMPRESS_LEVEL = 3
+
+#### Lines of SHOW CREATE TABLE that are created after the rows are loaded
+_INDEX_LINE = re.compile(r"^\s*(UNIQUE KEY|KEY|FULLTEXT KEY|SPATIAL KEY|INDEX) ")
+_FOREIGN_KEY_LINE = re.compile(r"^\s*CONSTRAINT .* FOREIGN KEY ")
+
+_ESCAPES = {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"}
+_ESCAPE = re.compile(r"[\\\t\n\r\0]")
+_UNESCAPES = {"t": "\t", "n": "\n", "r": "\r", "0": "\0"}
+_UNESCAPE = re.compile(r"\\(.)")
+
+
+class TableDump(TypedDict):
+    name: str
+    create: str  ## CREATE TABLE with the primary key only
+    indexes: list  ## Secondary index definitions, added after the rows are loaded
+    foreign_keys: list  ## Constraint definitions, added after all tables are loaded
+    columns: list
+    rows: int
+    chunks: list  ## Chunk file names, in order
+    bytes: int  ## Compressed size of the chunks
+    seconds: float
+
+
+class Manifest(TypedDict):
+    format: int
+    created: str
+    database: str
+    template: str | None
+    version: str | None
+    consistent: bool  ## Whether all tables were read from the same snapshot
+    tables: list[TableDump]
+
+
+def split_create(ddl: str) -> tuple[str, list, list]:
+    """
+    Split the output of SHOW CREATE TABLE into the statement creating the table with its primary key,
+    the secondary indexes and the foreign keys. Every definition is on a line of its own.
+    """
+    lines = ddl.split("\n")
+    head, definitions, tail = lines[0], lines[1:-1], lines[-1]
+
+    kept, indexes, foreign_keys = [], [], []
+    for line in definitions:
+        definition = line.strip().rstrip(",")
+        if _FOREIGN_KEY_LINE.match(line):
+            foreign_keys.append(definition)
+        elif _INDEX_LINE.match(line):
+            indexes.append(definition)
+        else:
+            kept.append(f"  {definition}")
+
+    return "\n".join([head, ",\n".join(kept), tail]), indexes, foreign_keys
+
+
+def _field(value) -> str:
+    "Raw (text protocol) value as a LOAD DATA field"
+    if value == None:
+        return "\\N"
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode("utf-8")
+    return _ESCAPE.sub(lambda m: _ESCAPES[m.group()], str(value))
+
+
+def _parse_field(field: str) -> str | None:
+    if field == "\\N":
+        return None
+    return _UNESCAPE.sub(lambda m: _UNESCAPES.get(m.group(1), m.group(1)), field)
+
+
+def _open_pool(workers: int, profile: str | None, **options) -> list:
+    from src.utils.connect import open_connection
+
+    connections = []
+    try:
+        for _ in range(workers):
+            connection = open_connection(profile=profile, **options)
+            if connection == None:
+                raise ValueError("No saved credentials for the database")
+            connections.append(connection)
+    except BaseException:
+        for connection in connections:
+            connection.close()
+        raise
+    return connections
+
+
+def _snapshot(connections: list) -> bool:
+    """
+    Start a read only transaction on every connection.
+    Global reads are blocked while the snapshots start (like mydumper), so all tables are read at the same moment.
+    Without the RELOAD privilege the snapshots are started right after each other instead. Returns whether they are consistent.
+    """
+    from mysql.connector import DatabaseError
+
+    with connections[0].cursor() as cursor:
+        try:
+            cursor.execute("FLUSH TABLES WITH READ LOCK;")
+            locked = True
+        except DatabaseError:
+            locked = False
+
+    for connection in connections:
+        with connection.cursor() as cursor:
+            cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY;")
+
+    if locked:
+        with connections[0].cursor() as cursor:
+            cursor.execute("UNLOCK TABLES;")
+
+    return locked
+
+
+def _dump_table(connection, table: str, path: str, chunk_rows: int) -> TableDump:
+    start = time.perf_counter()
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SHOW CREATE TABLE `{table}`;")
+        create, indexes, foreign_keys = split_create(cursor.fetchall()[0][1])
+
+    result: TableDump = {"name": table, "create": create, "indexes": indexes, "foreign_keys": foreign_keys, "columns": [], "rows": 0, "chunks": [], "bytes": 0, "seconds": 0}
+    chunk = None
+
+    #### Unbuffered, so rows are streamed from the server instead of fetched all at once. Raw values are written as the server sent them
+    cursor = connection.cursor(buffered=False, raw=True)
+    try:
+        cursor.execute(f"SELECT * FROM `{table}`;")
+        result["columns"] = list(cursor.column_names)
+
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if len(rows) == 0:
+                break
+
+            for row in rows:
+                if chunk == None or result["rows"] % chunk_rows == 0:
+                    if not chunk == None:
+                        chunk.close()
+                    name = f"{table}.{len(result['chunks']):05d}.tsv.gz"
+                    result["chunks"].append(name)
+                    chunk = gzip.open(os.path.join(path, name), "wt", compresslevel=COMPRESS_LEVEL, encoding="utf-8", newline="\n")
+
+                chunk.write("\t".join(_field(value) for value in row))
+                chunk.write("\n")
+                result["rows"] += 1
+    finally:
+        cursor.close()
+        if not chunk == None:
+            chunk.close()
+
+    result["bytes"] = sum(os.path.getsize(os.path.join(path, name)) for name in result["chunks"])
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def dump_database(db, path: str, workers: int = DEFAULT_WORKERS, chunk_rows: int = CHUNK_ROWS, on_table: Callable | None = None, profile: str | None = None) -> Manifest:
+    """
+    Dump every table of the database to compressed chunk files in the `path` directory, largest tables first,
+    concurrently over `workers` connections reading the same snapshot. The AlphaDB config table is dumped like any other,
+    so a restored database has the version matching its rows.
+    The manifest (template, version and the schema of every table) is written last, an archive without one is incomplete.
+    `on_table` is called with the TableDump of every table as it finishes.
+    """
+    from src.utils.journal import JOURNAL_TABLE_NAME
+
+    status = db.status()
+
+    with db.cursor() as cursor:
+        cursor.execute("SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE' ORDER BY DATA_LENGTH DESC", (db.db_name,))
+        tables = [row[0] for row in cursor.fetchall() if not row[0] == JOURNAL_TABLE_NAME]
+
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, MANIFEST_NAME)):
+        raise FileExistsError(f"{path} already holds an archive")
+
+    connections = _open_pool(max(1, min(workers, len(tables))), profile)
+    pool = queue.Queue()
+    for connection in connections:
+        pool.put(connection)
+
+    def run(table):
+        connection = pool.get()
+        try:
+            return _dump_table(connection, table, path, chunk_rows)
+        finally:
+            pool.put(connection)
+
+    results = {}
+    try:
+        consistent = _snapshot(connections)
+
+        with ThreadPoolExecutor(max_workers=len(connections), thread_name_prefix="dump") as executor:
+            for future in as_completed([executor.submit(run, table) for table in tables]):
+                result = future.result()
+                results[result["name"]] = result
+                if not on_table == None:
+                    on_table(result)
+    finally:
+        for connection in connections:
+            connection.close()
+
+    manifest: Manifest = {
+        "format": DUMP_FORMAT,
+        "created": datetime.now().isoformat(),
+        "database": db.db_name,
+        "template": status["template"],
+        "version": status["version"],
+        "consistent": consistent,
+        "tables": [results[table] for table in tables],
+    }
+
+    fd, tmp_path = tempfile.mkstemp(dir=path, prefix=".tmp-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(path, MANIFEST_NAME))
+
+    return manifest
+
+
+def read_manifest(path: str) -> Manifest:
+    from src.utils.exceptions import ArchiveUnreadable
+
+    try:
+        with open(os.path.join(path, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise ArchiveUnreadable(f"{path} has no {MANIFEST_NAME}, the dump did not finish.")
+    except ValueError:
+        raise ArchiveUnreadable(f"The {MANIFEST_NAME} of {path} is corrupt.")
+
+    if not manifest.get("format") == DUMP_FORMAT:
+        raise ArchiveUnreadable(f"It was written in an unsupported format ({manifest.get('format')}).")
+
+    return manifest
+
+
+def _load_chunk(connection, table: TableDump, file: str, batch_size: int, infile: bool) -> int:
+    "Load a chunk file in a single transaction, returns the number of statements used"
+    columns = ",".join(f"`{column}`" for column in table["columns"])
+
+    if infile:
+        fd, tmp_path = tempfile.mkstemp(prefix="alphadb-", suffix=".tsv")
+        try:
+            with os.fdopen(fd, "wb") as out, gzip.open(file, "rb") as chunk:
+                shutil.copyfileobj(chunk, out)
+            with connection.cursor() as cursor:
+                cursor.execute(f"LOAD DATA LOCAL INFILE %s INTO TABLE `{table['name']}` CHARACTER SET utf8mb4 ({columns});", (tmp_path,))
+            connection.commit()
+        finally:
+            os.unlink(tmp_path)
+        return 1
+
+    placeholders = "(" + ",".join(["%s"] * len(table["columns"])) + ")"
+    statements = 0
+
+    connection.start_transaction()
+    try:
+        with connection.cursor() as cursor, gzip.open(file, "rt", encoding="utf-8", newline="\n") as chunk:
+            batch = []
+            for line in chunk:
+                batch.append([_parse_field(field) for field in line[:-1].split("\t")])
+                if len(batch) == batch_size:
+                    cursor.execute(f"INSERT INTO `{table['name']}` ({columns}) VALUES {','.join([placeholders] * len(batch))};", tuple(value for row in batch for value in row))
+                    statements += 1
+                    batch = []
+            if len(batch) > 0:
+                cursor.execute(f"INSERT INTO `{table['name']}` ({columns}) VALUES {','.join([placeholders] * len(batch))};", tuple(value for row in batch for value in row))
+                statements += 1
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+    return statements
+
+
+def _restore_table(connection, table: TableDump, path: str, batch_size: int, infile: bool) -> LoadResult:
+    start = time.perf_counter()
+    statements = 0
+
+    with connection.cursor() as cursor:
+        cursor.execute(table["create"])
+
+    for name in table["chunks"]:
+        statements += _load_chunk(connection, table, os.path.join(path, name), batch_size, infile)
+
+    #### Building the indexes once is faster than maintaining them for every inserted row
+    if len(table["indexes"]) > 0:
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE `{table['name']}` {', '.join(f'ADD {index}' for index in table['indexes'])};")
+
+    return {"table": table["name"], "rows": table["rows"], "statements": statements, "seconds": time.perf_counter() - start}
+
+
+def restore_database(path: str, workers: int = DEFAULT_WORKERS, batch_size: int = DEFAULT_BATCH_SIZE, infile: bool = False, on_table: Callable | None = None, profile: str | None = None) -> list[LoadResult]:
+    """
+    Restore an archive written by `dump_database` into the connected database, which should not have its tables.
+    Tables are created and loaded concurrently over `workers` connections with foreign key and unique checks off,
+    secondary indexes are added after the rows and foreign keys after all tables.
+    `on_table` is called with the LoadResult of every table as it finishes.
+    """
+    manifest = read_manifest(path)
+    tables = manifest["tables"]
+
+    connections = _open_pool(max(1, min(workers, len(tables))), profile, allow_local_infile=infile)
+    for connection in connections:
+        with connection.cursor() as cursor:
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 0;")
+            cursor.execute("SET UNIQUE_CHECKS = 0;")
+
+    pool = queue.Queue()
+    for connection in connections:
+        pool.put(connection)
+
+    def run(table):
+        connection = pool.get()
+        try:
+            return _restore_table(connection, table, path, batch_size, infile)
+        finally:
+            pool.put(connection)
+
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=len(connections), thread_name_prefix="restore") as executor:
+            for future in as_completed([executor.submit(run, table) for table in tables]):
+                result = future.result()
+                results.append(result)
+                if not on_table == None:
+                    on_table(result)
+
+        #### Foreign keys reference other tables, they are added once all of them exist. Checks are off, the rows were consistent when dumped
+        with connections[0].cursor() as cursor:
+            for table in tables:
+                if len(table["foreign_keys"]) > 0:
+                    cursor.execute(f"ALTER TABLE `{table['name']}` {', '.join(f'ADD {foreign_key}' for foreign_key in table['foreign_keys'])};")
+    finally:
+        for connection in connections:
+            connection.close()
+
+    return results
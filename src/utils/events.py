@@ -0,0 +1,73 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+#### Structured events emitted while work is being done, consumers (progress bar, timing history, ...) subscribe to them
+#### Every event is a dict with at least `event` (its name) and `time` (unix time):
+#### plan_started      steps, versions, database, template
+#### version_started   version, steps
+#### step_started      index, version, table, method
+#### step_finished     index, version, table, method, rows, seconds
+#### step_skipped      index, version, table, method (completed by an earlier run that was interrupted)
+#### step_failed       index, version, table, method, error
+#### version_finished  version, seconds
+#### plan_finished     steps, seconds, failed
+#### pipeline_finished statements, packets, round_trips, saved (update --pipeline, see pipeline.PipelineStats)
+#### Headless mode (see headless) writes every event to stdout, and adds:
+#### command_started   command
+#### phase_started     phase
+#### phase_finished    phase, seconds, failed
+#### message           text (console output)
+#### error             message, type
+#### result            command, ok, exit_code, seconds
+#### Commands report their outcome with status (name, template, version, init), pending (versions) and issues (issues)
+
+_subscribers = []
+_lock = threading.Lock()
+
+
+def subscribe(callback: Callable) -> Callable:
+    "Call `callback` with every event, returns a function that unsubscribes it"
+    with _lock:
+        _subscribers.append(callback)
+
+    def unsubscribe():
+        with _lock:
+            if callback in _subscribers:
+                _subscribers.remove(callback)
+
+    return unsubscribe
+
+
+@contextmanager
+def subscribed(callback: Callable) -> Iterator[None]:
+    unsubscribe = subscribe(callback)
+    try:
+        yield
+    finally:
+        unsubscribe()
+
+
+def emit(event: str, **data) -> None:
+    if not _subscribers:
+        return
+
+    message = {"event": event, "time": time.time(), **data}
+    for callback in list(_subscribers):
+        callback(message)
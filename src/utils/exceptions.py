@@ -7,3 +7,31 @@ class ConfigIncoplete(Exception):
     msg = "Config seems to be incomplete. The config file might be broken or edited."
     def __init__(self):
         super().__init__(self, self.msg)
+
+class VersionSourceUnavailable(Exception):
+    msg = "The version source could not be fetched."
+    def __init__(self, reason: str | None = None):
+        if not reason == None:
+            self.msg = f"{self.msg} {reason}"
+        super().__init__(self, self.msg)
+
+class OnlineChangeUnsupported(Exception):
+    msg = "Unable to change the table online."
+    def __init__(self, reason: str | None = None):
+        if not reason == None:
+            self.msg = f"{self.msg} {reason} Run the update without --online."
+        super().__init__(self, self.msg)
+
+class ArchiveUnreadable(Exception):
+    msg = "The archive can not be restored."
+    def __init__(self, reason: str | None = None):
+        if not reason == None:
+            self.msg = f"{self.msg} {reason}"
+        super().__init__(self, self.msg)
+
+class InputRequired(Exception):
+    msg = "Input is required, but prompts are disabled in headless mode."
+    def __init__(self, option: str | None = None):
+        if not option == None:
+            self.msg = f"{self.msg} Pass {option}."
+        super().__init__(self, self.msg)
@@ -0,0 +1,211 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from fnmatch import fnmatchcase
+from typing import TypedDict
+
+from src.utils.connect import connect_profile, profile_names, release_connection
+from src.utils.events import emit
+from src.utils.globals import CACHE_DIR
+
+FLEET_DIR = os.path.join(CACHE_DIR, "fleet")
+
+DEFAULT_CONCURRENCY = 8
+
+#### Seconds a single target may take, also used as socket timeout
+DEFAULT_TIMEOUT = 600
+
+#### Running targets shown in the live table, the rest is counted
+VISIBLE_ROWS = 15
+
+
+class TargetResult(TypedDict):
+    target: str
+    status: str  ## updated, up-to-date or failed
+    from_version: str | None
+    to_version: str | None
+    statements: int
+    seconds: float
+    error: str | None
+
+
+class TargetTimeout(Exception):
+    "A target exceeded its time budget"
+
+
+def match_targets(pattern: str) -> list:
+    "Profile names matching `all` or a comma separated list of glob patterns"
+    names = profile_names()
+    if pattern == "all":
+        return names
+
+    patterns = [p.strip() for p in pattern.split(",") if p.strip()]
+    return [name for name in names if any(fnmatchcase(name, p) for p in patterns)]
+
+
+class _SourceCache:
+    "Pending versions per database version, read once and shared by all workers"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.sources = {}
+
+    def get(self, current_version: str | None) -> dict:
+        from src.utils.version_index import read_pending
+
+        with self.lock:
+            if not current_version in self.sources:
+                self.sources[current_version] = read_pending(self.path, current_version)
+            return self.sources[current_version]
+
+
+def update_target(target: str, sources: _SourceCache, progress: dict, no_data: bool = False, squash: bool = False, batch_size: int | None = None, infile: bool = False, timeout: float = DEFAULT_TIMEOUT) -> TargetResult:
+    "Update a single profile on its own connection, never raises"
+    from src.utils.bulk_load import DEFAULT_BATCH_SIZE
+    from src.utils.plan import build_plan, execute_plan, squash_plan
+
+    start = time.monotonic()
+    deadline = start + timeout
+    result: TargetResult = {"target": target, "status": "failed", "from_version": None, "to_version": None, "statements": 0, "seconds": 0, "error": None}
+    db = None
+
+    progress.update(state="connecting", started=start)
+
+    def on_step(i: int, _):
+        if time.monotonic() > deadline:
+            raise TargetTimeout(f"Timed out after {timeout:.0f}s")
+        progress.update(step=i)
+
+    try:
+        db = connect_profile(target, connection_timeout=int(timeout))
+
+        status = db.status()
+        result["from_version"] = status["version"]
+
+        if status["init"] == False:
+            raise ValueError("Database has not yet been initialized")
+
+        progress.update(state="planning", version=status["version"])
+        steps = build_plan(sources.get(status["version"]), status, no_data=no_data)
+        if squash:
+            steps = squash_plan(steps)
+
+        if len(steps) == 0:
+            result.update(status="up-to-date", to_version=status["version"])
+        else:
+            progress.update(state="updating", steps=len(steps))
+            execute_plan(
+                steps,
+                batch_size=batch_size if not batch_size == None else DEFAULT_BATCH_SIZE,
+                infile=infile,
+                on_step=on_step,
+                db=db,
+                profile=target,
+            )
+            result.update(status="updated", statements=len(steps), to_version=steps[-1]["version"])
+
+    except Exception as e:
+        result["error"] = getattr(e, "msg", None) or str(e) or type(e).__name__
+
+    finally:
+        if not db == None and not db.connection == None:
+            try:
+                release_connection(db)
+            except Exception:
+                pass
+
+    result["seconds"] = round(time.monotonic() - start, 3)
+    progress.update(state=result["status"])
+    emit("target_finished", **result)
+
+    return result
+
+
+def _progress_table(progress: dict, total: int):
+    from rich.table import Table
+
+    counts = {}
+    for state in progress.values():
+        counts[state["state"]] = counts.get(state["state"], 0) + 1
+
+    table = Table(
+        title=f"{total - counts.get('queued', 0)}/{total} targets started",
+        caption="  ".join(f"{state}: {count}" for state, count in sorted(counts.items())),
+        expand=False,
+    )
+    table.add_column("Target", style="cyan")
+    table.add_column("State")
+    table.add_column("Version")
+    table.add_column("Progress", justify="right")
+    table.add_column("Time", justify="right")
+
+    now = time.monotonic()
+    running = [(name, state) for name, state in progress.items() if state["state"] in ("connecting", "planning", "updating")]
+    for name, state in running[:VISIBLE_ROWS]:
+        steps = f"{state.get('step', 0)}/{state['steps']}" if state.get("steps") else ""
+        table.add_row(name, state["state"], state.get("version") or "", steps, f"{now - state['started']:.1f}s")
+
+    if len(running) > VISIBLE_ROWS:
+        table.add_row(f"... {len(running) - VISIBLE_ROWS} more", "", "", "", "")
+
+    return table
+
+
+def run_fleet(targets: list, source_path: str, concurrency: int = DEFAULT_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT, **options) -> list[TargetResult]:
+    """
+    Update all targets over a bounded thread pool, one connection per running target.
+    A live table shows the running targets and the count of every state.
+    """
+    from contextlib import nullcontext
+
+    from rich.live import Live
+
+    from src.utils import headless
+    from src.utils.common import console
+
+    sources = _SourceCache(source_path)
+    progress = {target: {"state": "queued"} for target in targets}
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="fleet") as pool:
+        #### Headless, every target reports a target_finished event instead
+        live = nullcontext() if headless.enabled() else Live(get_renderable=lambda: _progress_table(progress, len(targets)), console=console, refresh_per_second=4)
+        with live:
+            futures = [pool.submit(update_target, target, sources, progress[target], timeout=timeout, **options) for target in targets]
+            results = [future.result() for future in futures]
+
+    return results
+
+
+def write_summary(results: list[TargetResult], source_path: str, path: str | None = None) -> str:
+    "Write the results as JSON, to FLEET_DIR when no path is given. Returns the path"
+    if path == None:
+        os.makedirs(FLEET_DIR, exist_ok=True)
+        path = os.path.join(FLEET_DIR, f"summary-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+
+    with open(path, "w") as f:
+        json.dump({"finished": datetime.now().isoformat(timespec="seconds"), "source": source_path, "counts": counts, "targets": results}, f, indent=2)
+
+    return path
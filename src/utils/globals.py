@@ -19,13 +19,22 @@ from pathlib import Path
 from src.utils.types import AlphaDBMock
 
 global CONFIG_PATH
+global CACHE_DIR
+global HISTORY_PATH
+global SOCKET_PATH
 global db
 db = AlphaDBMock()
 
 if platform == "linux" or platform == "linux2" or platform == "darwin":
     config_dir = os.path.join(str(Path.home()), ".config/alphadb/")
-    if not os.path.exists(config_dir): os.mkdir(config_dir)
+    os.makedirs(config_dir, exist_ok=True)
     CONFIG_PATH = os.path.join(config_dir, "cli-config.ini")
+    CACHE_DIR = os.path.join(config_dir, "cache")
+    HISTORY_PATH = os.path.join(config_dir, "shell_history")
+    SOCKET_PATH = os.path.join(config_dir, "daemon.sock")
 else:
     CONFIG_PATH = "config.ini"
+    CACHE_DIR = "cache"
+    HISTORY_PATH = "shell_history"
+    SOCKET_PATH = None  ## No unix sockets, the daemon is not available
 
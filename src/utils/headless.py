@@ -0,0 +1,175 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#### Enabled before the CLI is imported (see __main__), keep the top level to the standard library
+import io
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+HEADLESS_OPTION = "--headless"
+HEADLESS_ENV = "ALPHADB_HEADLESS"
+
+_lock = threading.Lock()
+_out = None  ## The real stdout, only events are written to it
+_started = 0.0
+_command = None
+
+
+class _MessageStream(io.TextIOBase):
+    "Replaces stdout (and is the file of the console), every line written becomes a message event"
+
+    def __init__(self):
+        self.buffer_text = ""
+
+    def writable(self) -> bool:
+        return True
+
+    def isatty(self) -> bool:
+        return False
+
+    def write(self, text: str) -> int:
+        with _lock:
+            self.buffer_text += text
+            *lines, self.buffer_text = self.buffer_text.split("\n")
+        for line in lines:
+            if line.strip():
+                _emit("message", text=line.rstrip())
+        return len(text)
+
+    def flush(self) -> None:
+        with _lock:
+            line, self.buffer_text = self.buffer_text, ""
+        if line.strip():
+            _emit("message", text=line.rstrip())
+
+
+def options(argv: list) -> bool:
+    "Whether headless mode is asked for, as a global option (before the command) in `argv` or through the environment"
+    if os.environ.get(HEADLESS_ENV, "").lower() in ("1", "true", "yes", "on"):
+        return True
+
+    for arg in argv:
+        if not arg.startswith("-"):
+            break
+        if arg == HEADLESS_OPTION:
+            return True
+
+    return False
+
+
+def enabled() -> bool:
+    return not _out == None
+
+
+def _write(event: dict) -> None:
+    line = json.dumps(event, default=str) + "\n"
+    with _lock:
+        _out.write(line)
+        _out.flush()
+
+
+def _emit(event: str, **data) -> None:
+    from src.utils.events import emit
+
+    emit(event, **data)
+
+
+def enable() -> None:
+    """
+    Write every event as a line of JSON to stdout instead of rendering output for a terminal.
+    Other output (console messages and prints) becomes `message` events. Does nothing when already enabled.
+    """
+    global _out, _started
+
+    if enabled():
+        return
+
+    from src.utils.events import subscribe
+
+    _out = sys.stdout
+    _started = time.perf_counter()
+    subscribe(_write)
+
+    sys.stdout = _MessageStream()
+
+    #### Modules hold a reference to the console, so it is re-initialized in place
+    from src.utils.common import console
+
+    console.__init__(file=sys.stdout, force_terminal=False, no_color=True, highlight=False, soft_wrap=True)
+
+
+def command(name: str) -> None:
+    "The command that is running, reported with its result"
+    global _command
+    _command = name
+    _emit("command_started", command=name)
+
+
+def finish(code: int | None, error: Exception | None = None) -> None:
+    "Report the result of the command, with its exit code"
+    sys.stdout.flush()
+    if not error == None:
+        _emit("error", message=getattr(error, "msg", None) or str(error), type=type(error).__name__)
+    _emit("result", command=_command, ok=code == 0 and error == None, exit_code=code, seconds=time.perf_counter() - _started)
+
+
+class _Phase:
+    "Stands in for a rich Status, changing its text ends the running phase and starts the next"
+
+    def __init__(self, status: str):
+        self.name = None
+        self.update(status)
+
+    def update(self, status: str | None = None, **_) -> None:
+        "Same as Status.update, the spinner options are ignored"
+        from rich.text import Text
+
+        if status == None:
+            return
+        if not self.name == None:
+            self.finish(False)
+
+        self.name = Text.from_markup(str(status)).plain
+        self.start = time.perf_counter()
+        _emit("phase_started", phase=self.name)
+
+    def finish(self, failed: bool) -> None:
+        _emit("phase_finished", phase=self.name, seconds=time.perf_counter() - self.start, failed=failed)
+
+
+@contextmanager
+def phase(status: str) -> Iterator[_Phase]:
+    "Replaces a console status spinner: the start and end of a phase, with its time"
+    current = _Phase(status)
+
+    failed = True
+    try:
+        yield current
+        failed = False
+    finally:
+        current.finish(failed)
+
+
+def require(option: str) -> None:
+    "Fail when a prompt would be shown in headless mode, naming the option (or environment variable) to pass instead"
+    from src.utils.exceptions import InputRequired
+
+    if enabled():
+        raise InputRequired(option)
@@ -0,0 +1,231 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import TypedDict
+
+from src.utils.exceptions import VersionSourceUnavailable
+from src.utils.globals import CACHE_DIR
+
+#### Response metadata is keyed by URL, bodies are stored by content hash
+HTTP_CACHE_DIR = os.path.join(CACHE_DIR, "http")
+OBJECTS_DIR = os.path.join(HTTP_CACHE_DIR, "objects")
+
+#### (connect, read) timeout in seconds
+TIMEOUT = (10, 60)
+
+CHUNK_SIZE = 64 * 1024
+
+#### Failed connections, and responses with these statuses, are retried with exponential backoff
+RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CachedResponse(TypedDict, total=False):
+    url: str
+    etag: str | None
+    last_modified: str | None
+    sha256: str
+    path: str  ## Local file holding the (decompressed) body
+    changed: bool  ## False when the body was served from the cache
+    stale: bool  ## True when the server could not be reached and the cached body was used
+    name: str  ## Template name, remembered so unchanged sources are not parsed again
+
+
+#### Sessions are not safe to share between threads, every thread gets its own
+_sessions = threading.local()
+
+
+def get_session():
+    "Keep-alive session shared by all requests of the calling thread, retrying failed connections"
+    session = getattr(_sessions, "session", None)
+
+    if session == None:
+        from requests import Session
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.request import ACCEPT_ENCODING  ## Includes br when a brotli decoder is installed
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=RETRIES, backoff_factor=RETRY_BACKOFF, status_forcelist=RETRY_STATUSES, allowed_methods=("GET",), raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry)
+
+        session = Session()
+        session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _sessions.session = session
+
+    return session
+
+
+def _key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def _meta_path(url: str) -> str:
+    return os.path.join(HTTP_CACHE_DIR, f"{_key(url)}.json")
+
+
+def _object_path(sha256: str) -> str:
+    return os.path.join(OBJECTS_DIR, sha256)
+
+
+def _write_atomic(path: str, write) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_meta(url: str) -> CachedResponse | None:
+    "Cached metadata for URL, None if the body is not (or no longer) cached"
+    try:
+        with open(_meta_path(url)) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if not os.path.isfile(_object_path(meta["sha256"])):
+        return None
+
+    meta["path"] = _object_path(meta["sha256"])
+    return meta
+
+
+def _write_meta(meta: CachedResponse) -> None:
+    data = {k: v for k, v in meta.items() if not k in ("path", "changed", "stale")}
+    _write_atomic(_meta_path(meta["url"]), lambda f: f.write(json.dumps(data).encode()))
+
+
+def remember(url: str, **values) -> None:
+    "Store values derived from the cached body (like the template name) next to it"
+    meta = read_meta(url)
+    if meta == None:
+        return
+
+    meta.update(values)
+    _write_meta(meta)
+
+
+def _prune(sha256: str) -> None:
+    "Remove a body that is no longer referenced by any URL"
+    for file in os.listdir(HTTP_CACHE_DIR):
+        if not file.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(HTTP_CACHE_DIR, file)) as f:
+                if json.load(f)["sha256"] == sha256:
+                    return
+        except (OSError, ValueError, KeyError):
+            continue
+
+    from src.utils.version_index import remove_index
+
+    try:
+        os.unlink(_object_path(sha256))
+    except FileNotFoundError:
+        pass
+    remove_index(_object_path(sha256))
+
+
+def _store_body(response) -> str:
+    "Stream the (decompressed) body into the object store, returns its sha256"
+    digest = hashlib.sha256()
+
+    def write(f):
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            digest.update(chunk)
+            f.write(chunk)
+
+    fd, tmp_path = tempfile.mkstemp(dir=OBJECTS_DIR, prefix=".download-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    sha256 = digest.hexdigest()
+    os.replace(tmp_path, _object_path(sha256))
+
+    return sha256
+
+
+def fetch(url: str, offline: bool = False) -> CachedResponse:
+    """
+    Fetch URL through the local cache.
+
+    The cached ETag/Last-Modified are sent along, so an unchanged body is answered with a 304 and served from disk.
+    In offline mode, or when the server can not be reached, the cached copy is served without a request.
+    """
+    from requests.exceptions import RequestException
+
+    os.makedirs(OBJECTS_DIR, exist_ok=True)
+
+    cached = read_meta(url)
+
+    if offline:
+        if cached == None:
+            raise VersionSourceUnavailable("It has not been cached yet and offline mode is enabled.")
+        return {**cached, "changed": False}
+
+    headers = {}
+    if not cached == None:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    try:
+        with get_session().get(url, headers=headers, timeout=TIMEOUT, stream=True) as r:
+
+            #### Not modified, the cached body is still valid
+            if r.status_code == 304 and not cached == None:
+                return {**cached, "changed": False}
+
+            if not r.status_code == 200:
+                raise VersionSourceUnavailable(f"The server responded with status {r.status_code}.")
+
+            sha256 = _store_body(r)
+            etag = r.headers.get("ETag")
+            last_modified = r.headers.get("Last-Modified")
+
+    except RequestException:
+        if not cached == None:
+            return {**cached, "changed": False, "stale": True}
+        raise VersionSourceUnavailable("Unable to establish connection.")
+
+    meta: CachedResponse = {"url": url, "etag": etag, "last_modified": last_modified, "sha256": sha256}
+
+    #### Same content under new validators, keep what was derived from it
+    changed = cached == None or not cached["sha256"] == sha256
+    if not changed:
+        meta = {**cached, **meta}
+
+    _write_meta(meta)
+
+    if changed and not cached == None:
+        _prune(cached["sha256"])
+
+    return {**meta, "path": _object_path(sha256), "changed": changed}
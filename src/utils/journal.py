@@ -0,0 +1,198 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from typing import TypedDict
+
+from src.utils.globals import CACHE_DIR
+
+JOURNAL_DIR = os.path.join(CACHE_DIR, "journal")
+
+#### Mirror of the journal in the database itself, so another machine can resume. Dropped when the update finishes
+JOURNAL_TABLE_NAME = "adb_journal"
+
+
+class JournalEntry(TypedDict):
+    key: str
+    version: str | None
+    table: str | None
+    method: str
+    finished: str | None
+    error: str | None  ## Set when the statement failed
+
+
+def step_keys(steps: list) -> list:
+    """
+    Identity of every step of a plan, from its version, statement and data.
+    Steps keep their key when the plan around them changes, so an interrupted update can be resumed after fixing a later version.
+    Identical steps in the same version are told apart by their occurrence.
+    """
+    keys = []
+    seen = {}
+    for step in steps:
+        content = json.dumps([step["version"], step["table"], step["method"], step["query"], step["params"], step.get("rows")], default=str, sort_keys=True)
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        seen[digest] = seen.get(digest, 0) + 1
+        keys.append(f"{digest[:56]}{seen[digest]:08d}")
+    return keys
+
+
+class Journal:
+    """
+    Record of the statements of an update that completed, written before the next statement runs.
+    Every entry is fsynced to a local file and mirrored in the `adb_journal` table of the database.
+    The mirror is written once per version in a single INSERT, not per statement, which would cost a round trip each.
+    MySQL commits DDL implicitly, so after a failure the journal is the only record of which statements of a version already ran.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.path = os.path.join(JOURNAL_DIR, self._file_name(db))
+        self.file = None
+        self.lock = threading.Lock()  ## Steps may complete concurrently, see parallel
+        self.pending = []  ## Completed entries not yet in the database mirror
+        self.entries = self._load()
+
+    @staticmethod
+    def _file_name(db) -> str:
+        connection = db.connection
+        server = f"{getattr(connection, 'server_host', '')}:{getattr(connection, 'server_port', '')}/{db.db_name}"
+        return hashlib.sha256(server.encode()).hexdigest()[:32] + ".jsonl"
+
+    def _load(self) -> dict:
+        "Entries of an earlier, unfinished update, from the local file and the database mirror"
+        entries = {}
+
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  ## Torn write of the last line
+                    entries[entry["key"]] = entry
+        except FileNotFoundError:
+            pass
+
+        with self.db.cursor() as cursor:
+            cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = %s AND table_name = %s", (self.db.db_name, JOURNAL_TABLE_NAME))
+            if len(cursor.fetchall()) > 0:
+                cursor.execute(f"SELECT step, version, tbl, method, finished FROM `{JOURNAL_TABLE_NAME}`")
+                for key, version, table, method, finished in cursor.fetchall():
+
+                    #### A statement that failed here may have completed on another machine
+                    if not key in entries or entries[key]["finished"] == None:
+                        entries[key] = {"key": key, "version": version, "table": table, "method": method, "finished": finished.isoformat(), "error": None}
+
+        return entries
+
+    @property
+    def unfinished(self) -> bool:
+        "Whether an earlier update of this database did not finish"
+        return len(self.entries) > 0
+
+    def completed(self) -> set:
+        return {key for key, entry in self.entries.items() if not entry["finished"] == None}
+
+    def last_completed(self) -> JournalEntry | None:
+        completed = [entry for entry in self.entries.values() if not entry["finished"] == None]
+        return max(completed, key=lambda entry: entry["finished"]) if completed else None
+
+    def failure(self) -> JournalEntry | None:
+        for entry in self.entries.values():
+            if not entry["error"] == None:
+                return entry
+        return None
+
+    def start(self) -> None:
+        "Open the journal for writing, creating the database mirror"
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        self.file = open(self.path, "a")
+
+        with self.db.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS `{JOURNAL_TABLE_NAME}` (step CHAR(64) NOT NULL, version VARCHAR(50) NULL, tbl VARCHAR(64) NULL, method VARCHAR(20) NOT NULL, finished DATETIME(6) NOT NULL, PRIMARY KEY (step)) ENGINE = InnoDB;"
+            )
+
+    def _write(self, entry: JournalEntry) -> None:
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.entries[entry["key"]] = entry
+
+    def record(self, key: str, step: dict) -> None:
+        "Mark a statement as completed, durably, before the next one runs. The mirror is written when the next version starts"
+        finished = datetime.now()
+        with self.lock:
+            self._write({"key": key, "version": step["version"], "table": step["table"], "method": step["method"], "finished": finished.isoformat(), "error": None})
+
+            if len(self.pending) > 0 and not self.pending[-1][1] == step["version"]:
+                self._flush()
+            self.pending.append((key, step["version"], step["table"], step["method"], finished))
+
+    def _flush(self) -> None:
+        if len(self.pending) == 0:
+            return
+
+        with self.db.cursor() as cursor:
+            cursor.execute(
+                f"INSERT IGNORE INTO `{JOURNAL_TABLE_NAME}` (step, version, tbl, method, finished) VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(self.pending))}",
+                tuple(value for entry in self.pending for value in entry),
+            )
+        self.pending = []
+
+    def flush_before(self, version: str | None) -> None:
+        "Write the mirror now when its entries belong to another version, so recording steps of `version` doesn't use the connection"
+        if len(self.pending) > 0 and not self.pending[-1][1] == version:
+            self.flush()
+
+    def flush(self) -> None:
+        "Write the completed entries to the database mirror, if it can still be reached"
+        with self.lock:
+            try:
+                self._flush()
+            except Exception:
+                pass  ## The local file has them
+
+    def fail(self, key: str, step: dict, error: str) -> None:
+        "Remember where the update stopped. Locally first, since the database may be unreachable"
+        with self.lock:
+            self._write({"key": key, "version": step["version"], "table": step["table"], "method": step["method"], "finished": None, "error": error})
+        self.flush()
+
+    def finish(self) -> None:
+        "The update completed, the journal is no longer needed"
+        self.pending = []  ## Dropped anyway
+        self.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+        with self.db.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS `{JOURNAL_TABLE_NAME}`;")
+
+        self.entries = {}
+
+    def close(self) -> None:
+        "Stop writing, the entries of an interrupted update are mirrored first"
+        self.flush()
+        if not self.file == None:
+            self.file.close()
+            self.file = None
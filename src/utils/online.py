@@ -0,0 +1,317 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+import time
+from typing import Callable, TypedDict
+
+from src.utils.exceptions import OnlineChangeUnsupported
+
+#### Rows copied per chunk at the start, adjusted to reach CHUNK_TIME per chunk
+DEFAULT_CHUNK_SIZE = 1000
+MIN_CHUNK_SIZE = 100
+MAX_CHUNK_SIZE = 100000
+
+#### Seconds a chunk should take, short enough to not hold row locks for long
+DEFAULT_CHUNK_TIME = 0.5
+
+#### Copying pauses while the server or a replica is busier than this
+DEFAULT_MAX_THREADS = 25
+DEFAULT_MAX_LAG = 5.0
+
+#### Seconds to wait before checking again when throttled
+THROTTLE_INTERVAL = 1.0
+
+#### Errors MySQL and MariaDB raise when an ALTER can not run without locking the table
+_NOT_ONLINE_ERRORS = (1845, 1846)
+
+_ALTER = re.compile(r"\s*ALTER TABLE `?(\w+)`?\s(.+?);?\s*$", re.I | re.S)
+_RENAME = re.compile(r"RENAME COLUMN `?(\w+)`? TO `?(\w+)`?$", re.I)
+_CHANGE = re.compile(r"CHANGE (?:COLUMN )?`?(\w+)`? `?(\w+)`? ", re.I)
+
+
+class OnlineOptions(TypedDict, total=False):
+    chunk_size: int
+    chunk_time: float
+    max_threads: int
+    max_lag: float
+    replicas: list  ## Profiles of replicas to check the lag of
+    on_progress: Callable  ## Called with a status message
+
+
+def _progress(options: OnlineOptions, message: str) -> None:
+    if not options.get("on_progress") == None:
+        options["on_progress"](message)
+
+
+def _columns(cursor, database: str, table: str) -> list:
+    cursor.execute("SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION", (database, table))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _primary_key(cursor, database: str, table: str) -> list:
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND CONSTRAINT_NAME = 'PRIMARY' ORDER BY ORDINAL_POSITION",
+        (database, table),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _has_foreign_keys(cursor, database: str, table: str) -> bool:
+    "Foreign keys from or to the table would follow the original table on rename"
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.KEY_COLUMN_USAGE WHERE TABLE_SCHEMA = %s AND REFERENCED_TABLE_NAME IS NOT NULL AND (TABLE_NAME = %s OR REFERENCED_TABLE_NAME = %s)",
+        (database, table, table),
+    )
+    return cursor.fetchone()[0] > 0
+
+
+def column_renames(clauses: str) -> dict:
+    "Old name -> new name for the columns renamed by the clauses of an ALTER TABLE"
+    from src.utils.plan import split_clauses
+
+    renames = {}
+    for clause in split_clauses(clauses):
+        match = _RENAME.match(clause) or _CHANGE.match(clause)
+        if not match == None:
+            renames[match.group(1)] = match.group(2)
+    return renames
+
+
+def _status_value(cursor, query: str, *names: str):
+    "Value of the first of `names` found in the single row a SHOW statement returns"
+    cursor.execute(query)
+    row = cursor.fetchone()
+    if row == None:
+        return None
+
+    values = dict(zip((d[0] for d in cursor.description), row))
+    for name in names:
+        if name in values:
+            return values[name]
+    return None
+
+
+class _Throttle:
+    "Holds copying back while the server has too many running threads or a replica lags behind"
+
+    def __init__(self, db, options: OnlineOptions):
+        from src.utils.connect import connect_profile
+
+        self.db = db
+        self.options = options
+        self.replicas = [connect_profile(profile) for profile in options.get("replicas", [])]
+
+    def _threads_running(self) -> int:
+        with self.db.cursor() as cursor:
+            cursor.execute("SHOW GLOBAL STATUS LIKE 'Threads_running'")
+            return int(cursor.fetchone()[1])
+
+    def _replica_lag(self) -> float:
+        lag = 0.0
+        for replica in self.replicas:
+            with replica.cursor() as cursor:
+                try:
+                    value = _status_value(cursor, "SHOW REPLICA STATUS", "Seconds_Behind_Source")
+                except Exception:
+                    value = _status_value(cursor, "SHOW SLAVE STATUS", "Seconds_Behind_Master")  ## MariaDB and MySQL before 8.0.22
+
+            #### NULL means replication is not running, which is as bad as lagging indefinitely
+            lag = max(lag, float("inf") if value == None else float(value))
+        return lag
+
+    def wait(self) -> float:
+        "Block until the load is acceptable, returns the time spent waiting"
+        waited = 0.0
+        max_threads = self.options.get("max_threads", DEFAULT_MAX_THREADS)
+        max_lag = self.options.get("max_lag", DEFAULT_MAX_LAG)
+
+        while True:
+            threads = self._threads_running()
+            lag = self._replica_lag() if self.replicas else 0.0
+            if threads <= max_threads and lag <= max_lag:
+                return waited
+
+            _progress(self.options, f"Throttled ({threads} threads running, replica lag {lag:.0f}s)")
+            time.sleep(THROTTLE_INTERVAL)
+            waited += THROTTLE_INTERVAL
+
+    def close(self) -> None:
+        for replica in self.replicas:
+            replica.connection.close()
+
+
+def try_in_place(db, query: str) -> bool:
+    "Run an ALTER TABLE without locking the table, False when the server can't do that for this change"
+    from mysql.connector import DatabaseError
+
+    try:
+        with db.cursor() as cursor:
+            cursor.execute(f"{query.strip().rstrip(';')}, LOCK=NONE;")
+    except DatabaseError as e:
+        if e.errno in _NOT_ONLINE_ERRORS:
+            return False
+        raise
+
+    return True
+
+
+def shadow_alter(db, table: str, clauses: str, options: OnlineOptions | None = None) -> dict:
+    """
+    Change a table without blocking writes to it:
+    a shadow table with the new definition is filled in primary key chunks while triggers copy concurrent writes,
+    then both tables are swapped with an atomic RENAME TABLE.
+    Returns statistics of the copy.
+    """
+    options = options or {}
+    database = db.db_name
+    shadow, old = f"_{table}_new", f"_{table}_old"
+    triggers = [f"_{table}_ins", f"_{table}_upd", f"_{table}_del"]
+
+    with db.cursor() as cursor:
+        primary_key = _primary_key(cursor, database, table)
+        if not len(primary_key) == 1:
+            raise OnlineChangeUnsupported(f"Table {table} needs a single column primary key.")
+        if _has_foreign_keys(cursor, database, table):
+            raise OnlineChangeUnsupported(f"Table {table} has foreign keys.")
+
+        key = primary_key[0]
+        renames = column_renames(clauses)
+
+        #### Shadow table with the new definition
+        cursor.execute(f"DROP TABLE IF EXISTS `{shadow}`;")
+        cursor.execute(f"CREATE TABLE `{shadow}` LIKE `{table}`;")
+        cursor.execute(f"ALTER TABLE `{shadow}` {clauses.strip().rstrip(';')};")
+
+        #### Copy the columns that exist in both, under their new name
+        new_columns = set(_columns(cursor, database, shadow))
+        mapping = [(column, renames.get(column, column)) for column in _columns(cursor, database, table) if renames.get(column, column) in new_columns]
+        new_key = renames.get(key, key)
+        if not any(source == key for source, _ in mapping) or not _primary_key(cursor, database, shadow) == [new_key]:
+            cursor.execute(f"DROP TABLE `{shadow}`;")
+            raise OnlineChangeUnsupported(f"The primary key of {table} does not survive the change.")
+
+        source_list = ", ".join(f"`{source}`" for source, _ in mapping)
+        target_list = ", ".join(f"`{target}`" for _, target in mapping)
+
+    throttle = None
+    try:
+        with db.cursor() as cursor:
+            #### Writes during the copy are applied to the shadow table as well
+            new_values = ", ".join(f"NEW.`{source}`" for source, _ in mapping)
+            cursor.execute(f"CREATE TRIGGER `{triggers[0]}` AFTER INSERT ON `{table}` FOR EACH ROW REPLACE INTO `{shadow}` ({target_list}) VALUES ({new_values});")
+            cursor.execute(
+                f"CREATE TRIGGER `{triggers[1]}` AFTER UPDATE ON `{table}` FOR EACH ROW BEGIN "
+                f"DELETE IGNORE FROM `{shadow}` WHERE `{new_key}` = OLD.`{key}`; "
+                f"REPLACE INTO `{shadow}` ({target_list}) VALUES ({new_values}); END"
+            )
+            cursor.execute(f"CREATE TRIGGER `{triggers[2]}` AFTER DELETE ON `{table}` FOR EACH ROW DELETE IGNORE FROM `{shadow}` WHERE `{new_key}` = OLD.`{key}`;")
+
+        throttle = _Throttle(db, options)
+        stats = _copy_chunks(db, table, shadow, key, new_key, source_list, target_list, throttle, options)
+
+        _progress(options, f"Swapping {table}")
+        with db.cursor() as cursor:
+            cursor.execute(f"RENAME TABLE `{table}` TO `{old}`, `{shadow}` TO `{table}`;")
+            for trigger in triggers:
+                cursor.execute(f"DROP TRIGGER IF EXISTS `{trigger}`;")
+            cursor.execute(f"DROP TABLE `{old}`;")
+
+    except BaseException:
+        #### Leave the original table as it was
+        with db.cursor() as cursor:
+            for trigger in triggers:
+                cursor.execute(f"DROP TRIGGER IF EXISTS `{trigger}`;")
+            cursor.execute(f"DROP TABLE IF EXISTS `{shadow}`;")
+        raise
+
+    finally:
+        if not throttle == None:
+            throttle.close()
+
+    return stats
+
+
+def _copy_chunks(db, table: str, shadow: str, key: str, new_key: str, source_list: str, target_list: str, throttle: _Throttle, options: OnlineOptions) -> dict:
+    "Copy all rows in primary key order, sizing chunks so each takes about `chunk_time` seconds"
+    chunk_size = options.get("chunk_size", DEFAULT_CHUNK_SIZE)
+    chunk_time = options.get("chunk_time", DEFAULT_CHUNK_TIME)
+    start = time.perf_counter()
+    copied, chunks, throttled = 0, 0, 0.0
+
+    with db.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM `{table}`;")
+        estimate = cursor.fetchone()[0]
+
+        cursor.execute(f"SELECT MIN(`{key}`) FROM `{table}`;")
+        lower = cursor.fetchone()[0]
+        if lower == None:
+            return {"rows": 0, "chunks": 0, "seconds": 0.0, "throttled": 0.0}
+
+        #### The first chunk includes the lowest key
+        inclusive = True
+
+        while True:
+            throttled += throttle.wait()
+            chunk_start = time.perf_counter()
+
+            #### Upper bound of this chunk, None when the remaining rows fit in it
+            cursor.execute(f"SELECT `{key}` FROM `{table}` WHERE `{key}` {'>=' if inclusive else '>'} %s ORDER BY `{key}` LIMIT 1 OFFSET %s;", (lower, chunk_size - 1))
+            row = cursor.fetchone()
+            upper = None if row == None else row[0]
+
+            condition = f"`{key}` {'>=' if inclusive else '>'} %s" + ("" if upper == None else f" AND `{key}` <= %s")
+            params = (lower,) if upper == None else (lower, upper)
+
+            #### Rows already copied by a trigger are newer, keep those. No IGNORE, values that don't fit the new definition have to fail the change
+            cursor.execute(f"INSERT INTO `{shadow}` ({target_list}) SELECT {source_list} FROM `{table}` WHERE {condition} ON DUPLICATE KEY UPDATE `{new_key}` = `{new_key}`;", params)
+            copied += cursor.rowcount
+
+            #### Without a strict SQL mode, clipped and truncated values are only warnings
+            if cursor.warning_count > 0:
+                from mysql.connector.errors import DataError
+
+                cursor.execute("SHOW WARNINGS LIMIT 1;")
+                warning = cursor.fetchone()
+                raise DataError(msg=f"Copying {table} changed its data: {warning[2] if not warning == None else 'conversion warning'}")
+            chunks += 1
+
+            if upper == None:
+                break
+
+            lower, inclusive = upper, False
+
+            #### Adapt the chunk size towards the target time, damped to avoid swinging
+            elapsed = max(time.perf_counter() - chunk_start, 0.001)
+            chunk_size = int(min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, chunk_size * (0.5 + 0.5 * chunk_time / elapsed))))
+
+            _progress(options, f"Copying {table}: {copied:,}/{estimate:,} rows, {chunk_size:,} per chunk")
+
+    return {"rows": copied, "chunks": chunks, "seconds": time.perf_counter() - start, "throttled": throttled}
+
+
+def online_alter(db, query: str, options: OnlineOptions | None = None) -> dict | None:
+    """
+    Run an ALTER TABLE without blocking writes.
+    In place when the server supports that for the change, with a shadow copy otherwise. Returns the copy statistics, None when done in place.
+    """
+    match = _ALTER.match(query)
+    if match == None:
+        raise OnlineChangeUnsupported("The statement is not a single ALTER TABLE.")
+
+    if try_in_place(db, query):
+        return None
+
+    return shadow_alter(db, match.group(1), match.group(2), options)
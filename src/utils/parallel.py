@@ -0,0 +1,168 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import heapq
+import queue
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable
+
+from src.utils.bulk_load import DEFAULT_BATCH_SIZE, LoadResult
+from src.utils.events import emit
+from src.utils.plan import PlanStep, journaled_step, run_step
+
+_REFERENCES = re.compile(r"REFERENCES\s+`?(\w+)`?", re.IGNORECASE)
+
+
+def step_tables(step: PlanStep) -> set:
+    "Tables a step depends on: its own table and the tables its foreign keys reference"
+    tables = set() if step["table"] == None else {step["table"]}
+    if step["method"] in ("createtable", "altertable"):
+        tables.update(_REFERENCES.findall(step["query"]))
+    return tables
+
+
+def dependency_graph(steps: list[PlanStep]) -> list[set]:
+    """
+    Prerequisites (positions) of every step.
+    A step waits for the previous step on each of its tables, so statements on a table keep their version order
+    and tables are created before the foreign keys referencing them. Setting the version waits for everything.
+    """
+    prerequisites = []
+    last = {}  ## Table -> position of the last step on it
+
+    for i, step in enumerate(steps):
+        if step["method"] == "version":
+            prerequisites.append(set(range(i)))
+            continue
+
+        tables = step_tables(step)
+        prerequisites.append({last[table] for table in tables if table in last})
+        for table in tables:
+            last[table] = i
+
+    return prerequisites
+
+
+def execute_parallel(steps: list[PlanStep], jobs: int, keys: list | None = None, completed: set | None = None, journal=None, batch_size: int = DEFAULT_BATCH_SIZE, infile: bool = False, on_load: Callable | None = None, profile: str | None = None, online: dict | None = None) -> list[LoadResult]:
+    """
+    Run the steps of a plan over a pool of `jobs` connections, each step as soon as its prerequisites completed.
+    When a step fails, no new steps are started, the running ones finish and the error is raised.
+    """
+    from src.utils.connect import connect_profile
+
+    prerequisites = dependency_graph(steps)
+    dependents = [[] for _ in steps]
+    for i, required in enumerate(prerequisites):
+        for j in required:
+            dependents[j].append(i)
+
+    waiting = [len(required) for required in prerequisites]
+    version_steps = {}
+    for step in steps:
+        version_steps[step["version"]] = version_steps.get(step["version"], 0) + 1
+    version_left = dict(version_steps)
+    version_start = {}
+
+    results = []
+    ready = [i for i in range(len(steps)) if waiting[i] == 0]  ## Heap of positions
+    done = 0
+
+    #### Connections are opened up front, so connection errors surface before anything runs
+    pool = queue.Queue()
+    connections = []
+    try:
+        for _ in range(min(jobs, len(steps))):
+            db = connect_profile(profile, keep=False, allow_local_infile=infile)
+            connections.append(db)
+            pool.put(db)
+    except BaseException:
+        for db in connections:
+            db.connection.close()
+        raise
+
+    def run(step):
+        db = pool.get()
+        try:
+            return run_step(db, step, batch_size=batch_size, load_connection=db.connection if infile else None, online=online)
+        finally:
+            pool.put(db)
+
+    def start(i):
+        step = steps[i]
+        if not step["version"] in version_start:
+            version_start[step["version"]] = time.perf_counter()
+            emit("version_started", version=step["version"], steps=version_steps[step["version"]])
+
+        #### Completed by an earlier, interrupted run
+        if not keys == None and not completed == None and keys[i] in completed:
+            emit("step_skipped", index=i, version=step["version"], table=step["table"], method=step["method"])
+            return None
+
+        return executor.submit(journaled_step, i, None if keys == None else keys[i], journal, run, step)
+
+    def finish(i):
+        nonlocal done
+        done += 1
+        version = steps[i]["version"]
+        version_left[version] -= 1
+        if version_left[version] == 0:
+            emit("version_finished", version=version, seconds=time.perf_counter() - version_start[version])
+
+        for j in dependents[i]:
+            waiting[j] -= 1
+            if waiting[j] == 0:
+                heapq.heappush(ready, j)
+
+    running = {}
+    error = None
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(connections), thread_name_prefix="apply") as executor:
+            while done < len(steps):
+                while error == None and len(ready) > 0:
+                    i = heapq.heappop(ready)  ## Earliest step first
+                    future = start(i)
+                    if future == None:
+                        finish(i)
+                    else:
+                        running[future] = i
+
+                if len(running) == 0:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    i = running.pop(future)
+                    try:
+                        _, result = future.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+
+                    if not result == None:
+                        results.append(result)
+                        if not on_load == None:
+                            on_load(result)
+                    finish(i)
+    finally:
+        for db in connections:
+            db.connection.close()
+
+    if not error == None:
+        raise error
+
+    return results
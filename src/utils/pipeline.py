@@ -0,0 +1,136 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+import time
+from decimal import Decimal
+from typing import TypedDict
+
+from src.utils.events import emit
+
+#### Statements of a version are sent together in packets up to this size, well below the default max_allowed_packet (4 MB before MySQL 8.0)
+MAX_PACKET_BYTES = 1024 * 1024
+
+#### Steps that are a single statement, default data is loaded in bulk on its own
+PIPELINED_METHODS = ("createtable", "altertable", "template", "version")
+
+_PARAM = re.compile(r"%s")
+
+
+class PipelineStats(TypedDict):
+    statements: int  ## Statements sent in packets
+    packets: int
+    round_trips: int  ## Round trips the packets took, including reading the SQL mode once
+    saved: int  ## Round trips saved compared to sending every statement on its own
+
+
+def pipeline_packets(steps: list, keys: list | None = None, completed: set | None = None, online: dict | None = None, max_bytes: int = MAX_PACKET_BYTES) -> dict:
+    """
+    Group consecutive steps of the same version that can be sent in a single multi-statement packet.
+    Returns the position of the first step of every packet -> positions of its steps, packets of one step are left out.
+    """
+    packets = {}
+    current = []
+    size = 0
+
+    def close():
+        if len(current) > 1:
+            packets[current[0]] = list(current)
+        current.clear()
+
+    for i, step in enumerate(steps):
+        pipelined = step["method"] in PIPELINED_METHODS and not (step["method"] == "altertable" and not online == None)
+        skipped = not keys == None and not completed == None and keys[i] in completed
+        step_bytes = len(step["query"].encode()) + 64  ## Room for inlined parameters
+
+        if not pipelined or skipped:
+            close()
+            continue
+
+        if len(current) > 0 and (not step["version"] == steps[current[-1]]["version"] or size + step_bytes > max_bytes):
+            close()
+
+        if len(current) == 0:
+            size = 0
+        current.append(i)
+        size += step_bytes
+
+    close()
+    return packets
+
+
+def inline_params(connection, query: str, params: tuple | None, sql_mode: str | None = None) -> str:
+    "Statement with its parameters escaped into it the way the cursor does, so it can be sent along with others"
+    if not params:
+        return query
+
+    converter = connection.converter
+    values = []
+    for param in params:
+        value = converter.escape(converter.to_mysql(param), sql_mode)
+        if not isinstance(param, Decimal):
+            value = converter.quote(value)
+        values.append(value.decode(connection.python_charset) if isinstance(value, (bytes, bytearray)) else str(value))
+
+    values = iter(values)
+    return _PARAM.sub(lambda _: next(values), query)
+
+
+def run_packet(db, steps: list, positions: list, keys: list | None = None, journal=None, sql_mode: str | None = None) -> None:
+    """
+    Send the steps at `positions` as one multi-statement packet.
+    The server runs them in order and stops at the first statement that fails. Results are read as the statements
+    complete, so every step still reports its own events, journal entry and error.
+    """
+    statements = [inline_params(db.connection, steps[i]["query"], steps[i]["params"], sql_mode) for i in positions]
+    packet = ";\n".join(statement.rstrip().rstrip(";") for statement in statements) + ";"
+
+    #### The connection can't be used while the results are read, the journal must not write its mirror then
+    if not journal == None:
+        journal.flush_before(steps[positions[0]]["version"])
+
+    with db.cursor() as cursor:
+        started = time.perf_counter()
+        results = cursor.execute(packet, multi=True)
+
+        for i in positions:
+            step = steps[i]
+            emit("step_started", index=i, version=step["version"], table=step["table"], method=step["method"])
+
+            try:
+                rows = next(results).rowcount
+            except Exception as e:
+                emit("step_failed", index=i, version=step["version"], table=step["table"], method=step["method"], error=getattr(e, "msg", None) or str(e))
+                if not journal == None:
+                    journal.fail(keys[i], step, getattr(e, "msg", None) or str(e))
+                raise
+
+            if not journal == None:
+                journal.record(keys[i], step)
+
+            finished = time.perf_counter()
+            emit("step_finished", index=i, version=step["version"], table=step["table"], method=step["method"], rows=rows, seconds=finished - started)
+            started = finished
+
+        #### Nothing should be left, but the connection can only be used again once every result is read
+        for _ in results:
+            pass
+
+
+def packet_stats(packets: dict) -> PipelineStats:
+    "Round trips of the packets, compared to running their statements one by one"
+    statements = sum(len(positions) for positions in packets.values())
+    round_trips = len(packets) + (1 if len(packets) > 0 else 0)  ## Reading the SQL mode for escaping
+    return {"statements": statements, "packets": len(packets), "round_trips": round_trips, "saved": max(statements - round_trips, 0)}
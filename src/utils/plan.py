@@ -0,0 +1,517 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import copy
+import re
+import time
+from typing import Callable, TypedDict
+
+from src.utils import globals
+from src.utils.bulk_load import DEFAULT_BATCH_SIZE, LoadResult, insert_batches, load_table
+from src.utils.connect import open_connection
+from src.utils.events import emit
+from src.utils.version_stream import version_number
+
+
+class PlanStep(TypedDict, total=False):
+    version: str | None  ## Version the statement belongs to
+    squashed: list  ## Later versions merged into this statement
+    table: str | None
+    method: str  ## createtable, altertable, default_data, template or version
+    query: str
+    params: tuple | None
+    rows: list | None  ## Default data items, loaded in bulk
+
+
+def _step(version: str | None, table: str | None, method: str, query: str, params: tuple | None = None, rows: list | None = None) -> PlanStep:
+    return {"version": version, "squashed": [], "table": table, "method": method, "query": query.strip(), "params": params, "rows": rows}
+
+
+def build_plan(version_source: dict, status: dict, no_data: bool = False) -> list[PlanStep]:
+    """
+    Compile the pending versions into an ordered list of statements.
+    Generates the same queries as `AlphaDB.update`, attributed to the version they belong to.
+    Returns an empty list when the database is up to date.
+    """
+    from alphadb.utils.exceptions import DBConfigIncomplete, DBTemplateNoMatch, IncompleteVersionData, MissingVersionData
+    from alphadb.utils.globals import CONFIG_TABLE_NAME
+    from alphadb.utils.query.table.altertable import altertable
+    from alphadb.utils.query.table.createtable import createtable
+
+    #### Some error handling
+    if version_source == None:
+        raise MissingVersionData()
+    if not "version" in version_source or not "name" in version_source:
+        raise IncompleteVersionData()
+
+    steps = []
+
+    #### Check if the database template matches, if no template is defined, use the current one
+    if not version_source["name"] == status["template"]:
+        if not status["template"] == None:
+            raise DBTemplateNoMatch()
+
+        steps.append(_step(None, CONFIG_TABLE_NAME, "template", f"UPDATE {CONFIG_TABLE_NAME} SET template = %s WHERE db = %s", (version_source["name"], status["name"])))
+
+    #### If db version number can not be formatted to int, it's invalid
+    try:
+        database_version = version_number(status["version"])
+    except (AttributeError, ValueError):
+        raise DBConfigIncomplete(missing="version")
+
+    if len(version_source["version"]) == 0:
+        return []
+
+    latest = max(version_source["version"], key=lambda x: version_number(x["_id"]))["_id"]
+    if not version_number(latest) > database_version:
+        return []
+
+    for version in version_source["version"]:
+        if version_number(version["_id"]) <= database_version:
+            continue
+
+        #### Create tables
+        for table in version.get("createtable", {}):
+            steps.append(_step(version["_id"], table, "createtable", createtable(version_source=version_source, table_name=table, version=version["_id"])))
+
+        #### Alter tables
+        for table in version.get("altertable", {}):
+            steps.append(_step(version["_id"], table, "altertable", altertable(version_source=version_source, table_name=table, version=version["_id"])))
+
+        #### Insert default data, all rows of a table are loaded in bulk
+        if no_data == False:
+            for table in version.get("default_data", {}):
+                if len(version["default_data"][table]) > 0:
+                    steps.append(_step(version["_id"], table, "default_data", f"INSERT INTO `{table}`", rows=version["default_data"][table]))
+
+    steps.append(_step(latest, CONFIG_TABLE_NAME, "version", f"UPDATE `{CONFIG_TABLE_NAME}` SET version=%s WHERE `db` = %s", (latest, status["name"])))
+
+    return steps
+
+
+def run_step(db, step: PlanStep, batch_size: int = DEFAULT_BATCH_SIZE, load_connection=None, online: dict | None = None) -> tuple[int, LoadResult | None]:
+    """
+    Run a single plan step on `db`, default data is loaded over `load_connection` when given.
+    Returns the number of affected rows, and the load result of default data.
+    """
+    if step["method"] == "default_data":
+        result = load_table(db.connection if load_connection == None else load_connection, step["table"], step["rows"], batch_size=batch_size, infile=not load_connection == None)
+        return result["rows"], result
+
+    if not online == None and step["method"] == "altertable":
+        from src.utils.online import online_alter
+
+        copy = online_alter(db, step["query"], online)
+        return 0 if copy == None else copy["rows"], None
+
+    with db.cursor() as cursor:
+        cursor.execute(step["query"], step["params"])
+        return cursor.rowcount, None
+
+
+def journaled_step(index: int, key: str | None, journal, run: Callable, step: PlanStep) -> tuple[int, LoadResult | None]:
+    "Run a step through `run`, reporting it as events and recording it in the journal"
+    emit("step_started", index=index, version=step["version"], table=step["table"], method=step["method"])
+    start = time.perf_counter()
+
+    try:
+        rows, result = run(step)
+    except Exception as e:
+        emit("step_failed", index=index, version=step["version"], table=step["table"], method=step["method"], error=getattr(e, "msg", None) or str(e))
+        if not journal == None:
+            journal.fail(key, step, getattr(e, "msg", None) or str(e))
+        raise
+
+    if not journal == None:
+        journal.record(key, step)
+
+    emit("step_finished", index=index, version=step["version"], table=step["table"], method=step["method"], rows=rows, seconds=time.perf_counter() - start)
+    return rows, result
+
+
+def execute_plan(steps: list[PlanStep], batch_size: int = DEFAULT_BATCH_SIZE, infile: bool = False, on_load: Callable | None = None, on_step: Callable | None = None, db=None, profile: str | None = None, online: dict | None = None, template: str | None = None, journal=None, jobs: int = 1, pipeline: bool = False) -> list[LoadResult]:
+    """
+    Run the statements of a plan on the active connection, or on `db` when given.
+    Default data is loaded per table in a single transaction, `on_load` is called with the result of every table.
+    `on_step` is called with the position and step before each step runs, raising from it aborts the plan.
+    With `online` (OnlineOptions), ALTER TABLE statements run without blocking writes.
+    With a `journal`, every completed step is recorded and steps it has recorded as completed are skipped.
+    With more than one of `jobs`, steps on unrelated tables run concurrently, see `parallel`.
+    With `pipeline`, consecutive statements of a version are sent in multi-statement packets, see `pipeline`.
+    Progress is reported through `events`.
+    """
+    if db == None:
+        db = globals.db
+
+    keys = None
+    completed = set()
+    if not journal == None:
+        from src.utils.journal import step_keys
+
+        keys = step_keys(steps)
+        completed = journal.completed()
+        journal.start()
+
+    versions = list(dict.fromkeys(step["version"] for step in steps))
+    emit("plan_started", steps=len(steps), versions=versions, database=db.db_name, template=template)
+    plan_start = time.perf_counter()
+    failed = True
+
+    try:
+        if jobs > 1:
+            from src.utils.parallel import execute_parallel
+
+            results = execute_parallel(steps, jobs, keys=keys, completed=completed, journal=journal, batch_size=batch_size, infile=infile, on_load=on_load, profile=profile, online=online)
+        else:
+            results = _execute_sequential(steps, db, keys=keys, completed=completed, journal=journal, batch_size=batch_size, infile=infile, on_load=on_load, on_step=on_step, profile=profile, online=online, pipeline=pipeline)
+
+        if not journal == None:
+            journal.finish()
+
+        failed = False
+    finally:
+        if not journal == None:
+            journal.close()
+
+        emit("plan_finished", steps=len(steps), seconds=time.perf_counter() - plan_start, failed=failed)
+
+    return results
+
+
+def _execute_sequential(steps: list[PlanStep], db, keys, completed, journal, batch_size, infile, on_load, on_step, profile, online, pipeline=False) -> list[LoadResult]:
+    from src.utils.pipeline import packet_stats, pipeline_packets, run_packet
+
+    results = []
+    infile_connection = None
+    version_start = None
+    packets = pipeline_packets(steps, keys, completed, online) if pipeline else {}
+    sent = 0  ## Steps before this position were already sent in a packet
+    sql_mode = None
+
+    #### Read once, parameters are escaped into the packets according to it
+    if len(packets) > 0:
+        sql_mode = db.connection.sql_mode
+
+    def run(step):
+        nonlocal infile_connection
+
+        #### Local infile has to be enabled when the connection is opened
+        if infile and step["method"] == "default_data" and infile_connection == None:
+            infile_connection = open_connection(profile=profile, allow_local_infile=True)
+
+        return run_step(db, step, batch_size=batch_size, load_connection=infile_connection if infile else None, online=online)
+
+    try:
+        for i, step in enumerate(steps):
+            if not on_step == None and i >= sent:
+                on_step(i, step)
+
+            #### Steps of a version are consecutive
+            if i == 0 or not step["version"] == steps[i - 1]["version"]:
+                version_start = time.perf_counter()
+                emit("version_started", version=step["version"], steps=sum(1 for s in steps if s["version"] == step["version"]))
+
+            #### Completed by an earlier, interrupted run
+            if not keys == None and keys[i] in completed:
+                emit("step_skipped", index=i, version=step["version"], table=step["table"], method=step["method"])
+
+            elif i in packets:
+                if not on_step == None:
+                    for j in packets[i][1:]:
+                        on_step(j, steps[j])
+
+                run_packet(db, steps, packets[i], keys=keys, journal=journal, sql_mode=sql_mode)
+                sent = packets[i][-1] + 1
+
+            elif i < sent:
+                pass  ## Ran in the packet
+
+            else:
+                _, result = journaled_step(i, None if keys == None else keys[i], journal, run, step)
+                if not result == None:
+                    results.append(result)
+                    if not on_load == None:
+                        on_load(result)
+
+            if i == len(steps) - 1 or not step["version"] == steps[i + 1]["version"]:
+                emit("version_finished", version=step["version"], seconds=time.perf_counter() - version_start)
+    finally:
+        if not infile_connection == None:
+            infile_connection.close()
+
+    if pipeline:
+        emit("pipeline_finished", **packet_stats(packets))
+
+    return results
+
+
+def render_query(step: PlanStep) -> str:
+    "Statement with its parameters filled in, for display only"
+    if step["method"] == "default_data":
+        return "\n".join(render_query({**step, "method": "insert", "query": query, "params": params}) for query, params in insert_batches(step["table"], step["rows"]))
+
+    if not step["params"]:
+        return step["query"]
+
+    values = tuple("NULL" if p == None else "'" + str(p).replace("'", "''") + "'" for p in step["params"])
+    return step["query"].replace("%s", "{}").format(*values)
+
+
+def print_plan(steps: list[PlanStep]) -> None:
+    "Print a plan as SQL, grouped by version"
+    current = object()
+    for step in steps:
+        if not step["version"] == current:
+            current = step["version"]
+            print("\n-- Template" if current == None else f"\n-- Version {current}")
+
+        if step["squashed"]:
+            print(f"-- Includes version {', '.join(step['squashed'])}")
+
+        query = render_query(step)
+        print(query if query.endswith(";") else query + ";")
+
+    print()
+
+
+#### Squashing
+
+_CLAUSES = (
+    ("drop_pk", re.compile(r"DROP PRIMARY KEY$", re.I)),
+    ("drop", re.compile(r"DROP COLUMN (\S+)$", re.I)),
+    ("add", re.compile(r"ADD (?:COLUMN )?(\S+) (.+)$", re.I | re.S)),
+    ("modify", re.compile(r"MODIFY COLUMN (\S+) (.+)$", re.I | re.S)),
+    ("rename", re.compile(r"RENAME COLUMN (\S+) TO (\S+)$", re.I)),
+)
+_REFERENCES = re.compile(r"REFERENCES\s+`?(\w+)`?", re.I)
+
+#### Every MODIFY/ADD with these creates another index, two definitions merged into one would create one less
+_INDEXES = re.compile(r"\b(UNIQUE|PRIMARY\s+KEY)\b", re.I)
+
+
+class _Conflict(Exception):
+    "The clause can not be merged into the statement"
+
+
+def split_clauses(body: str) -> list[str]:
+    "Split the clauses of an ALTER TABLE on commas outside of quotes and parentheses"
+    clauses, depth, quote, start = [], 0, None, 0
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if quote:
+            if char == "\\":
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in "'\"`":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            clauses.append(body[start:i].strip())
+            start = i + 1
+        i += 1
+
+    clauses.append(body[start:].strip())
+    return [c for c in clauses if c]
+
+
+def _parse_clause(text: str) -> dict:
+    for kind, pattern in _CLAUSES:
+        match = pattern.match(text)
+        if match == None:
+            continue
+        if kind == "drop_pk":
+            return {"kind": kind}
+        if kind == "drop":
+            return {"kind": kind, "column": match.group(1)}
+        if kind == "rename":
+            return {"kind": kind, "column": match.group(1), "new": match.group(2)}
+        return {"kind": kind, "column": match.group(1), "definition": match.group(2)}
+
+    return {"kind": "other", "text": text}
+
+
+def _render_clause(clause: dict) -> str:
+    match clause["kind"]:
+        case "drop_pk":
+            return "DROP PRIMARY KEY"
+        case "drop":
+            return f"DROP COLUMN {clause['column']}"
+        case "add":
+            return f"ADD {clause['column']} {clause['definition']}"
+        case "modify":
+            return f"MODIFY COLUMN {clause['column']} {clause['definition']}"
+        case "change":
+            return f"CHANGE COLUMN {clause['column']} {clause['new']} {clause['definition']}"
+        case "rename":
+            return f"RENAME COLUMN {clause['column']} TO {clause['new']}"
+    return clause["text"]
+
+
+def _names(clauses: list) -> set:
+    "All column names referenced by the clauses, before and after the statement"
+    names = set()
+    for clause in clauses:
+        names.update(n for n in (clause.get("column"), clause.get("new")) if not n == None)
+    return names
+
+
+def _resulting(clauses: list, column: str) -> dict | None:
+    "The clause that leaves a column named `column` behind"
+    for clause in clauses:
+        if clause["kind"] in ("add", "modify") and clause["column"] == column:
+            return clause
+        if clause["kind"] in ("change", "rename") and clause["new"] == column:
+            return clause
+    return None
+
+
+def _merge_clause(clauses: list, clause: dict) -> None:
+    """
+    Merge a clause that runs after `clauses` into them, as if it were part of the same statement.
+    Raises _Conflict when that would change the outcome.
+    """
+    kind = clause["kind"]
+
+    if kind == "drop_pk":
+        if any(c["kind"] == "drop_pk" for c in clauses):
+            raise _Conflict()
+        clauses.append(clause)
+        return
+
+    if kind == "other":
+        raise _Conflict()
+
+    column = clause["column"]
+    previous = _resulting(clauses, column)
+
+    #### Untouched column, the clause can simply be added
+    if previous == None:
+        if column in _names(clauses) or (kind == "rename" and clause["new"] in _names(clauses)):
+            raise _Conflict()
+        clauses.append(clause)
+        return
+
+    match kind:
+        case "drop":
+            #### Added and dropped again, both cancel out
+            if previous["kind"] == "add":
+                clauses.remove(previous)
+            else:
+                clauses[clauses.index(previous)] = {"kind": "drop", "column": previous["column"]}
+
+        case "add":
+            raise _Conflict()
+
+        case "modify":
+            if not previous["kind"] == "rename" and (_INDEXES.search(previous["definition"]) or _INDEXES.search(clause["definition"])):
+                raise _Conflict()
+
+            if previous["kind"] == "rename":
+                clauses[clauses.index(previous)] = {"kind": "change", "column": previous["column"], "new": column, "definition": clause["definition"]}
+            else:
+                previous["definition"] = clause["definition"]
+
+        case "rename":
+            new = clause["new"]
+            if new in _names(clauses) and not (previous["kind"] == "rename" and previous["column"] == new):
+                raise _Conflict()
+
+            if previous["kind"] == "add":
+                previous["column"] = new
+            elif previous["kind"] == "modify":
+                clauses[clauses.index(previous)] = {"kind": "change", "column": column, "new": new, "definition": previous["definition"]}
+            elif previous["kind"] == "rename" and previous["column"] == new:
+                clauses.remove(previous)  ## Renamed back
+            else:
+                previous["new"] = new
+
+
+def _alter_clauses(step: PlanStep) -> list | None:
+    "Parse the clauses of an ALTER TABLE step, None if it can't be merged with others"
+    match = re.match(rf"ALTER TABLE `?{re.escape(step['table'])}`?\s(.+?);?\s*$", step["query"], re.I | re.S)
+    if match == None:
+        return None
+
+    clauses = []
+    try:
+        for text in split_clauses(match.group(1)):
+            _merge_clause(clauses, _parse_clause(text))
+    except _Conflict:
+        return None
+
+    return clauses
+
+
+def squash_plan(steps: list[PlanStep]) -> list[PlanStep]:
+    """
+    Merge consecutive ALTER TABLE statements on the same table into one, so the table is rebuilt once.
+    Later statements are moved up into the earlier one, as long as no statement in between touches the table.
+    Operations that cancel out (adding and dropping a column) are left out entirely.
+    """
+    result = []
+    open_groups = {}  ## table -> ALTER TABLE step later statements on that table can merge into
+    merged_clauses = {}  ## id(step) -> clauses of that step, including the merged ones
+
+    for step in steps:
+        if step["method"] == "altertable":
+            clauses = _alter_clauses(step)
+            group = open_groups.get(step["table"])
+
+            if not clauses == None and not group == None:
+                merged = copy.deepcopy(merged_clauses[id(group)])
+                try:
+                    for clause in clauses:
+                        _merge_clause(merged, clause)
+                except _Conflict:
+                    pass
+                else:
+                    merged_clauses[id(group)] = merged
+                    group["squashed"].append(step["version"])
+                    continue
+
+            step = {**step, "squashed": list(step["squashed"])}
+            result.append(step)
+
+            if clauses == None:
+                open_groups.pop(step["table"], None)
+            else:
+                open_groups[step["table"]] = step
+                merged_clauses[id(step)] = clauses
+            continue
+
+        #### Statements touching a table end its merge window
+        open_groups.pop(step["table"], None)
+        for table in _REFERENCES.findall(step["query"]):
+            open_groups.pop(table, None)
+
+        result.append(step)
+
+    #### Write the merged statements, dropping those where everything cancelled out
+    squashed = []
+    for step in result:
+        if step["method"] == "altertable" and step["squashed"]:
+            clauses = merged_clauses[id(step)]
+            if len(clauses) == 0:
+                continue
+            step["query"] = f"ALTER TABLE {step['table']} {', '.join(_render_clause(c) for c in clauses)};"
+
+        squashed.append(step)
+
+    return squashed
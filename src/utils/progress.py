@@ -0,0 +1,184 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+from datetime import timedelta
+
+from rich.progress import BarColumn, Progress, ProgressColumn, SpinnerColumn, TextColumn
+from rich.text import Text
+
+from src.utils import headless
+from src.utils.common import console
+from src.utils.events import subscribe
+from src.utils.timings import Timings
+
+#### Statement names shown for the plan step methods
+_LABELS = {"createtable": "CREATE TABLE", "altertable": "ALTER TABLE", "default_data": "INSERT INTO", "template": "Setting template", "version": "Setting version"}
+
+
+def _duration(seconds: float) -> str:
+    return str(timedelta(seconds=int(max(seconds, 0))))
+
+
+class _StatusColumn(ProgressColumn):
+    "Running statement with the time it has been running, and the estimated time left"
+
+    def render(self, task) -> Text:
+        text = Text()
+        if task.fields.get("note"):
+            text.append(task.fields["note"], style="yellow")
+        elif task.fields.get("statement"):
+            running = time.monotonic() - task.fields["step_started"]
+            text.append(f"{task.fields['statement']} ", style="cyan")
+            text.append(f"{running:.1f}s", style="yellow" if running > task.fields.get("step_estimate", 0) * 3 + 1 else "dim")
+
+        if task.fields.get("eta") and not task.finished:
+            text.append(f"  ETA {_duration(task.fields['eta']())}", style="dim")
+        return text
+
+
+class UpdateProgress:
+    """
+    Progress bars for an update, one for the whole plan and one per running version.
+    Driven by plan events, with the estimates (and ETA) based on the timings of earlier updates.
+    Steps may run concurrently (update --jobs), so running steps and versions are tracked by position.
+    The timings of this run are stored when it finishes.
+    """
+
+    def __init__(self, steps: list, template: str | None):
+        self.steps = steps
+        self.template = template
+        self.timings = Timings()
+        self.estimates = [self.timings.estimate(template, step) for step in steps]
+        self.lock = threading.Lock()
+
+        self.done_estimate = 0.0  ## Estimated seconds of the finished steps
+        self.done_actual = 0.0  ## Actual seconds of the finished steps
+        self.done_steps = 0
+        self.running = {}  ## Position -> start of the running steps
+        self.versions = {}  ## Version -> {task, statements, rows, steps, estimate, done_estimate}
+
+        self.progress = Progress(
+            SpinnerColumn(spinner_name="bouncingBall"),
+            TextColumn("{task.description}"),
+            BarColumn(),
+            TextColumn("{task.fields[count]}"),
+            _StatusColumn(),
+            console=console,
+        )
+        self.total_task = self.progress.add_task("Updating", total=sum(self.estimates) or 1, count=f"0/{len(steps)} steps", eta=self._eta)
+
+    def _ratio(self) -> float:
+        "How much slower (or faster) this run is than estimated so far"
+        if self.done_estimate <= 0:
+            return 1.0
+        return min(max(self.done_actual / self.done_estimate, 0.1), 10.0)
+
+    def _running(self, selected) -> float:
+        "Estimated seconds of the running (selected) steps that have passed already"
+        now = time.monotonic()
+        return sum(min(now - started, self.estimates[i]) for i, started in list(self.running.items()) if selected(self.steps[i]))
+
+    def _eta(self) -> float:
+        remaining = sum(self.estimates) - self.done_estimate - self._running(lambda step: True)
+        return remaining * self._ratio()
+
+    def _version_eta(self, version) -> float:
+        state = self.versions.get(version)
+        if state == None:
+            return 0
+        remaining = state["estimate"] - state["done_estimate"] - self._running(lambda step: step["version"] == version)
+        return remaining * self._ratio()
+
+    def note(self, message: str) -> None:
+        "Show a message instead of the running statement of the latest version, until its next statement"
+        with self.lock:
+            if len(self.versions) > 0:
+                self.progress.update(list(self.versions.values())[-1]["task"], note=message)
+
+    def _step_done(self, event: dict, estimate: float) -> None:
+        state = self.versions[event["version"]]
+        state["statements"] += 1
+        state["done_estimate"] += estimate
+        self.done_steps += 1
+        self.progress.update(state["task"], advance=estimate, count=f"{state['statements']}/{state['steps']}")
+        self.progress.update(self.total_task, advance=estimate, total=sum(self.estimates) or 1, count=f"{self.done_steps}/{len(self.steps)} steps")
+
+    def _handle(self, event: dict) -> None:
+        with self.lock:
+            match event["event"]:
+                case "version_started":
+                    version = event["version"]
+                    estimate = sum(e for i, e in enumerate(self.estimates) if self.steps[i]["version"] == version)
+                    self.versions[version] = {
+                        "task": self.progress.add_task(
+                            "Template" if version == None else f"Version {version}",
+                            total=estimate or 1,
+                            count=f"0/{event['steps']}",
+                            eta=lambda: self._version_eta(version),
+                        ),
+                        "statements": 0,
+                        "rows": 0,
+                        "steps": event["steps"],
+                        "estimate": estimate,
+                        "done_estimate": 0.0,
+                    }
+
+                case "step_started":
+                    i = event["index"]
+                    self.running[i] = time.monotonic()
+                    self.progress.update(
+                        self.versions[event["version"]]["task"],
+                        statement=f"{_LABELS.get(event['method'], event['method'])} {event['table'] or ''}".strip(),
+                        step_started=self.running[i],
+                        step_estimate=self.estimates[i] * self._ratio(),
+                        note=None,
+                    )
+
+                case "step_finished":
+                    i = event["index"]
+                    self.running.pop(i, None)
+                    self.done_estimate += self.estimates[i]
+                    self.done_actual += event["seconds"]
+                    self.versions[event["version"]]["rows"] += max(event["rows"] or 0, 0)
+                    self.timings.record(self.template, event)
+                    self._step_done(event, self.estimates[i])
+
+                case "step_skipped":
+                    self.estimates[event["index"]] = 0  ## Not part of the ETA
+                    self._step_done(event, 0)
+
+                case "version_finished":
+                    state = self.versions.pop(event["version"])
+                    self.progress.remove_task(state["task"])
+                    name = "Template set" if event["version"] == None else f"Version [cyan]{event['version']}[/cyan] applied"
+                    if not headless.enabled():  ## The version_finished event says the same
+                        console.print(f"[green]{name}[/green] in {event['seconds']:.2f}s ({state['statements']} statements, {state['rows']:,} rows)", highlight=False)
+
+                case "plan_finished":
+                    self.timings.save()
+
+    def __enter__(self):
+        self.unsubscribe = subscribe(self._handle)
+        #### Headless, the update events are written as they are, timings are still recorded
+        if not headless.enabled():
+            self.progress.start()
+        return self
+
+    def __exit__(self, *_):
+        if not headless.enabled():
+            self.progress.stop()
+        self.unsubscribe()
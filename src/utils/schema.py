@@ -0,0 +1,319 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import re
+from datetime import datetime
+from typing import TypedDict
+
+from src.utils.version_stream import version_number
+
+#### Column attributes, as named in version sources
+ATTRIBUTES = ("type", "length", "null", "unique", "default", "a_i")
+
+#### Integer types report their display width only on older servers, so it is only compared when present
+INTEGER_TYPES = ("INT", "TINYINT", "BIGINT")
+
+#### Types whose length is part of the definition on every server
+LENGTH_TYPES = ("VARCHAR",)
+
+
+class ColumnModel(TypedDict):
+    type: str
+    length: int | None
+    null: bool
+    unique: bool
+    default: str | None
+    a_i: bool
+
+
+class TableModel(TypedDict):
+    columns: dict  ## name -> ColumnModel, in definition order
+    primary_key: str | None
+    foreign_keys: list  ## [{"column": ..., "references": ...}]
+
+
+class Snapshot(TypedDict):
+    database: str
+    version: str | None
+    taken: str
+    tables: dict  ## name -> TableModel
+
+
+class Drift(TypedDict):
+    table: str
+    column: str | None
+    kind: str  ## missing_table, unexpected_table, missing_column, unexpected_column, attribute, primary_key, foreign_key
+    attribute: str | None
+    expected: object
+    actual: object
+
+
+def _column(definition: dict) -> ColumnModel:
+    "Column model from a version source definition, with the defaults AlphaDB applies"
+    return {
+        "type": str(definition.get("type", "")).upper(),
+        "length": definition.get("length"),
+        "null": bool(definition.get("null", False)),
+        "unique": bool(definition.get("unique", False)),
+        "default": str(definition["default"]) if definition.get("default") else None,  ## Falsy defaults are not written by AlphaDB
+        "a_i": bool(definition.get("a_i", False)),
+    }
+
+
+def _is_column(name: str, value) -> bool:
+    "Table data mixes columns with table attributes (primary_key, foreign_key)"
+    return isinstance(value, dict) and not name == "foreign_key"
+
+
+def _create_table(table_data: dict) -> TableModel:
+    table: TableModel = {"columns": {}, "primary_key": table_data.get("primary_key"), "foreign_keys": []}
+
+    for name, value in table_data.items():
+        if _is_column(name, value):
+            table["columns"][name] = _column(value)
+
+    foreign_key = table_data.get("foreign_key")
+    if isinstance(foreign_key, dict) and "key" in foreign_key and "references" in foreign_key:
+        table["foreign_keys"].append({"column": foreign_key["key"], "references": foreign_key["references"]})
+
+    return table
+
+
+def _alter_table(table: TableModel, table_data: dict) -> None:
+    "Apply an altertable in the order AlphaDB puts the clauses in: drop, add, modify, rename, primary key"
+    columns = table["columns"]
+
+    #### AUTO_INCREMENT is removed from the old primary key when it changes
+    if "primary_key" in table_data and table["primary_key"] in columns:
+        columns[table["primary_key"]]["a_i"] = False
+
+    #### Dropping a key column drops the key along with it
+    for name in table_data.get("dropcolumn", []):
+        columns.pop(name, None)
+        if table["primary_key"] == name:
+            table["primary_key"] = None
+        table["foreign_keys"] = [fk for fk in table["foreign_keys"] if not fk["column"] == name]
+
+    for name, value in table_data.get("addcolumn", {}).items():
+        if _is_column(name, value):
+            columns[name] = _column(value)
+
+    for name, value in table_data.get("modifycolumn", {}).items():
+        if not _is_column(name, value):
+            continue
+
+        #### Without recreate, the given attributes are merged into the current definition
+        if value.get("recreate") == False and name in columns:
+            merged = _column(value)
+            columns[name] = {attribute: merged[attribute] if attribute in value else columns[name][attribute] for attribute in ATTRIBUTES}
+        else:
+            columns[name] = _column(value)
+
+    renames = table_data.get("renamecolumn", {})
+    if renames:
+        table["columns"] = {renames.get(name, name): column for name, column in columns.items()}
+        if table["primary_key"] in renames:
+            table["primary_key"] = renames[table["primary_key"]]
+        for foreign_key in table["foreign_keys"]:
+            foreign_key["column"] = renames.get(foreign_key["column"], foreign_key["column"])
+
+    if "primary_key" in table_data:
+        table["primary_key"] = table_data["primary_key"]
+
+
+def replay(version_source: dict, up_to: str | None = None) -> dict:
+    """
+    Expected schema after applying the versions of a version source, up to and including version `up_to`.
+    Nothing is executed, the createtable and altertable operations are replayed on an in-memory model.
+    """
+    tables = {}
+    limit = None if up_to == None else version_number(up_to)
+
+    for version in version_source.get("version", []):
+        if not limit == None and version_number(version["_id"]) > limit:
+            continue
+
+        apply_version(tables, version)
+
+    return tables
+
+
+def apply_version(tables: dict, version: dict) -> None:
+    "Replay the createtable and altertable operations of a single version on `tables`"
+    for name, table_data in version.get("createtable", {}).items():
+        tables[name] = _create_table(table_data)
+
+    for name, table_data in version.get("altertable", {}).items():
+        if name in tables:
+            _alter_table(tables[name], table_data)
+
+
+#### Live schema
+
+_COLUMN_TYPE = re.compile(r"\w+\((\d+)")
+
+
+def fetch_snapshot(db) -> Snapshot:
+    "Schema of the connected database, fetched in two information_schema queries for all tables at once"
+    from alphadb.utils.globals import CONFIG_TABLE_NAME
+    from src.utils.journal import JOURNAL_TABLE_NAME
+
+    tables = {}
+
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT, COLUMN_KEY, EXTRA "
+            "FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s ORDER BY TABLE_NAME, ORDINAL_POSITION",
+            (db.db_name,),
+        )
+        for table_name, column_name, data_type, column_type, nullable, default, key, extra in cursor.fetchall():
+            if table_name in (CONFIG_TABLE_NAME, JOURNAL_TABLE_NAME):
+                continue
+
+            table = tables.setdefault(table_name, {"columns": {}, "primary_key": None, "foreign_keys": []})
+            length = _COLUMN_TYPE.match(column_type)
+
+            #### MariaDB returns string defaults quoted
+            if isinstance(default, str) and len(default) > 1 and default[0] == default[-1] == "'":
+                default = default[1:-1]
+            if default == "NULL":
+                default = None
+
+            table["columns"][column_name] = {
+                "type": data_type.upper(),
+                "length": int(length.group(1)) if length else None,
+                "null": nullable == "YES",
+                "unique": key in ("UNI", "PRI"),
+                "default": default,
+                "a_i": "auto_increment" in extra.lower(),
+            }
+
+            if key == "PRI":
+                table["primary_key"] = column_name if table["primary_key"] == None else f"{table['primary_key']},{column_name}"
+
+        cursor.execute(
+            "SELECT TABLE_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME FROM information_schema.KEY_COLUMN_USAGE "
+            "WHERE TABLE_SCHEMA = %s AND REFERENCED_TABLE_NAME IS NOT NULL ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION",
+            (db.db_name,),
+        )
+        for table_name, column_name, referenced in cursor.fetchall():
+            if table_name in tables:
+                tables[table_name]["foreign_keys"].append({"column": column_name, "references": referenced})
+
+    return {"database": db.db_name, "version": None, "taken": datetime.now().isoformat(timespec="seconds"), "tables": tables}
+
+
+def save_snapshot(snapshot: Snapshot, path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(snapshot, f, indent=2)
+
+
+def load_snapshot(path: str) -> Snapshot:
+    with open(path) as f:
+        return json.load(f)
+
+
+#### Comparison
+
+
+def _drift(table: str, column: str | None, kind: str, attribute: str | None = None, expected=None, actual=None) -> Drift:
+    return {"table": table, "column": column, "kind": kind, "attribute": attribute, "expected": expected, "actual": actual}
+
+
+def _compare_column(table: str, name: str, expected: ColumnModel, actual: ColumnModel) -> list[Drift]:
+    drift = []
+
+    for attribute in ATTRIBUTES:
+        want, have = expected[attribute], actual[attribute]
+
+        if attribute == "length":
+            if want == None or have == None:
+                continue
+            if not expected["type"] in LENGTH_TYPES + INTEGER_TYPES:
+                continue  ## TEXT and friends pick a storage type from the length instead of keeping it
+
+        #### Primary keys are always unique
+        if attribute == "unique" and want == False and have == True:
+            continue
+
+        if attribute == "default" and not want == None and not have == None:
+            want, have = str(want), str(have)
+
+        if not want == have:
+            drift.append(_drift(table, name, "attribute", attribute, want, have))
+
+    return drift
+
+
+def compare(expected: dict, actual: dict) -> list[Drift]:
+    "Differences between the expected (replayed) tables and the actual (snapshot) tables"
+    drift = []
+
+    for table_name, table in expected.items():
+        if not table_name in actual:
+            drift.append(_drift(table_name, None, "missing_table"))
+            continue
+
+        live = actual[table_name]
+
+        for name, column in table["columns"].items():
+            if not name in live["columns"]:
+                drift.append(_drift(table_name, name, "missing_column", expected=column["type"]))
+            else:
+                drift += _compare_column(table_name, name, column, live["columns"][name])
+
+        for name in live["columns"]:
+            if not name in table["columns"]:
+                drift.append(_drift(table_name, name, "unexpected_column", actual=live["columns"][name]["type"]))
+
+        if not table["primary_key"] == live["primary_key"]:
+            drift.append(_drift(table_name, None, "primary_key", expected=table["primary_key"], actual=live["primary_key"]))
+
+        expected_keys = {(fk["column"], fk["references"]) for fk in table["foreign_keys"]}
+        live_keys = {(fk["column"], fk["references"]) for fk in live["foreign_keys"]}
+        for column, references in sorted(expected_keys - live_keys):
+            drift.append(_drift(table_name, column, "foreign_key", expected=references))
+        for column, references in sorted(live_keys - expected_keys):
+            drift.append(_drift(table_name, column, "foreign_key", actual=references))
+
+    for table_name in actual:
+        if not table_name in expected:
+            drift.append(_drift(table_name, None, "unexpected_table"))
+
+    return drift
+
+
+def describe(drift: Drift) -> str:
+    "Human readable description of a difference"
+    target = drift["table"] if drift["column"] == None else f"{drift['table']}.{drift['column']}"
+
+    match drift["kind"]:
+        case "missing_table":
+            return f"{target}: table is missing"
+        case "unexpected_table":
+            return f"{target}: table is not defined in the version source"
+        case "missing_column":
+            return f"{target}: column is missing"
+        case "unexpected_column":
+            return f"{target}: column is not defined in the version source"
+        case "primary_key":
+            return f"{target}: primary key is {drift['actual']}, expected {drift['expected']}"
+        case "foreign_key":
+            if drift["actual"] == None:
+                return f"{target}: foreign key to {drift['expected']} is missing"
+            return f"{target}: unexpected foreign key to {drift['actual']}"
+
+    return f"{target}: {drift['attribute']} is {drift['actual']}, expected {drift['expected']}"
@@ -0,0 +1,266 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import queue
+import random
+import string
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from src.utils.bulk_load import DEFAULT_BATCH_SIZE, LoadResult
+
+#### Connections inserting rows at the same time
+DEFAULT_WORKERS = 4
+
+#### Rows generated and committed per job. Every job has its own random generator, so the rows don't depend on the scheduling
+JOB_ROWS = 50_000
+
+#### Share of NULL values in nullable columns
+NULL_RATIO = 0.1
+
+#### Parent keys (the lowest) foreign key columns pick from
+FOREIGN_KEY_SAMPLE = 100_000
+
+#### Value ranges of the supported types, DECIMAL without a length is DECIMAL(10)
+INTEGER_RANGES = {"TINYINT": (-(2**7), 2**7 - 1), "INT": (-(2**31), 2**31 - 1), "BIGINT": (-(2**63), 2**63 - 1)}
+DEFAULT_DECIMAL_LENGTH = 10
+DATETIME_START = 946684800  ## 2000-01-01
+DATETIME_SPAN = 30 * 365 * 86400
+
+_ALPHABET = string.ascii_letters + string.digits
+_WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet", "kilo", "lima", "mike", "november", "oscar", "papa")
+
+
+def seed_order(tables: dict) -> list:
+    "Table names with the tables referenced by foreign keys first, so their keys exist when the referencing rows are generated"
+    order = []
+    visiting = set()
+
+    def visit(name):
+        if name in order or name in visiting or not name in tables:
+            return
+        visiting.add(name)  ## Cycles are broken where they are found
+        for foreign_key in tables[name]["foreign_keys"]:
+            visit(foreign_key["references"])
+        order.append(name)
+
+    for name in tables:
+        visit(name)
+
+    return order
+
+
+def _datetime(seconds: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(seconds))
+
+
+def column_generator(name: str, column: dict, unique: bool, start: int, parent_keys: list | None = None) -> Callable:
+    """
+    Function (rng, row number) -> value for a column model (see schema.ColumnModel).
+    Unique columns derive their value from the row number, counted from `start`, so they never repeat.
+    Foreign key columns pick from `parent_keys`. Raises ValueError when the column can't hold the rows asked for.
+    """
+    generate = _values(name, column, unique, start, parent_keys)
+
+    #### Unique columns always get a value
+    if column["null"] and not unique:
+        return lambda rng, i: None if rng.random() < NULL_RATIO else generate(rng, i)
+
+    return generate
+
+
+def _values(name: str, column: dict, unique: bool, start: int, parent_keys: list | None) -> Callable:
+    kind = column["type"]
+    length = column["length"]
+
+    if not parent_keys == None:
+        if len(parent_keys) == 0:
+            if not column["null"]:
+                raise ValueError(f"Column {name} references a table without rows")
+            return lambda rng, i: None
+        return lambda rng, i: rng.choice(parent_keys)
+
+    if kind in INTEGER_RANGES:
+        low, high = INTEGER_RANGES[kind]
+        if unique:
+            return lambda rng, i: _unique_number(name, start + i, high)
+        return lambda rng, i: rng.randint(low, high)
+
+    if kind == "DECIMAL":
+        high = 10 ** (length or DEFAULT_DECIMAL_LENGTH) - 1
+        if unique:
+            return lambda rng, i: _unique_number(name, start + i, high)
+        return lambda rng, i: rng.randint(-high, high)
+
+    if kind == "FLOAT":
+        if unique:
+            return lambda rng, i: float(start + i)
+        return lambda rng, i: round(rng.uniform(-1e6, 1e6), 4)
+
+    if kind == "DATETIME":
+        if unique:
+            return lambda rng, i: _datetime(DATETIME_START + start + i)
+        return lambda rng, i: _datetime(DATETIME_START + rng.randrange(DATETIME_SPAN))
+
+    if kind == "VARCHAR":
+        length = length or 255
+        if unique:
+            #### Row number in hex, padded with random characters
+            return lambda rng, i: _unique_string(name, start + i, length, rng)
+        return lambda rng, i: "".join(rng.choices(_ALPHABET, k=rng.randint(1, min(length, 32))))
+
+    if kind in ("TEXT", "LONGTEXT"):
+        return lambda rng, i: " ".join(rng.choices(_WORDS, k=rng.randint(3, 40)))
+
+    if kind == "JSON":
+        return lambda rng, i: json.dumps({"id": start + i, "value": rng.random(), "tag": rng.choice(_WORDS)})
+
+    raise ValueError(f"Column {name} has type {kind}, which can't be generated")
+
+
+def _unique_number(name: str, number: int, high: int) -> int:
+    if number > high:
+        raise ValueError(f"Column {name} can't hold more unique values")
+    return number
+
+
+def _unique_string(name: str, number: int, length: int, rng) -> str:
+    key = f"{number:x}"
+    if len(key) > length:
+        raise ValueError(f"Column {name} can't hold more unique values")
+    if length - len(key) < 2:
+        return key
+    return f"{key}-{''.join(rng.choices(_ALPHABET, k=min(length - len(key) - 1, 8)))}"
+
+
+def _unique_start(cursor, table: str, name: str, kind: str) -> int:
+    "Row number to count unique values of a column from, after the values already in the table"
+    if kind in INTEGER_RANGES or kind in ("DECIMAL", "FLOAT"):
+        cursor.execute(f"SELECT COALESCE(MAX(`{name}`), 0) FROM `{table}`;")
+        return int(cursor.fetchall()[0][0]) + 1
+    if kind == "DATETIME":
+        cursor.execute(f"SELECT COALESCE(UNIX_TIMESTAMP(MAX(`{name}`)) - %s, -1) FROM `{table}`;", (DATETIME_START,))
+        return max(int(cursor.fetchall()[0][0]) + 1, 0)
+
+    cursor.execute(f"SELECT COUNT(*) FROM `{table}`;")
+    return int(cursor.fetchall()[0][0])
+
+
+def row_generators(db, table_name: str, table: dict) -> tuple[list, list]:
+    "Columns to insert and their generators. AUTO_INCREMENT columns are left to the server"
+    foreign_keys = {foreign_key["column"]: foreign_key["references"] for foreign_key in table["foreign_keys"]}
+    columns, generators = [], []
+
+    with db.cursor() as cursor:
+        for name, column in table["columns"].items():
+            if column["a_i"]:
+                continue
+
+            unique = column["unique"] or name == table["primary_key"]
+            parent_keys = None
+            if name in foreign_keys:
+                cursor.execute(f"SELECT `{name}` FROM `{foreign_keys[name]}` ORDER BY `{name}` LIMIT %s;", (FOREIGN_KEY_SAMPLE,))
+                parent_keys = [row[0] for row in cursor.fetchall()]
+
+            start = _unique_start(cursor, table_name, name, column["type"]) if unique and parent_keys == None else 0
+            columns.append(name)
+            generators.append(column_generator(name, column, unique, start, parent_keys))
+
+    return columns, generators
+
+
+def seed_table(connections: queue.Queue, workers: int, table_name: str, columns: list, generators: list, rows: int, seed: int, batch_size: int = DEFAULT_BATCH_SIZE) -> LoadResult:
+    """
+    Insert `rows` generated rows into a table with multi-row INSERTs, in jobs of JOB_ROWS rows spread over the connections.
+    Each job commits its rows in a single transaction.
+    """
+    start = time.perf_counter()
+    column_list = ",".join(f"`{column}`" for column in columns)
+    placeholders = "(" + ",".join(["%s"] * len(columns)) + ")"
+
+    def job(first):
+        rng = random.Random(f"{seed}:{table_name}:{first}")
+        connection = connections.get()
+        statements = 0
+        try:
+            connection.start_transaction()
+            with connection.cursor() as cursor:
+                for batch_start in range(first, min(first + JOB_ROWS, rows), batch_size):
+                    count = min(batch_size, rows - batch_start, first + JOB_ROWS - batch_start)
+                    params = []
+                    for i in range(batch_start, batch_start + count):
+                        params.extend(generate(rng, i) for generate in generators)
+                    if len(columns) == 0:
+                        cursor.execute(f"INSERT INTO `{table_name}` () VALUES {','.join(['()'] * count)};")
+                    else:
+                        cursor.execute(f"INSERT INTO `{table_name}` ({column_list}) VALUES {','.join([placeholders] * count)};", tuple(params))
+                    statements += 1
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            connections.put(connection)
+        return statements
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="seed") as executor:
+        statements = sum(executor.map(job, range(0, rows, JOB_ROWS)))
+
+    return {"table": table_name, "rows": rows, "statements": statements, "seconds": time.perf_counter() - start}
+
+
+def seed_database(db, tables: dict, rows: int, seed: int = 0, workers: int = DEFAULT_WORKERS, batch_size: int = DEFAULT_BATCH_SIZE, on_table: Callable | None = None, profile: str | None = None) -> list[LoadResult]:
+    """
+    Fill the tables of a schema model (see schema.replay) with `rows` generated rows each, referenced tables first.
+    The same seed generates the same rows. `on_table` is called with the LoadResult of every table as it finishes.
+    """
+    from src.utils.connect import open_connection
+
+    #### Checked up front, before any row is inserted
+    for name in tables:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s", (db.db_name, name))
+            if cursor.fetchall()[0][0] == 0:
+                raise ValueError(f"Table {name} does not exist in the database")
+
+    connections = queue.Queue()
+    opened = []
+    try:
+        for _ in range(workers):
+            connection = open_connection(profile=profile)
+            if connection == None:
+                raise ValueError("No saved credentials for the database")
+            opened.append(connection)
+            connections.put(connection)
+
+        #### Foreign key values are sampled from the referenced table, checking them again only slows the inserts down
+        for connection in opened:
+            with connection.cursor() as cursor:
+                cursor.execute("SET FOREIGN_KEY_CHECKS = 0;")
+
+        results = []
+        for name in seed_order(tables):
+            columns, generators = row_generators(db, name, tables[name])
+            result = seed_table(connections, workers, name, columns, generators, rows, seed, batch_size)
+            results.append(result)
+            if not on_table == None:
+                on_table(result)
+    finally:
+        for connection in opened:
+            connection.close()
+
+    return results
@@ -0,0 +1,140 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import shlex
+
+from src import __app_name__
+from src.utils import globals
+from src.utils.common import console
+from src.utils.decorators import connection_check
+
+HISTORY_LENGTH = 1000
+
+EXIT_COMMANDS = ("exit", "quit")
+
+#### Commands that make no sense inside the shell
+EXCLUDED_COMMANDS = ("shell", "daemon")
+
+
+def _setup_readline(commands: list):
+    "Load the command history and enable tab completion, None when readline is not available (Windows)"
+    try:
+        import readline
+    except ImportError:
+        return None
+
+    try:
+        readline.read_history_file(globals.HISTORY_PATH)
+    except OSError:
+        pass
+
+    readline.set_history_length(HISTORY_LENGTH)
+    readline.set_completer(lambda text, state: ([c for c in commands if c.startswith(text)] + [None])[state])
+    readline.parse_and_bind("tab: complete")
+
+    return readline
+
+
+def _command_names() -> list:
+    import typer
+
+    from src import cli
+
+    return [name for name in typer.main.get_command(cli.app).commands if not name in EXCLUDED_COMMANDS]
+
+
+def run_command(args: list) -> int:
+    "Run a command of the CLI in this process, returns its exit code"
+    from click.exceptions import Abort, ClickException
+
+    from src import cli
+
+    if args and args[0] in EXCLUDED_COMMANDS:
+        console.print(f"[yellow]{args[0]} can not be used inside the shell[/yellow]\n")
+        return 1
+
+    try:
+        code = cli.app(args, prog_name=__app_name__, standalone_mode=False)
+    except ClickException as e:
+        e.show()
+        return e.exit_code
+    except Abort:
+        print()
+        return 1
+
+    return code if isinstance(code, int) else 0
+
+
+@connection_check()
+def _warm_up():
+    "Connect before the first command, so it doesn't pay for the handshake"
+    console.print(f"[cyan]Connected to database[/cyan] {globals.db.db_name}\n")
+
+
+def run_shell() -> None:
+    """
+    Read commands until exit, running them in this process.
+    The database connection is opened once and reused, `connection_check` pings it before every command.
+    """
+    commands = _command_names()
+    readline = _setup_readline(commands + ["help", *EXIT_COMMANDS])
+
+    console.print(f"[cyan]Type[/cyan] help [cyan]for the available commands,[/cyan] exit [cyan]to leave[/cyan]\n")
+    _warm_up()
+
+    try:
+        while True:
+            try:
+                line = input(f"{__app_name__}> ")
+            except EOFError:
+                print()
+                return
+            except KeyboardInterrupt:
+                print()
+                continue
+
+            try:
+                args = shlex.split(line)
+            except ValueError as e:
+                console.print(f"[red]{e}[/red]")
+                continue
+
+            if len(args) == 0:
+                continue
+
+            if args[0] in EXIT_COMMANDS:
+                return
+
+            if args[0] == "help":
+                args = ["--help"]
+
+            try:
+                run_command(args)
+            except KeyboardInterrupt:
+                console.print("\n[yellow]Interrupted[/yellow]\n")
+
+            #### A failing command should not end the session
+            except Exception as e:
+                console.print(f"[red]{e.msg if hasattr(e, 'msg') else e}[/red]\n")
+
+    finally:
+        if not readline == None:
+            try:
+                readline.write_history_file(globals.HISTORY_PATH)
+            except OSError:
+                pass
+
+        if not globals.db.connection == None:
+            globals.db.connection.close()
@@ -0,0 +1,127 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import TypedDict
+
+from src.utils.globals import CACHE_DIR
+
+#### Metadata of the saved version sources, as of their last refresh
+SOURCES_PATH = os.path.join(CACHE_DIR, "sources.json")
+
+#### Number of sources fetched at the same time
+DEFAULT_WORKERS = 8
+
+
+class SourceMetadata(TypedDict):
+    path: str
+    web: bool
+    template: str | None  ## Root level name
+    latest: str | None  ## `_id` of the highest version
+    versions: int
+    sha256: str | None
+    refreshed: str  ## ISO timestamp
+    stale: bool  ## A web source that could not be reached, the cached copy was used
+    error: str | None
+
+
+def source_metadata(path: str, offline: bool = False) -> SourceMetadata:
+    "Fetch (web) or re-read (local) a version source and describe it, from its version index"
+    from src.utils import http_cache
+    from src.utils.exceptions import VersionSourceUnavailable
+    from src.utils.version_index import load_index
+    from src.utils.version_source import is_web_source
+
+    metadata: SourceMetadata = {"path": path, "web": is_web_source(path), "template": None, "latest": None, "versions": 0, "sha256": None, "refreshed": datetime.now().isoformat(), "stale": False, "error": None}
+
+    try:
+        if metadata["web"]:
+            cached = http_cache.fetch(path, offline=offline)
+            metadata["stale"] = cached.get("stale", False)
+            file = cached["path"]
+        else:
+            file = path
+
+        index = load_index(file)
+    except VersionSourceUnavailable as e:
+        metadata["error"] = e.msg
+        return metadata
+    except OSError as e:
+        metadata["error"] = e.strerror or str(e)
+        return metadata
+    except ValueError:
+        metadata["error"] = "Not a valid version source"
+        return metadata
+
+    numbers = [number for number in index["numbers"] if not number == None]
+    metadata.update(
+        template=index["header"].get("name"),
+        latest=index["ids"][index["numbers"].index(max(numbers))] if len(numbers) > 0 else None,
+        versions=len(index["ids"]),
+        sha256=index["sha256"],
+    )
+
+    return metadata
+
+
+def load_metadata() -> dict:
+    "Metadata of the saved version sources by name, from the last refresh"
+    try:
+        with open(SOURCES_PATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_metadata(metadata: dict) -> None:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix=".tmp-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(metadata, f)
+    os.replace(tmp_path, SOURCES_PATH)
+
+
+def refresh_sources(sources: list, workers: int = DEFAULT_WORKERS, offline: bool = False) -> dict:
+    """
+    Refresh the metadata of (name, path) version sources concurrently, web sources over keep-alive sessions with retries.
+    Sources that fail keep their earlier metadata next to the error. Returns the metadata by name.
+    """
+    previous = load_metadata()
+
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(sources)), 1), thread_name_prefix="sources") as pool:
+        results = dict(zip((name for name, _ in sources), pool.map(lambda source: source_metadata(source[1], offline=offline), sources)))
+
+    for name, metadata in results.items():
+        earlier = previous.get(name)
+        if not metadata["error"] == None and not earlier == None and earlier["path"] == metadata["path"] and not earlier["template"] == None:
+            results[name] = {**earlier, "error": metadata["error"]}
+
+    _save_metadata(results)
+
+    return results
+
+
+def describe_source(name: str, path: str, metadata: SourceMetadata | None) -> str:
+    "Line describing a saved version source, as shown when choosing one"
+    kind = "web" if path[0:4] == "http" else "file"
+    if metadata == None or not metadata["path"] == path or metadata["template"] == None:
+        return f"{name} ({kind})"
+
+    refreshed = datetime.fromisoformat(metadata["refreshed"]).strftime("%Y-%m-%d %H:%M")
+    return f"{name} ({kind}, {metadata['template']} {metadata['latest']}, {metadata['versions']} versions, refreshed {refreshed})"
@@ -0,0 +1,90 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+
+from src.utils.globals import CACHE_DIR
+
+TIMINGS_PATH = os.path.join(CACHE_DIR, "timings.json")
+
+#### Weight of a new measurement in the moving averages
+SMOOTHING = 0.3
+
+#### Estimates used before anything has been measured
+DEFAULT_SECONDS = {"createtable": 0.05, "altertable": 0.5, "default_data": 0.05, "template": 0.01, "version": 0.01}
+DEFAULT_ROWS_PER_SECOND = 20000.0
+
+
+def _average(old: float | None, new: float) -> float:
+    return new if old == None else old + SMOOTHING * (new - old)
+
+
+class Timings:
+    """
+    Durations of earlier updates, stored locally to estimate how long the next one takes.
+    Steps are remembered by template, version, table and method, so a run on staging predicts the run on production.
+    Steps that have never run are estimated from the average of their method.
+    """
+
+    def __init__(self, path: str = TIMINGS_PATH):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.data = {}
+
+        self.data.setdefault("steps", {})
+        self.data.setdefault("methods", {})
+        self.data.setdefault("rows_per_second", None)
+
+    @staticmethod
+    def key(template: str | None, step: dict) -> str:
+        return f"{template}|{step['version']}|{step['table']}|{step['method']}"
+
+    def estimate(self, template: str | None, step: dict) -> float:
+        "Expected duration of a plan step in seconds"
+        known = self.data["steps"].get(self.key(template, step))
+        if not known == None:
+            return known
+
+        if step["method"] == "default_data" and step.get("rows"):
+            return len(step["rows"]) / (self.data["rows_per_second"] or DEFAULT_ROWS_PER_SECOND)
+
+        return self.data["methods"].get(step["method"], DEFAULT_SECONDS.get(step["method"], 0.05))
+
+    def record(self, template: str | None, event: dict) -> None:
+        "Remember the duration of a `step_finished` event"
+        key = self.key(template, event)
+        self.data["steps"][key] = _average(self.data["steps"].get(key), event["seconds"])
+
+        if event["method"] == "default_data":
+            if event["rows"] and event["seconds"] > 0:
+                self.data["rows_per_second"] = _average(self.data["rows_per_second"], event["rows"] / event["seconds"])
+        else:
+            self.data["methods"][event["method"]] = _average(self.data["methods"].get(event["method"]), event["seconds"])
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.data, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
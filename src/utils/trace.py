@@ -0,0 +1,170 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+#### Timeline of a command in the Chrome trace event format, which opens in Perfetto (ui.perfetto.dev) and chrome://tracing
+#### Only imports the standard library, it is used by modules that are loaded on startup
+
+#### Global options that enable tracing, read from the command line before the CLI framework is loaded
+TRACE_OPTION = "--profile"
+PYTHON_PROFILE_OPTION = "--profile-python"
+
+#### Moment the timeline starts
+_origin = 0.0
+
+_lock = threading.Lock()
+_trace = None
+
+
+class _Trace:
+    def __init__(self, path: str, python_path: str | None):
+        self.path = path
+        self.python_path = python_path
+        self.events = []
+        self.threads = set()
+        self.unsubscribe = None
+        self.python_profile = None
+        self.versions = {}  ## Version -> start, versions overlap when steps run concurrently
+
+        if not python_path == None:
+            import cProfile
+
+            self.python_profile = cProfile.Profile()
+            self.python_profile.enable()
+
+    def add(self, event: dict) -> None:
+        thread = threading.current_thread()
+        event.update(pid=os.getpid(), tid=thread.ident)
+        with _lock:
+            if not thread.ident in self.threads:
+                self.threads.add(thread.ident)
+                self.events.append({"name": "thread_name", "ph": "M", "pid": event["pid"], "tid": thread.ident, "args": {"name": thread.name}})
+            self.events.append(event)
+
+
+def _timestamp(moment: float | None = None) -> float:
+    "Microseconds since the start of the timeline"
+    return ((time.perf_counter() if moment == None else moment) - _origin) * 1e6
+
+
+def tracing() -> bool:
+    return not _trace == None
+
+
+def options(argv: list) -> tuple:
+    "Trace file and Python profile file given as global options (before the command) in `argv`"
+    values = {TRACE_OPTION: None, PYTHON_PROFILE_OPTION: None}
+    args = iter(argv)
+    for arg in args:
+        if not arg.startswith("-"):
+            break
+
+        name, _, value = arg.partition("=")
+        if name in values:
+            values[name] = value if not value == "" else next(args, None)
+
+    return values[TRACE_OPTION], values[PYTHON_PROFILE_OPTION]
+
+
+def start(path: str, python_path: str | None = None, started: float | None = None) -> None:
+    """
+    Start recording a timeline to `path`, and a cProfile dump of the Python side to `python_path`.
+    `started` (a `time.perf_counter` value) is recorded as the start of the process. Does nothing when already recording.
+    """
+    global _trace, _origin
+
+    if not _trace == None:
+        return
+
+    from src.utils.events import subscribe
+
+    _origin = time.perf_counter() if started == None else started
+
+    _trace = _Trace(path, python_path)
+    _trace.unsubscribe = subscribe(_on_event)
+
+    if not started == None:
+        _trace.add({"name": "startup", "cat": "startup", "ph": "X", "ts": 0, "dur": _timestamp()})
+
+    atexit.register(stop)
+
+
+def stop() -> str | None:
+    "Stop recording and write the timeline, returns its path"
+    global _trace
+
+    trace = _trace
+    if trace == None:
+        return None
+    _trace = None
+
+    trace.unsubscribe()
+    if not trace.python_profile == None:
+        trace.python_profile.disable()
+        trace.python_profile.dump_stats(trace.python_path)
+
+    with open(trace.path, "w") as f:
+        json.dump({"traceEvents": trace.events, "displayTimeUnit": "ms"}, f)
+
+    return trace.path
+
+
+@contextmanager
+def span(name: str, category: str = "cli", **args) -> Iterator[None]:
+    "Record the time spent in the block, nothing is recorded when not tracing"
+    if _trace == None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = _trace
+        if not trace == None:
+            trace.add({"name": name, "cat": category, "ph": "X", "ts": _timestamp(start), "dur": (time.perf_counter() - start) * 1e6, "args": args})
+
+
+#### Plan events become nested spans, versions containing their statements
+_STATEMENTS = {"createtable": "CREATE TABLE", "altertable": "ALTER TABLE", "default_data": "INSERT INTO", "template": "UPDATE template", "version": "UPDATE version"}
+
+
+def _on_event(event: dict) -> None:
+    trace = _trace
+    if trace == None:
+        return
+
+    match event["event"]:
+        case "plan_started":
+            trace.add({"name": "plan", "cat": "database", "ph": "B", "ts": _timestamp(), "args": {"database": event["database"], "template": event["template"], "steps": event["steps"]}})
+        case "version_started":
+            trace.versions[event["version"]] = _timestamp()
+        case "step_started":
+            name = f"{_STATEMENTS.get(event['method'], event['method'])} {event['table'] or ''}".strip()
+            trace.add({"name": name, "cat": "statement", "ph": "B", "ts": _timestamp()})
+        case "step_finished":
+            trace.add({"ph": "E", "ts": _timestamp(), "args": {"rows": event["rows"]}})
+        case "version_finished":
+            start = trace.versions.pop(event["version"], _timestamp())
+            trace.add({"name": "template" if event["version"] == None else f"version {event['version']}", "cat": "version", "ph": "X", "ts": start, "dur": _timestamp() - start})
+        case "plan_finished":
+            trace.add({"ph": "E", "ts": _timestamp(), "args": {"failed": event["failed"]}})
@@ -0,0 +1,116 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import queue
+import threading
+import time
+from typing import Callable, TypedDict
+
+#### Connections used to truncate tables concurrently
+DEFAULT_WORKERS = 4
+
+
+class TableTiming(TypedDict):
+    table: str
+    seconds: float
+    error: str | None
+
+
+def list_tables(db) -> list:
+    "Base tables of the connected database, without the journal of an interrupted update"
+    from src.utils.journal import JOURNAL_TABLE_NAME
+
+    with db.cursor() as cursor:
+        cursor.execute("SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE'", (db.db_name,))
+        return [row[0] for row in cursor.fetchall() if not row[0] == JOURNAL_TABLE_NAME]
+
+
+def drop_all(db, tables: list) -> float:
+    """
+    Drop all tables in a single statement, with foreign key checks disabled for the session.
+    Metadata locks are taken once for all tables instead of once per table. Returns the time it took.
+    """
+    if len(tables) == 0:
+        return 0
+
+    start = time.perf_counter()
+    with db.cursor() as cursor:
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 0;")
+        try:
+            cursor.execute(f"DROP TABLE IF EXISTS {', '.join(f'`{table}`' for table in tables)};")
+        finally:
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 1;")
+
+    return time.perf_counter() - start
+
+
+def truncate_all(tables: list, workers: int = DEFAULT_WORKERS, on_table: Callable | None = None, profile: str | None = None) -> list[TableTiming]:
+    """
+    Truncate tables concurrently, keeping the schema.
+    Every worker opens its own connection with foreign key checks disabled and takes tables from a shared queue.
+    `on_table` is called with the timing of every table as it finishes.
+    """
+    from src.utils.connect import open_connection
+
+    pending = queue.Queue()
+    for table in tables:
+        pending.put(table)
+
+    results = []
+    lock = threading.Lock()
+
+    def worker(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SET FOREIGN_KEY_CHECKS = 0;")
+
+                while True:
+                    try:
+                        table = pending.get_nowait()
+                    except queue.Empty:
+                        return
+
+                    start = time.perf_counter()
+                    error = None
+                    try:
+                        cursor.execute(f"TRUNCATE TABLE `{table}`;")
+                    except Exception as e:
+                        error = getattr(e, "msg", None) or str(e)
+
+                    timing: TableTiming = {"table": table, "seconds": time.perf_counter() - start, "error": error}
+                    with lock:
+                        results.append(timing)
+                        if not on_table == None:
+                            on_table(timing)
+        finally:
+            connection.close()
+
+    #### Connections are opened up front, so connection errors surface here
+    connections = []
+    try:
+        for _ in range(max(1, min(workers, len(tables)))):
+            connections.append(open_connection(profile=profile))
+    except BaseException:
+        for connection in connections:
+            connection.close()
+        raise
+
+    threads = [threading.Thread(target=worker, args=(connection,), name=f"truncate-{i}") for i, connection in enumerate(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
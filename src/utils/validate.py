@@ -0,0 +1,320 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+from typing import TypedDict
+
+from src.utils.globals import CACHE_DIR
+from src.utils.schema import apply_version
+from src.utils.version_stream import version_number
+
+#### Results are stored per content hash of the version source
+VALIDATION_DIR = os.path.join(CACHE_DIR, "validation")
+
+#### Bump when checks are added or changed, older results are discarded
+VALIDATION_FORMAT = 1
+
+METHODS = ("_id", "createtable", "altertable", "default_data")
+ALTER_OPERATIONS = ("addcolumn", "dropcolumn", "modifycolumn", "renamecolumn", "primary_key")
+
+
+class Issue(TypedDict):
+    level: str  ## error (the update would fail or do something else than intended) or warning
+    version: str | None
+    location: str | None  ## table -> column
+    message: str
+
+
+def _issue(issues: list, level: str, version: str | None, location: str | None, message: str) -> None:
+    issues.append({"level": level, "version": version, "location": location, "message": message})
+
+
+class _Validator:
+    "Single pass over the versions, checking each against the schema model of the versions before it"
+
+    def __init__(self):
+        from typing import get_args
+
+        from alphadb.utils.types import DatabaseColumnType
+        from alphadb.verification.compatibility import incompatible_types_with_autoincrement, incompatible_types_with_unique
+
+        self.types = {kind.upper() for kind in get_args(DatabaseColumnType)}
+        self.no_auto_increment = {kind.upper() for kind in incompatible_types_with_autoincrement}
+        self.no_unique = {kind.upper() for kind in incompatible_types_with_unique}
+
+        self.issues = []
+        self.tables = {}  ## Schema model, see schema.TableModel
+        self.version = None
+
+    def error(self, location: str | None, message: str) -> None:
+        _issue(self.issues, "error", self.version, location, message)
+
+    def warning(self, location: str | None, message: str) -> None:
+        _issue(self.issues, "warning", self.version, location, message)
+
+    def column(self, location: str, definition) -> None:
+        "A column definition, as used by createtable, addcolumn and modifycolumn"
+        if not isinstance(definition, dict):
+            self.error(location, "Column definition must be an object")
+            return
+
+        kind = definition.get("type")
+        if kind == None:
+            self.error(location, "Missing a column type")
+            return
+
+        kind = str(kind).upper()
+        if not kind in self.types:
+            self.error(location, f"Column type {definition['type']} is not supported, use one of {', '.join(sorted(self.types))}")
+
+        length = definition.get("length")
+        if not length == None and (not isinstance(length, int) or isinstance(length, bool) or length < 1):
+            self.error(location, f"Length must be a positive integer, got {length!r}")
+        if kind == "VARCHAR" and length == None:
+            self.error(location, "VARCHAR columns need a length")
+
+        if definition.get("a_i"):
+            if kind in self.no_auto_increment:
+                self.error(location, f"{kind} columns can't be AUTO_INCREMENT")
+            if definition.get("null"):
+                self.error(location, "AUTO_INCREMENT columns can't be NULL")
+
+        if definition.get("unique") and kind in self.no_unique:
+            self.error(location, f"{kind} columns can't be UNIQUE")
+
+    def keys(self, name: str) -> None:
+        "Primary key and AUTO_INCREMENT rules of a table, after a version changed it"
+        table = self.tables[name]
+        columns = table["columns"]
+
+        if not table["primary_key"] == None:
+            if not table["primary_key"] in columns:
+                self.error(name, f"Primary key {table['primary_key']} does not match any column")
+            elif columns[table["primary_key"]]["null"]:
+                self.error(f"{name} -> {table['primary_key']}", "Primary key columns can't be NULL")
+
+        auto_increment = [column for column, model in columns.items() if model["a_i"]]
+        if len(auto_increment) > 1:
+            self.error(name, f"Only one AUTO_INCREMENT column is allowed, found {', '.join(auto_increment)}")
+        for column in auto_increment:
+            if not column == table["primary_key"] and not columns[column]["unique"]:
+                self.error(f"{name} -> {column}", "AUTO_INCREMENT columns must be the primary key or unique")
+
+        for foreign_key in table["foreign_keys"]:
+            if not foreign_key["column"] in columns:
+                self.error(name, f"Foreign key column {foreign_key['column']} does not exist")
+            if not foreign_key["references"] in self.tables:
+                self.error(name, f"Foreign key references table {foreign_key['references']}, which does not exist")
+
+    def createtable(self, createtable: dict) -> None:
+        for name, table_data in createtable.items():
+            if name in self.tables:
+                self.error(name, "Table is created again, it already exists")
+            if not isinstance(table_data, dict) or len(table_data) == 0:
+                self.error(name, "Table has no columns")
+                continue
+
+            for column, definition in table_data.items():
+                if column == "primary_key":
+                    continue
+                if column == "foreign_key":
+                    if not isinstance(definition, dict) or not "key" in definition or not "references" in definition:
+                        self.error(name, "Foreign key needs a key and the table it references")
+                    continue
+                self.column(f"{name} -> {column}", definition)
+
+    def altertable(self, altertable: dict) -> None:
+        for name, table_data in altertable.items():
+            if not name in self.tables:
+                self.error(name, "Table is altered, but it does not exist at this version")
+                continue
+            if not isinstance(table_data, dict):
+                self.error(name, "Alter table data must be an object")
+                continue
+
+            for operation in table_data:
+                if not operation in ALTER_OPERATIONS:
+                    self.error(name, f"Unknown alter table operation '{operation}'")
+
+            columns = set(self.tables[name]["columns"])
+
+            for column in table_data.get("dropcolumn", []):
+                if not column in columns:
+                    self.error(f"{name} -> {column}", "Column is dropped, but it does not exist")
+                columns.discard(column)
+
+            for column, definition in table_data.get("addcolumn", {}).items():
+                if column in columns:
+                    self.error(f"{name} -> {column}", "Column is added, but it already exists")
+                self.column(f"{name} -> {column}", definition)
+                columns.add(column)
+
+            for column, definition in table_data.get("modifycolumn", {}).items():
+                if not column in columns:
+                    self.error(f"{name} -> {column}", "Column is modified, but it does not exist")
+                elif isinstance(definition, dict) and definition.get("recreate") == False:
+                    continue  ## Merged with the current definition, which was checked already
+                self.column(f"{name} -> {column}", definition)
+
+            for old, new in table_data.get("renamecolumn", {}).items():
+                if not old in columns:
+                    self.error(f"{name} -> {old}", "Column is renamed, but it does not exist")
+                elif new in columns and not new == old:
+                    self.error(f"{name} -> {old}", f"Column is renamed to {new}, which already exists")
+                columns.discard(old)
+                columns.add(new)
+
+            #### A primary key of None drops the key
+            if not table_data.get("primary_key") == None and not table_data["primary_key"] in columns:
+                self.error(name, f"Primary key is changed to {table_data['primary_key']}, which does not exist")
+
+    def default_data(self, default_data: dict) -> None:
+        for name, rows in default_data.items():
+            if not name in self.tables:
+                self.error(name, "Default data for a table that does not exist at this version")
+                continue
+            if not isinstance(rows, list):
+                self.error(name, "Default data must be a list of rows")
+                continue
+
+            columns = self.tables[name]["columns"]
+            unknown = set()
+            for row in rows:
+                if not isinstance(row, dict):
+                    self.error(name, "Default data rows must be objects")
+                    break
+                unknown.update(column for column in row if not column in columns)
+
+            for column in sorted(unknown):
+                self.error(f"{name} -> {column}", "Default data for a column that does not exist at this version")
+
+    def run(self, version_source: dict) -> list[Issue]:
+        if not isinstance(version_source, dict):
+            self.error(None, "The version source must be an object")
+            return self.issues
+
+        if not "name" in version_source:
+            self.error(None, "No root level name was specified")
+
+        versions = version_source.get("version", [])
+        if not isinstance(versions, list):
+            self.error(None, "The version list must be a list")
+            return self.issues
+
+        seen = {}
+        previous = None
+        for i, version in enumerate(versions):
+            if not isinstance(version, dict) or not "_id" in version:
+                self.version = f"#{i + 1}"
+                self.error(None, "Missing a version number")
+                continue
+
+            self.version = str(version["_id"])
+            try:
+                number = version_number(self.version)
+            except ValueError:
+                self.error(None, "Version number is not convertible to an integer")
+                continue
+
+            #### AlphaDB compares version numbers with the dots removed, so 0.1.0 and 0.0.10 are the same version
+            if number in seen:
+                self.error(None, f"Duplicate version number, the same as {seen[number]}")
+            elif not previous == None and number < previous:
+                self.error(None, "Version number is lower than the version before it, versions must be in ascending order")
+            seen.setdefault(number, self.version)
+            previous = number if previous == None else max(previous, number)
+
+            if len(version) == 1:
+                self.warning(None, "Version does not contain any changes")
+
+            for method in version:
+                if not method in METHODS:
+                    self.error(None, f"Method '{method}' does not exist")
+
+            self.createtable(version.get("createtable", {}))
+            self.altertable(version.get("altertable", {}))
+
+            #### Keys are checked against the schema as it is after this version
+            try:
+                apply_version(self.tables, version)
+            except (AttributeError, TypeError, KeyError):
+                self.error(None, "Version could not be replayed, its structure is invalid")
+                continue
+            for name in list(version.get("createtable", {})) + list(version.get("altertable", {})):
+                if name in self.tables:
+                    self.keys(name)
+
+            self.default_data(version.get("default_data", {}))
+
+        return self.issues
+
+
+def validate(version_source: dict) -> list[Issue]:
+    "Check a version source before anything is executed, returns the issues found"
+    return _Validator().run(version_source)
+
+
+def _result_path(sha256: str) -> str:
+    return os.path.join(VALIDATION_DIR, f"{sha256}.json")
+
+
+def validate_file(path: str) -> list[Issue]:
+    """
+    Validate a local version source file.
+    Results are cached by the content hash (from the version index), so an unchanged source validates without decoding it.
+    """
+    from src.utils.version_index import file_hash, load_index, read_source
+
+    #### Sources the index can't read are hashed separately, the validation reports what is wrong with them
+    #### Compiled sources too: their index holds the hash of the JSON they were compiled from, which may have changed since
+    try:
+        index = load_index(path)
+        sha256 = file_hash(path) if index["compiled"] else index["sha256"]
+    except ValueError:
+        sha256 = file_hash(path)
+
+    try:
+        with open(_result_path(sha256)) as f:
+            result = json.load(f)
+        if result.get("format") == VALIDATION_FORMAT:
+            return result["issues"]
+    except (FileNotFoundError, ValueError):
+        pass
+
+    try:
+        issues = validate(read_source(path))
+    except ValueError as e:
+        issues = [{"level": "error", "version": None, "location": None, "message": f"Not a readable version source: {e}"}]
+
+    os.makedirs(VALIDATION_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=VALIDATION_DIR, prefix=".tmp-")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"format": VALIDATION_FORMAT, "issues": issues}, f)
+    os.replace(tmp_path, _result_path(sha256))
+
+    return issues
+
+
+def errors(issues: list[Issue]) -> list[Issue]:
+    return [issue for issue in issues if issue["level"] == "error"]
+
+
+def describe(issue: Issue) -> str:
+    "Issue as a line of console markup"
+    where = " -> ".join(part for part in (None if issue["version"] == None else f"Version {issue['version']}", issue["location"]) if not part == None)
+    color = "red" if issue["level"] == "error" else "yellow"
+    return f"[{color}]{issue['level']}[/{color}] [cyan]{where}[/cyan]: {issue['message']}" if where else f"[{color}]{issue['level']}[/{color}] {issue['message']}"
@@ -0,0 +1,248 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import tempfile
+from bisect import bisect_right
+from typing import TypedDict
+
+from src.utils.compiled import is_compiled, read_header, read_payloads
+from src.utils.globals import CACHE_DIR
+from src.utils.trace import span
+from src.utils.version_stream import CHUNK_SIZE, VersionStream, requires_history, version_number
+
+INDEX_DIR = os.path.join(CACHE_DIR, "index")
+
+#### Bump when the layout of the index changes, older indexes are rebuilt
+INDEX_FORMAT = 2
+
+
+class VersionIndex(TypedDict):
+    format: int
+    source: str  ## Absolute path of the indexed file
+    stat: list  ## [mtime_ns, size] of the file when indexed
+    sha256: str  ## Content hash of the file
+    header: dict  ## Root level values other than the version list (name, ...)
+    has_versions: bool
+    ids: list  ## Version `_id`s in document order
+    numbers: list  ## Version numbers (as compared by AlphaDB) in document order
+    spans: list  ## [start, end] byte offsets of every version
+    ordered: bool  ## Whether the version numbers are strictly increasing
+    compiled: bool  ## Whether the file is a compiled version source, with msgpack versions
+
+
+def _index_path(path: str) -> str:
+    return os.path.join(INDEX_DIR, f"{hashlib.sha256(os.path.abspath(path).encode()).hexdigest()}.json")
+
+
+def _stat(path: str) -> list:
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_index(index: VersionIndex) -> None:
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=INDEX_DIR, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, _index_path(index["source"]))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _ordered(numbers: list) -> bool:
+    return not None in numbers and all(a < b for a, b in zip(numbers, numbers[1:]))
+
+
+def compiled_index(path: str, stat: list) -> VersionIndex:
+    "Index of a compiled version source, read from its header. The hash is the one of the JSON it was compiled from"
+    compiled = read_header(path)
+    numbers = compiled["numbers"]
+
+    return {
+        "format": INDEX_FORMAT,
+        "source": os.path.abspath(path),
+        "stat": stat,
+        "sha256": compiled["sha256"],
+        "header": compiled["header"],
+        "has_versions": compiled["has_versions"],
+        "ids": compiled["ids"],
+        "numbers": numbers,
+        "spans": compiled["spans"],
+        "ordered": _ordered(numbers),
+        "compiled": True,
+    }
+
+
+def build_index(path: str) -> VersionIndex:
+    "Index a version source in a single streaming pass"
+    digest = hashlib.sha256()
+    stat = _stat(path)
+
+    with open(path, "rb") as f:
+
+        def chunks():
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                yield chunk
+
+        stream = VersionStream(chunks())
+        ids, numbers, spans = [], [], []
+        for version_id, start, end in stream.entries():
+            ids.append(version_id)
+            numbers.append(None if version_id == None else version_number(version_id))
+            spans.append([start, end])
+
+    index: VersionIndex = {
+        "format": INDEX_FORMAT,
+        "source": os.path.abspath(path),
+        "stat": stat,
+        "sha256": digest.hexdigest(),
+        "header": stream.header,
+        "has_versions": stream.has_versions,
+        "ids": ids,
+        "numbers": numbers,
+        "spans": spans,
+        "ordered": _ordered(numbers),
+        "compiled": False,
+    }
+
+    _write_index(index)
+
+    return index
+
+
+#### Indexes used by this process, long running processes (shell, daemon) skip reading them again
+_loaded = {}
+
+
+def load_index(path: str) -> VersionIndex:
+    "Get the index of a version source, (re)building it when the file changed"
+    stat = _stat(path)
+
+    index = _loaded.get(os.path.abspath(path))
+    if index == None or not index["stat"] == stat:
+        index = compiled_index(path, stat) if is_compiled(path) else _read_index(path, stat)
+        _loaded[index["source"]] = index
+
+    return index
+
+
+def _read_index(path: str, stat: list) -> VersionIndex:
+    try:
+        with open(_index_path(path)) as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return build_index(path)
+
+    if not index.get("format") == INDEX_FORMAT:
+        return build_index(path)
+
+    if stat == index["stat"]:
+        return index
+
+    #### Touched but not changed, only the stat needs updating
+    if file_hash(path) == index["sha256"]:
+        index["stat"] = stat
+        _write_index(index)
+        return index
+
+    return build_index(path)
+
+
+def remove_index(path: str) -> None:
+    _loaded.pop(os.path.abspath(path), None)
+    try:
+        os.unlink(_index_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def pending_positions(index: VersionIndex, current_version: str | None) -> range | list:
+    "Positions (in document order) of the versions newer than `current_version`"
+    if current_version == None:
+        return range(len(index["ids"]))
+
+    current = version_number(current_version)
+
+    #### Binary search when the versions are in order, a linear filter otherwise
+    if index["ordered"]:
+        return range(bisect_right(index["numbers"], current), len(index["ids"]))
+
+    return [i for i, number in enumerate(index["numbers"]) if number == None or number > current]
+
+
+def pending_ids(path: str, current_version: str | None) -> list:
+    "Version `_id`s newer than `current_version`, without decoding any version"
+    index = load_index(path)
+    return [index["ids"][i] for i in pending_positions(index, current_version)]
+
+
+def read_versions(path: str, index: VersionIndex, positions) -> list:
+    "Decode the versions at the given positions, reading only their byte ranges"
+    if index["compiled"]:
+        return read_payloads(path, [index["spans"][i] for i in positions])
+
+    versions = []
+
+    with open(path, "rb") as f:
+        for i in positions:
+            start, end = index["spans"][i]
+            f.seek(start)
+            versions.append(json.loads(f.read(end - start)))
+
+    return versions
+
+
+def read_pending(path: str, current_version: str | None) -> dict:
+    """
+    Read a version source, only decoding the versions newer than `current_version`.
+    Falls back to the full version list when a pending version needs the history to generate its queries.
+    """
+    with span("load version index", "source"):
+        index = load_index(path)
+
+    with span("parse version source", "source", current_version=current_version):
+        pending = read_versions(path, index, pending_positions(index, current_version))
+
+        if any(requires_history(version) for version in pending):
+            pending = read_versions(path, index, range(len(index["ids"])))
+
+    version_source = dict(index["header"])
+    if index["has_versions"]:
+        version_source["version"] = pending
+
+    return version_source
+
+
+def read_source(path: str) -> dict:
+    "Whole version source, JSON or compiled"
+    if is_compiled(path):
+        return read_pending(path, None)
+
+    with open(path) as f:
+        return json.load(f)
@@ -13,39 +13,77 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import json
 import os
 
-from inquirer import Text, prompt
+from inquirer import List, Text, prompt
 from inquirer.errors import ValidationError
-from requests import get
-from requests.exceptions import ConnectionError, JSONDecodeError
 
-from src.utils.common import console
-from src.utils.config import config_get, config_write
+from src.utils import headless, http_cache
+from src.utils.common import clear, console
+from src.utils.config import config_get, config_get_items, config_write
+from src.utils.exceptions import VersionSourceUnavailable
+from src.utils.trace import span
+
+
+def is_web_source(path: str) -> bool:
+    return path[0:4] == "http"
+
+
+def version_source_file(path: str, offline: bool = False) -> str:
+    "Local file holding the version source, web sources are fetched through the HTTP cache"
+
+    if is_web_source(path):
+        with span("fetch version source", "source", url=path, offline=offline):
+            return http_cache.fetch(path, offline=offline)["path"]
+
+    #### `--source` is taken as a path when it is not a saved name
+    if not os.path.isfile(path):
+        raise VersionSourceUnavailable(f"There is no file {path}.")
+
+    return path
+
+
+def version_source_name(path: str, offline: bool = False) -> str:
+    "Template name of a version source"
+
+    from src.utils.version_index import load_index
+
+    #### Read from the index, which also covers compiled version sources
+    if not is_web_source(path):
+        return load_index(path)["header"]["name"]
+
+    #### Unchanged web sources remember their name, so they are not parsed again
+    cached = http_cache.fetch(path, offline=offline)
+    if "name" in cached:
+        return cached["name"]
+
+    name = load_index(cached["path"])["header"]["name"]
+
+    http_cache.remember(path, name=name)
+
+    return name
 
 
 def add_version_source() -> str | None:
     "Adding a new version source to config"
 
     print(
-        "Version sources can either be local JSON files or URL's returning JSON data.\n"
+        "Version sources can either be local JSON files, compiled version sources (see compile) or URL's returning either.\n"
     )
 
-    try:  ## To catch ConnectionError
+    try:
 
         def pathval(path: str):
-            if path[0:4] == "http":
-                r = get(path)
-                if not r.status_code == 200:
-                    raise ValidationError(
-                        "", reason=f"URL responded with {r.status_code}"
-                    )
+            if is_web_source(path):
+                try:
+                    http_cache.fetch(path)
+                except VersionSourceUnavailable as e:
+                    raise ValidationError("", reason=e.msg)
                 return True
 
             if not os.path.isfile(path):
                 raise ValidationError(
-                    "", reason="This path does not point towards a JSON file."
+                    "", reason="This path does not point towards a file."
                 )
             return True
 
@@ -64,24 +102,29 @@ def add_version_source() -> str | None:
 
         path = answers["path"]
 
-        if path[0:4] == "http":
-            template_name = get(path).json()["name"]
-        else:
-            with open(path) as version_json:
-                template_name = json.load(version_json)["name"]
+        #### The validator already fetched web sources, so the cached copy is used without a request
+        template_name = version_source_name(path, offline=True)
 
-    #### TODO This connection error catch does not seem to work
-    except ConnectionError:
-        console.print("\n[red]Unable to establish connection[/red]\n")
+    except VersionSourceUnavailable as e:
+        console.print(f"\n[red]{e.msg}[/red]\n")
         return
 
-    except JSONDecodeError:
+    except (ValueError, KeyError):
         console.print(
             "\n[red]The supplied URL did not respond with compatible data[/red]\n"
         )
         return
 
-    ##### TODO maybe add a check if the data has no errors
+    #### Check the whole source up front, the result is cached so later updates don't have to
+    from src.utils.validate import describe, errors, validate_file
+
+    issues = validate_file(version_source_file(path, offline=True))
+    for issue in issues:
+        console.print(describe(issue), highlight=False)
+
+    if not len(errors(issues)) == 0:
+        console.print(f"\n[red]The version source contains {len(errors(issues))} error{'s' if len(errors(issues)) > 1 else ''}, it was not added[/red]\n")
+        return
 
     questions = [Text("name", message="Name the template", default=template_name)]
     answers = prompt(questions)
@@ -92,10 +135,50 @@ def add_version_source() -> str | None:
 
     name = answers["name"]
 
-    vs = config_get("VERSION_SOURCES", fallback=True)
-    if vs == None:
-        vs = {}
+    vs = dict(config_get("VERSION_SOURCES", fallback=True) or {})
     vs[name] = path
     config_write({"VERSION_SOURCES": vs})
 
     return path
+
+
+def select_version_source(source: str | None = None) -> str | None:
+    "Ask the user which saved version source to use, returns its path. `source` (a saved name, path or URL) skips the question"
+
+    version_sources = config_get_items("VERSION_SOURCES")
+
+    if not source == None:
+        return dict(version_sources).get(source, source)
+
+    headless.require("--source (or ALPHADB_SOURCE)")
+
+    #### If no versions sources exist, ask to create one
+    if len(version_sources) == 0:
+        console.print("[cyan]You have no saved version sources, so let's find one.[/cyan]\n")
+        path = add_version_source()
+        print("\n")
+        if not path == None:
+            return path
+
+    #### Described from the last `sources refresh`, so nothing is fetched while choosing
+    from src.utils.sources import describe_source, load_metadata
+
+    metadata = load_metadata()
+    choices = [(describe_source(name, path, metadata.get(name)), name) for name, path in version_sources]
+    choices.append("+ New version source")
+    questions = [List("version_source", message=f"Fount {len(version_sources)} version sources, which one do you wish to use?", choices=choices)]
+
+    answers = prompt(questions)
+
+    #### If answers is None, user probably aborted
+    if answers == None:
+        return
+
+    version_source = answers["version_source"]
+
+    clear()
+
+    if version_source == "+ New version source":
+        return add_version_source()
+
+    return config_get("VERSION_SOURCES")[version_source]
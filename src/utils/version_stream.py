@@ -0,0 +1,294 @@
+# Copyright (C) 2023 Wibo Kuipers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import re
+from typing import BinaryIO, Iterable, Iterator
+
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(rb"[ \t\n\r]*")
+#### A complete string (group 1 is the closing quote, missing when the chunk ends inside the string) or a bracket
+_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*(")?|[\[\]{}]', re.S)
+_STRING_END = re.compile(rb'["\\]')
+_SCALAR = re.compile(rb"[^ \t\n\r,\]}]*")
+
+
+def version_number(version: str) -> int:
+    "Version number as compared by AlphaDB (dots removed, parsed as integer)"
+    return int(version.replace(".", ""))
+
+
+def requires_history(version: dict) -> bool:
+    """
+    Whether AlphaDB needs earlier versions to generate the queries for this one.
+    Primary key changes and non-recreating column modifications are resolved against the full history.
+    """
+    for table in version.get("altertable", {}).values():
+        if "primary_key" in table:
+            return True
+
+        for column in table.get("modifycolumn", {}).values():
+            if isinstance(column, dict) and column.get("recreate") == False:
+                return True
+
+    return False
+
+
+class VersionStream:
+    """
+    Incremental reader for version sources.
+
+    Walks the document chunk by chunk and hands out the entries of the `version` array one at a time.
+    Entries are only decoded when asked for, skipped entries are scanned for their `_id` and discarded,
+    so memory use is bound by the size of a single entry.
+    All other root level keys (`name`, ...) are collected in `header`.
+    """
+
+    def __init__(self, source: BinaryIO | Iterable[bytes], chunk_size: int = CHUNK_SIZE):
+        if hasattr(source, "read"):
+            self._chunks = iter(lambda: source.read(chunk_size), b"")
+        else:
+            self._chunks = iter(source)
+
+        self.buf = b""
+        self.pos = 0
+        self.offset = 0  ## Absolute position of buf[0] in the document
+        self.mark = None  ## Buffer position that must be retained when refilling
+        self.eof = False
+
+        self.header = {}
+        self.has_versions = False  ## Whether a `version` array was found
+
+    #### Buffer handling
+
+    def _fill(self) -> bool:
+        "Read the next chunk, dropping everything that has been consumed"
+        keep = self.pos if self.mark == None else min(self.pos, self.mark)
+        if keep:
+            self.buf = self.buf[keep:]
+            self.offset += keep
+            self.pos -= keep
+            if not self.mark == None:
+                self.mark -= keep
+
+        chunk = next(self._chunks, b"")
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buf += chunk
+        return True
+
+    def _peek(self) -> int:
+        while self.pos >= len(self.buf):
+            if not self._fill():
+                raise ValueError("Unexpected end of version source")
+        return self.buf[self.pos]
+
+    def _skip_whitespace(self) -> None:
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self._fill():
+                return
+
+    def _expect(self, char: bytes) -> None:
+        self._skip_whitespace()
+        if not self._peek() == char[0]:
+            raise ValueError(f"Expected {char.decode()} at position {self.offset + self.pos} of version source")
+        self.pos += 1
+
+    #### Tokens
+
+    def _skip_string(self) -> None:
+        "Skip a string, pos must be at its opening quote"
+        self.pos += 1
+        while True:
+            match = _STRING_END.search(self.buf, self.pos)
+            if match == None:
+                self.pos = len(self.buf)
+                self._peek()
+                continue
+
+            if match.group() == b"\\":
+                #### Skip the escaped character, which might be in the next chunk
+                self.pos = match.end()
+                self._peek()
+                self.pos += 1
+                continue
+
+            self.pos = match.end()
+            return
+
+    def _read_string(self) -> str:
+        "Decode a string, pos must be at its opening quote"
+        outer_mark = self.mark
+        if outer_mark == None:
+            self.mark = self.pos
+
+        #### Relative to the mark, which moves along when the buffer is refilled
+        start = self.pos - self.mark
+        self._skip_string()
+        value = json.loads(self.buf[self.mark + start : self.pos])
+
+        if outer_mark == None:
+            self.mark = None
+
+        return value
+
+    def _skip_value(self) -> None:
+        "Skip any value, without decoding it"
+        self._skip_whitespace()
+        char = self._peek()
+
+        if char == ord('"'):
+            self._skip_string()
+            return
+
+        if not char in b"[{":
+            while True:
+                self.pos = _SCALAR.match(self.buf, self.pos).end()
+                if self.pos < len(self.buf) or not self._fill():
+                    return
+
+        #### Let the regex engine consume whole strings, only brackets outside of strings are counted
+        depth = 0
+        while True:
+            for match in _TOKEN.finditer(self.buf, self.pos):
+                token = self.buf[match.start()]
+
+                if token == ord('"'):
+                    if match.group(1) == None:
+                        self.pos = match.start()  ## Incomplete string, retry when the next chunk is in
+                        break
+                    continue
+
+                if token in b"[{":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        self.pos = match.end()
+                        return
+            else:
+                self.pos = len(self.buf)
+
+            if not self._fill():
+                raise ValueError("Unexpected end of version source")
+
+    #### Document
+
+    def _object_id(self) -> str | None:
+        "Scan an object for its `_id`, skipping all other values"
+        version_id = None
+
+        self._expect(b"{")
+        self._skip_whitespace()
+        if self._peek() == ord("}"):
+            self.pos += 1
+            return None
+
+        while True:
+            self._skip_whitespace()
+            key = self._read_string()
+            self._expect(b":")
+            self._skip_whitespace()
+
+            if key == "_id" and self._peek() == ord('"'):
+                version_id = self._read_string()
+            else:
+                self._skip_value()
+
+            self._skip_whitespace()
+            if self._peek() == ord(","):
+                self.pos += 1
+                continue
+
+            self._expect(b"}")
+            return version_id
+
+    def entries(self) -> Iterator[tuple[str | None, int, int]]:
+        """
+        Yield (`_id`, start, end) for every entry of the `version` array, start and end being byte offsets in the document.
+        While the generator is paused on an entry, its raw bytes are available through `entry_bytes`.
+        """
+        self._expect(b"{")
+        self._skip_whitespace()
+        if self._peek() == ord("}"):
+            return
+
+        while True:
+            self._skip_whitespace()
+            key = self._read_string()
+            self._expect(b":")
+            self._skip_whitespace()
+
+            if key == "version" and self._peek() == ord("["):
+                self.has_versions = True
+                self.pos += 1
+
+                self._skip_whitespace()
+                if self._peek() == ord("]"):
+                    self.pos += 1
+                else:
+                    while True:
+                        self._skip_whitespace()
+                        self.mark = self.pos
+                        version_id = self._object_id()
+
+                        self._entry = (self.mark, self.pos)
+                        yield version_id, self.offset + self.mark, self.offset + self.pos
+                        self.mark = None
+
+                        self._skip_whitespace()
+                        if self._peek() == ord(","):
+                            self.pos += 1
+                            continue
+
+                        self._expect(b"]")
+                        break
+
+            #### Other root level values are small, decode them
+            else:
+                self.mark = self.pos
+                self._skip_value()
+                self.header[key] = json.loads(self.buf[self.mark : self.pos])
+                self.mark = None
+
+            self._skip_whitespace()
+            if self._peek() == ord(","):
+                self.pos += 1
+                continue
+
+            self._expect(b"}")
+            return
+
+    def entry_bytes(self) -> bytes:
+        "Raw bytes of the entry the `entries` generator is paused on"
+        start, end = self._entry
+        return self.buf[start:end]
+
+    def versions(self, after: str | None = None) -> Iterator[dict]:
+        "Yield decoded versions, skipping those at or below version `after` without decoding them"
+        after_number = None if after == None else version_number(after)
+
+        for version_id, _, _ in self.entries():
+            if not after_number == None and not version_id == None and version_number(version_id) <= after_number:
+                continue
+
+            yield json.loads(self.entry_bytes())
+